@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption('--performance', action='store_true', default=False,
+                     help='run the performance regression tests (also DI245_PERFORMANCE=1)')
+    parser.addoption('--update-baselines', action='store_true', default=False,
+                     help='run the performance tests and overwrite the stored baselines with the measured values')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'performance: performance regression test against stored baselines, '
+                                       'skipped unless --performance is given')
+
+
+def pytest_collection_modifyitems(config, items):
+    if (config.getoption('--performance') or config.getoption('--update-baselines') or
+            os.environ.get('DI245_PERFORMANCE', '') not in ('', '0')):
+        return
+    skip = pytest.mark.skip(reason='performance test, run with --performance or DI245_PERFORMANCE=1')
+    for item in items:
+        if 'performance' in item.keywords:
+            item.add_marker(skip)
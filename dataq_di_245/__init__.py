@@ -1,4 +1,15 @@
+import sys
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+if sys.version_info < (3, 7):
+    from ._version import get_versions
+    __version__ = get_versions()['version']
+    del get_versions
+else:
+    def __getattr__(name):
+        # versioneer may run git to find the version, so it is only done when asked for
+        if name == '__version__':
+            from ._version import get_versions
+            globals()['__version__'] = get_versions()['version']
+            return globals()['__version__']
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+del sys
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Automatic range selection for the voltage channels of the DI-245.
+
+AutoRange watches the per-channel minimum and maximum counts over a window of
+samples and proposes the tightest range of the gain table (conversion.ranges)
+that holds the observed peak with some headroom:
+
+    peak = max(|min|, |max|)/2**13 * full scale of the current range
+    new range = smallest range with peak <= headroom * full scale
+
+A channel that reached the rails (within margin counts of -8192 or 8191) is
+clipped, its real peak is unknown, so it steps up to the smallest range that
+is larger than the current full scale by at least 1/headroom. Thermocouple
+channels are never changed.
+
+The reconfiguration itself, a brief stop of the scan, is done by
+Device.change_ranges; the interruption is recorded in Device.timebase as a
+gap segment that carries the new gain list. The gains in effect are
+Device.active_gain_lst, the saved gain_lst setting is not changed, so every
+start programs the configured ranges again.
+
+Examples
+--------
+>>> autorange = AutoRange(['5','5','5','T-thrmc'], window = 2000, headroom = 0.8)
+>>> autorange.update(value_array)   # None until the window is complete
+['0.5', '5', '25', 'T-thrmc']
+
+Valentyn Stadnytskyi
+"""
+from dataq_di_245.conversion import ranges
+
+full_scale = sorted(ranges.values())
+range_names = {value: name for name, value in ranges.items()}
+
+
+class AutoRange(object):
+    """
+    proposes the tightest range per channel from the observed signal
+    """
+    def __init__(self, gain_lst, window = 1000, headroom = 0.8, margin = 16, channels = None):
+        """
+        Parameters
+        ----------
+        gain_lst :: list
+            current gains, one per scan list member
+        window :: integer
+            number of samples observed before a proposal is made
+        headroom :: float
+            fraction of the full scale the observed peak may use, 0 < headroom <= 1
+        margin :: integer
+            counts from the rails that are considered clipped
+        channels :: list, optional
+            scan list members that are ranged automatically, default all
+            voltage channels
+        """
+        if not 0 < headroom <= 1:
+            raise ValueError('headroom must be in (0, 1], got {}'.format(headroom))
+        self.gain_lst = list(gain_lst)
+        self.window = window
+        self.headroom = headroom
+        self.margin = margin
+        self.channels = channels
+        self.changes = 0
+        self.reset()
+
+    def reset(self):
+        """
+        starts a new observation window
+        """
+        self.count = 0
+        self.low = None
+        self.high = None
+
+    def update(self, value_array):
+        """
+        adds a packet, (N points x N channels) counts with the offset removed
+
+        Returns
+        -------
+        gain_lst :: list or None
+            new gains at the end of a window if any channel should change
+        """
+        from numpy import minimum, maximum
+        if value_array.shape[0] == 0:
+            return None
+        low = value_array.min(axis = 0)
+        high = value_array.max(axis = 0)
+        if self.low is None:
+            self.low, self.high = low, high
+        else:
+            self.low = minimum(self.low, low)
+            self.high = maximum(self.high, high)
+        self.count += value_array.shape[0]
+        if self.count < self.window:
+            return None
+        gain_lst = self.select(self.low, self.high)
+        self.reset()
+        if gain_lst == self.gain_lst:
+            return None
+        return gain_lst
+
+    def select(self, low, high):
+        """
+        returns the gain list for per-channel minimum and maximum counts
+        """
+        gain_lst = list(self.gain_lst)
+        for i, gain in enumerate(self.gain_lst):
+            if gain not in ranges or (self.channels is not None and i not in self.channels):
+                continue
+            current = ranges[gain]
+            if low[i] <= -8192 + self.margin or high[i] >= 8191 - self.margin:
+                peak = current
+            else:
+                peak = max(-int(low[i]), int(high[i]))/2**13*current
+            candidates = [value for value in full_scale if peak <= self.headroom*value and
+                          (peak < current or value > current)]
+            gain_lst[i] = range_names[candidates[0] if candidates else full_scale[-1]]
+        return gain_lst
+
+    def set_gains(self, gain_lst):
+        """
+        the device was reconfigured with gain_lst, starts a new window
+        """
+        if list(gain_lst) != self.gain_lst:
+            self.changes += 1
+        self.gain_lst = list(gain_lst)
+        self.reset()
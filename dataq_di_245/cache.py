@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Persistent cache of per-device information for fast warm starts.
+
+The cache lives next to the SavedProperty DataBase of the Device and is keyed
+by the USB serial number of the DI-245. For every device it keeps
+
+    description  the replies to the A1, A2, A7 and NZ queries
+    config_hash  hash of the last channel configuration written to the device
+
+On warm start Driver.init takes the description from the cache instead of
+querying the device, and Device.configure_device skips config_channels if the
+configuration hash is unchanged. The DI-245 keeps its configuration only
+while powered, so the entry is invalidated whenever the device is lost.
+
+Devices share the file: every update rereads it and merges the entry of one
+device under a lock, so concurrent writers (the devices of a DeviceGroup,
+several DeviceCache instances) do not overwrite each other. shared_cache()
+is the default cache of all devices of the process.
+
+Examples
+--------
+>>> cache = DeviceCache()
+>>> cache.set_description('56671FE4A', driver.description)
+>>> cache.get_description('56671FE4A')
+{'Device name': b'2450', 'Firmware version': b'6B', ...}
+
+Valentyn Stadnytskyi
+"""
+from threading import RLock
+from time import time
+
+lock = RLock()
+_shared = {}
+
+
+def config_hash(*args):
+    """
+    returns a stable hash of the configuration arguments
+
+    Examples
+    --------
+    >>> config_hash(['0','1'], ['0','1'], ['5','5'], b'xrate 4099 2000 \\x0D')
+    'b182d2c514575de6aa9aef50f6b1d63026bfe3a4'
+    """
+    from hashlib import sha1
+    return sha1(repr(args).encode('utf-8')).hexdigest()
+
+
+def shared_cache(root = 'TEMP', name = 'dataq_di_245_cache'):
+    """
+    returns the DeviceCache of the process for root and name
+    """
+    with lock:
+        if (root, name) not in _shared:
+            _shared[root, name] = DeviceCache(root = root, name = name)
+        return _shared[root, name]
+
+
+class DeviceCache(object):
+    def __init__(self, root = 'TEMP', name = 'dataq_di_245_cache'):
+        """
+        Parameters
+        ----------
+        root :: str
+            DataBase root, 'TEMP' places it next to the Device DataBase
+        name :: str
+            DataBase name
+        """
+        from ubcs_auxiliary.saved_property import DataBase
+        self.db = DataBase(root = root, name = name)
+
+    def get(self, serial_number):
+        """
+        returns the cache entry of the device, empty dictionary if there is none
+        """
+        if serial_number is None:
+            return {}
+        return dict(self.db.database.get(str(serial_number), {}))
+
+    def _modify(self, serial_number, function):
+        """
+        rereads the file, replaces the entry of the device with
+        function(entry) and writes the file, all under the lock
+        """
+        if serial_number is None:
+            return
+        with lock:
+            self.db.database = self.db.read() or {}
+            entry = function(self.get(serial_number))
+            self.db.database[str(serial_number)] = entry
+            self.db.write()
+
+    def _update(self, serial_number, **kwargs):
+        def update(entry):
+            entry.update(kwargs)
+            entry['time'] = time()
+            return entry
+        self._modify(serial_number, update)
+
+    def get_description(self, serial_number):
+        return self.get(serial_number).get('description')
+
+    def set_description(self, serial_number, description):
+        self._update(serial_number, description = dict(description))
+
+    def get_config_hash(self, serial_number):
+        return self.get(serial_number).get('config_hash')
+
+    def set_config_hash(self, serial_number, value):
+        self._update(serial_number, config_hash = value)
+
+    def invalidate(self, serial_number, description = False):
+        """
+        forgets the configuration hash (and the description) of the device
+        """
+        def invalidate(entry):
+            entry.pop('config_hash', None)
+            if description:
+                entry.pop('description', None)
+            return entry
+        self._modify(serial_number, invalidate)
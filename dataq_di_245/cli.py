@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Command line interface of the DI-245 package, installed as "di245".
+
+    di245 list                          DI-245 connected to the host
+    di245 info [-s SN]                  description of the device
+    di245 stream [-s SN] [options]      stream data to stdout
+    di245 record FILE [-s SN] [options] record data into a recording file
+    di245 bench [benchmark options]     acquisition pipeline benchmarks
+
+stream writes every packet to stdout as it arrives:
+
+    --format raw        the DI-245 byte stream as read from the port
+    --format binary     little-endian int16 counts (offset removed), or
+                        float64 Volts / degrees C with --units
+    --format csv        time and one column per channel
+
+record writes the recording format of dataq_di_245.recording, compressed with
+--codec (see dataq_di_245.codec, 'raw' for uncompressed int16). Both report the
+sustained rate and the number of dropped scans on stderr when they finish.
+Both read the stream with Driver.iter_raw_packets: dropped scans are detected
+by the sync bits, the stream is realigned and acquisition continues.
+
+--emulator runs on the DI-245 emulator instead of the hardware. --replay FILE
+streams a recording (or, with --rate, a raw byte stream) through the same read
+path at --speed times the recorded rate (0 is as fast as possible) and ends
+with the recording; the channels and gains of a recording are its own.
+--points auto adapts the packet size to the measured rate (see
+driver.PacketSizer) and reports the operating point.
+
+Examples
+--------
+$ di245 stream --duration 10 --format csv --units > data.csv
+$ di245 record data.di245 --duration 3600 --channels 0 1 --gains 5 T-thrmc
+$ di245 stream --format binary | consumer
+$ di245 stream --replay data.di245 --speed 10 --format binary | consumer
+
+Valentyn Stadnytskyi
+"""
+import sys
+
+
+def new_driver(args):
+    if args.replay:
+        from dataq_di_245.replay import ReplayDriver
+        channels = getattr(args, 'channels', None) or ['0','1','2','3']
+        N_of_channels = len(channels) if args.rate else None
+        return ReplayDriver(args.replay, speed = args.speed or None, N_of_channels = N_of_channels,
+                            rate = args.rate)
+    if args.emulator:
+        from dataq_di_245.emulator import EmulatedDriver
+        return EmulatedDriver(args.serial_number or 'EMULATED0', rate = args.emulator_rate)
+    from dataq_di_245.driver import Driver
+    return Driver()
+
+
+def new_cache(args):
+    if args.no_cache:
+        return None
+    from dataq_di_245.cache import DeviceCache
+    return DeviceCache()
+
+
+def open_device(args):
+    """
+    returns initialized driver, exits if the device is not found
+    """
+    driver = new_driver(args)
+    if not driver.init(args.serial_number or None, cache = new_cache(args)):
+        sys.exit('DI-245 {}is not found'.format(args.serial_number + ' ' if args.serial_number else ''))
+    return driver
+
+
+def configure(driver, args):
+    """
+    writes the channel configuration of args to the device, skipped if the
+    device cache shows it is already configured
+    """
+    from dataq_di_245.config import ScanConfig
+    phys_ch_lst = args.channels
+    gain_lst = args.gains
+    if args.replay and driver.source.header.get('gain_lst'):
+        phys_ch_lst = driver.source.header['phys_ch_lst']
+        gain_lst = driver.source.header['gain_lst']
+    scan_lst = [str(i) for i in range(len(phys_ch_lst))]
+    if len(gain_lst) == 1:
+        gain_lst = gain_lst*len(phys_ch_lst)
+    if len(gain_lst) != len(phys_ch_lst):
+        sys.exit('{} gains given for {} channels'.format(len(gain_lst), len(phys_ch_lst)))
+    try:
+        config = ScanConfig(scan_lst, phys_ch_lst, gain_lst, xrate_command = driver.xrate_command)
+    except ValueError as exception:
+        sys.exit(str(exception))
+    current_hash = config.digest
+    cache = driver.cache
+    if cache is None or cache.get_config_hash(driver.serial_number) != current_hash:
+        success, result = driver.config_channels(config = config)
+        if cache is not None:
+            if all(result):
+                cache.set_config_hash(driver.serial_number, current_hash)
+            else:
+                cache.invalidate(driver.serial_number)
+    return scan_lst, phys_ch_lst, gain_lst
+
+
+def list_devices(args):
+    for port in new_driver(args).available_ports:
+        print('{}\t{}\t{}'.format(*port))
+
+
+def show_info(args):
+    driver = open_device(args)
+    if args.refresh:
+        driver.refresh_description()
+    print('port\t{}'.format(getattr(driver.port, 'port', driver.port)))
+    for key, value in driver.description.items():
+        if isinstance(value, bytes):
+            value = value.decode('Latin-1')
+        print('{}\t{}'.format(key, value))
+    driver.close()
+
+
+def new_sizer(args):
+    """
+    returns PacketSizer if the packet size is 'auto', None otherwise
+    """
+    from dataq_di_245.driver import PacketSizer
+    if args.points == 'auto':
+        args.points = 100
+        return PacketSizer()
+    return None
+
+
+def report(driver, sizer = None):
+    """
+    prints the stream counters and the operating point of the packet sizer to stderr
+    """
+    stats = driver.stream_stats
+    if stats is not None:
+        print(stats.summary(), file = sys.stderr)
+    if sizer is not None and sizer.rate:
+        point = sizer.operating_point()
+        print('packet size {points_per_packet} scans, {packets_per_second:.1f} packets/s, '
+              '{latency:.4f} s latency, {catch_up} backlog reads'.format(**point), file = sys.stderr)
+
+
+def points(value):
+    """
+    --points argument: integer or 'auto'
+    """
+    if value == 'auto':
+        return value
+    return int(value)
+
+
+def replay_finished(driver, args):
+    """
+    returns the abort function of a replay: True after the last sample
+    """
+    if not args.replay:
+        return None
+    return lambda: driver.finished
+
+
+def stream(args):
+    from numpy import arange, savetxt
+    from dataq_di_245.driver import decode
+    from dataq_di_245.conversion import to_units
+    from dataq_di_245.timebase import Timebase
+    driver = open_device(args)
+    scan_lst, phys_ch_lst, gain_lst = configure(driver, args)
+    N_of_channels = len(scan_lst)
+    timebase = Timebase()
+    output = sys.stdout.buffer
+    sizer = new_sizer(args)
+    packets = driver.iter_raw_packets(args.points, N_of_channels = N_of_channels, duration = args.duration,
+                                      sizer = sizer, abort = replay_finished(driver, args))
+    try:
+        for index, t, raw in packets:
+            N_of_points = len(raw)//(2*N_of_channels)
+            if len(timebase.segments) == 0:
+                timebase.start(0, driver.stream_stats.t_start)
+            timebase.update(index + N_of_points - 1, t)
+            if args.format == 'raw':
+                output.write(raw)
+            else:
+                value_array = decode(raw, N_of_channels).T - 8192
+                if args.units:
+                    value_array = to_units(value_array, gain_lst)
+                if args.format == 'binary':
+                    output.write(value_array.astype('<f8' if args.units else '<i2').tobytes())
+                else:
+                    times = timebase.time_of(index + arange(N_of_points))
+                    rows = value_array.astype('float64') if args.units else value_array
+                    savetxt(output, [[ti] + list(row) for ti, row in zip(times, rows)],
+                            fmt = ['%.6f'] + ['%.6g' if args.units else '%d']*N_of_channels, delimiter = ',')
+            output.flush()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        packets.close()
+        driver.close()
+    report(driver, sizer)
+    return driver.stream_stats
+
+
+def record(args):
+    from dataq_di_245.driver import decode
+    from dataq_di_245.recording import Recorder
+    from dataq_di_245.timebase import Timebase
+    driver = open_device(args)
+    scan_lst, phys_ch_lst, gain_lst = configure(driver, args)
+    N_of_channels = len(scan_lst)
+    timebase = Timebase()
+    recorder = Recorder(args.output, N_of_channels = N_of_channels, serial_number = driver.serial_number,
+                        scan_lst = scan_lst, phys_ch_lst = phys_ch_lst, gain_lst = gain_lst, codec = args.codec)
+    sizer = new_sizer(args)
+    packets = driver.iter_raw_packets(args.points, N_of_channels = N_of_channels, duration = args.duration,
+                                      sizer = sizer, abort = replay_finished(driver, args))
+    try:
+        for index, t, raw in packets:
+            N_of_points = len(raw)//(2*N_of_channels)
+            if len(timebase.segments) == 0:
+                timebase.start(0, driver.stream_stats.t_start)
+            timebase.update(index + N_of_points - 1, t)
+            recorder.write(decode(raw, N_of_channels).T - 8192, sequence = index,
+                           t = timebase.time_of(index), rate = timebase.rate)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        packets.close()
+        recorder.close()
+        driver.close()
+    report(driver, sizer)
+    return driver.stream_stats
+
+
+def bench(args):
+    from dataq_di_245.serialization_benchmarks import main as bench_main
+    return bench_main(args.arguments)
+
+
+def parser():
+    from argparse import ArgumentParser, REMAINDER
+    parser = ArgumentParser(prog = 'di245', description = 'DATAQ DI-245 data acquisition')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    def device_options(command):
+        command.add_argument('-s', '--serial-number', dest = 'serial_number', default = '',
+                             help = 'USB serial number, default is the first DI-245 found')
+        command.add_argument('--no-cache', action = 'store_true', help = 'do not use the device cache')
+        command.add_argument('--emulator', action = 'store_true', help = 'use the DI-245 emulator')
+        command.add_argument('--emulator-rate', type = float, default = None,
+                             help = 'emulator rate, scans per second, default free running')
+        command.add_argument('--replay', default = None, metavar = 'FILE',
+                             help = 'replay a recording (or a raw stream, see --rate) instead of a device')
+        command.add_argument('--speed', type = float, default = 1.0,
+                             help = 'replay speed, multiple of the recorded rate, 0 is as fast as possible')
+        command.add_argument('--rate', type = float, default = None,
+                             help = 'the replayed FILE is a raw byte stream recorded at RATE scans per second')
+
+    def acquisition_options(command):
+        device_options(command)
+        command.add_argument('--channels', nargs = '+', default = ['0','1','2','3'],
+                             help = 'physical channels in scan order')
+        command.add_argument('--gains', nargs = '+', default = ['5'],
+                             help = 'gain (range) per channel, a single value applies to all channels')
+        command.add_argument('--points', type = points, default = 100,
+                             help = "scans per packet, 'auto' adapts to the rate and the backlog")
+        command.add_argument('--duration', type = float, default = None,
+                             help = 'seconds, default until interrupted')
+
+    command = commands.add_parser('list', help = 'list DI-245 connected to the host')
+    device_options(command)
+    command.set_defaults(function = list_devices)
+
+    command = commands.add_parser('info', help = 'show device description')
+    device_options(command)
+    command.add_argument('--refresh', action = 'store_true', help = 'query the device, bypass the cache')
+    command.set_defaults(function = show_info)
+
+    command = commands.add_parser('stream', help = 'stream data to stdout')
+    acquisition_options(command)
+    command.add_argument('--format', choices = ['raw', 'binary', 'csv'], default = 'csv')
+    command.add_argument('--units', action = 'store_true', help = 'convert counts to Volts or degrees C')
+    command.set_defaults(function = stream)
+
+    command = commands.add_parser('record', help = 'record data into a file')
+    command.add_argument('output', help = 'recording file')
+    acquisition_options(command)
+    command.add_argument('--codec', default = 'delta+zlib:1', help = 'codec of the chunks, e.g. raw, delta+lzma:0')
+    command.set_defaults(function = record)
+
+    command = commands.add_parser('bench', help = 'run acquisition pipeline benchmarks')
+    command.add_argument('arguments', nargs = REMAINDER, help = 'arguments of the benchmarks')
+    command.set_defaults(function = bench)
+    return parser
+
+
+def main(argv = None):
+    """
+    runs the command of argv and returns the exit status, 0 on success; the
+    command functions themselves return their results (StreamStats of stream
+    and record, the results of bench)
+    """
+    import logging
+    logging.basicConfig(level = logging.WARNING, format = "%(asctime)s %(levelname)s: %(message)s")
+    args = parser().parse_args(argv)
+    args.function(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Lossless codec for blocks of DI-245 counts.
+
+A block is a (N points x N channels) array of 14-bit counts with the offset
+removed (-8192..8191). The codec is a chain of stages given by a string,
+e.g. 'delta+pack14+zlib:1':
+
+    delta       per-channel differences of consecutive samples, modulo 2**14,
+                zigzag mapped to 0..16383 so that small changes of either sign
+                become small numbers. Neighbouring samples differ little, so
+                most codes fit in one byte.
+    pack14      four 14-bit codes in 7 bytes instead of 8: drops the 2 unused
+                bits of every 16-bit word
+    zlib[:L]    zlib.compress with level L (default 1)
+    lzma[:P]    lzma.compress with preset P (default 0)
+    raw         no stage, little-endian int16 (the recording format default)
+
+The integer stages are vectorized with NumPy. Every block is encoded on its
+own, so blocks (recording chunks, network messages) can be decoded in any
+order. The compressors do better on byte aligned codes; 'delta+zlib:1' is a
+good default, pack14 alone gives a fixed 12.5% without a compressor. See
+bench_codec in serialization_benchmarks for measured ratios and throughput.
+
+Examples
+--------
+>>> codec = Codec('delta+zlib:1')
+>>> payload = codec.encode(value_array)
+>>> codec.decode(payload, N_of_points = value_array.shape[0], N_of_channels = 4)
+
+Valentyn Stadnytskyi
+"""
+stages = ('delta', 'pack14', 'zlib', 'lzma')
+default_levels = {'zlib': 1, 'lzma': 0}
+
+
+def zigzag_delta(value_array):
+    """
+    returns (N points x N channels) uint16 zigzag codes of the per-channel
+    differences modulo 2**14, the first sample is differenced against 0
+    """
+    from numpy import diff, where
+    x = value_array.astype('int32')
+    d = diff(x, axis = 0, prepend = 0)
+    d = ((d + 8192) & 0x3FFF) - 8192
+    return where(d >= 0, 2*d, -2*d - 1).astype('uint16')
+
+
+def undo_zigzag_delta(codes):
+    """
+    inverse of zigzag_delta, returns int16 counts
+    """
+    from numpy import cumsum
+    z = codes.astype('int32')
+    d = (z >> 1) ^ -(z & 1)
+    x = cumsum(d, axis = 0)
+    return (((x + 8192) & 0x3FFF) - 8192).astype('int16')
+
+
+def pack14(codes):
+    """
+    packs 14-bit codes (any shape, row major) into bytes, 7 bytes per 4 codes
+    """
+    from numpy import zeros
+    flat = codes.reshape(-1)
+    N = flat.shape[0]
+    groups = zeros(((N + 3)//4, 4), dtype = 'uint64')
+    groups.reshape(-1)[:N] = flat & 0x3FFF
+    words = groups[:, 0] | (groups[:, 1] << 14) | (groups[:, 2] << 28) | (groups[:, 3] << 42)
+    return words.astype('<u8').view('uint8').reshape(-1, 8)[:, :7].tobytes()
+
+
+def unpack14(payload, N):
+    """
+    returns N uint16 14-bit codes packed by pack14
+    """
+    from numpy import frombuffer, zeros
+    data = frombuffer(payload, dtype = 'uint8').reshape(-1, 7)
+    words = zeros((data.shape[0], 8), dtype = 'uint8')
+    words[:, :7] = data
+    words = words.view('<u8')[:, 0]
+    codes = zeros((words.shape[0], 4), dtype = 'uint16')
+    for i in range(4):
+        codes[:, i] = (words >> (14*i)) & 0x3FFF
+    return codes.reshape(-1)[:N]
+
+
+class Codec(object):
+    """
+    encoder and decoder for one chain of stages
+    """
+    def __init__(self, spec = 'raw'):
+        """
+        Parameters
+        ----------
+        spec :: str
+            stages joined with '+', e.g. 'delta+zlib:1', or 'raw'
+        """
+        self.spec = spec
+        self.delta = False
+        self.pack = False
+        self.compressor = None
+        self.level = None
+        for item in spec.split('+'):
+            name, _, level = item.partition(':')
+            if name == 'raw':
+                continue
+            if name not in stages:
+                raise ValueError('unknown codec stage {!r} in {!r}'.format(name, spec))
+            if name == 'delta':
+                self.delta = True
+            elif name == 'pack14':
+                self.pack = True
+            else:
+                self.compressor = name
+                self.level = int(level) if level else default_levels[name]
+
+    def encode(self, value_array):
+        """
+        returns payload bytes of (N points x N channels) counts
+        """
+        import zlib
+        if self.delta:
+            codes = zigzag_delta(value_array)
+        elif self.pack:
+            codes = value_array.astype('uint16')
+        else:
+            codes = value_array.astype('<i2')
+        if self.pack:
+            payload = pack14(codes)
+        else:
+            payload = codes.astype(codes.dtype.newbyteorder('<')).tobytes()
+        if self.compressor == 'zlib':
+            payload = zlib.compress(payload, self.level)
+        elif self.compressor == 'lzma':
+            import lzma
+            payload = lzma.compress(payload, preset = self.level)
+        return payload
+
+    def decode(self, payload, N_of_points, N_of_channels):
+        """
+        returns (N points x N channels) int16 counts of a payload
+        """
+        import zlib
+        from numpy import frombuffer
+        if self.compressor == 'zlib':
+            payload = zlib.decompress(payload)
+        elif self.compressor == 'lzma':
+            import lzma
+            payload = lzma.decompress(payload)
+        N = N_of_points*N_of_channels
+        if self.pack:
+            codes = unpack14(payload, N)
+        elif self.delta:
+            codes = frombuffer(payload, dtype = '<u2')
+        else:
+            return frombuffer(payload, dtype = '<i2').reshape((N_of_points, N_of_channels))
+        codes = codes.reshape((N_of_points, N_of_channels))
+        if self.delta:
+            return undo_zigzag_delta(codes)
+        return (((codes.astype('int32') + 8192) & 0x3FFF) - 8192).astype('int16')
+
+    def __repr__(self):
+        return 'Codec({!r})'.format(self.spec)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Compiled scan configuration of the DI-245.
+
+ScanConfig validates the scan list, the physical channels and the gains once
+and precomputes everything that depends on them:
+
+    channel_commands    b'chn <member> <config>\\r' for every scan list member
+    commands            channel commands followed by the xrate command
+    frame_size          bytes per scan in the binary stream
+    slope, intercept    per-channel conversion from counts to Volts or degrees C
+    units               'V' or 'C' per channel
+    digest              stable hash, the key of the DeviceCache
+
+A ScanConfig is immutable and hashable, equal configurations compare equal,
+so it can key dictionaries and caches. Invalid configurations raise
+ValueError before anything is sent to the device.
+
+The channel configuration word of the chn command is
+
+    bits 0-3    physical channel
+    bits 8-12   range or thermocouple type (gain_codes)
+
+Examples
+--------
+>>> config = ScanConfig(['0','1'], ['0','3'], ['5','T-thrmc'])
+>>> config.channel_commands
+(b'chn 0 2816 \\r', b'chn 1 5891 \\r')
+>>> config.to_units(value_array)
+
+Valentyn Stadnytskyi
+"""
+from dataq_di_245.conversion import ranges, thermocouples
+
+# range or thermocouple type, bits 8-12 of the channel configuration word
+gain_codes = {}
+gain_codes['0.010'] = 0b00101
+gain_codes['0.025'] = 0b00100
+gain_codes['0.05'] = 0b00011
+gain_codes['0.1'] = 0b00010
+gain_codes['0.25'] = 0b00001
+gain_codes['0.5'] = 0b00000
+gain_codes['1'] = 0b01101
+gain_codes['2.5'] = 0b01100
+gain_codes['5'] = 0b01011
+gain_codes['10'] = 0b01010
+gain_codes['25'] = 0b01001
+gain_codes['50'] = 0b01000
+gain_codes['B-thrmc'] = 0b10000
+gain_codes['E-thrmc'] = 0b10001
+gain_codes['J-thrmc'] = 0b10010
+gain_codes['K-thrmc'] = 0b10011
+gain_codes['N-thrmc'] = 0b10100
+gain_codes['R-thrmc'] = 0b10101
+gain_codes['S-thrmc'] = 0b10110
+gain_codes['T-thrmc'] = 0b10111
+
+N_of_physical_channels = 4
+max_scan_members = 8
+default_xrate_command = b'xrate 4099 2000 \x0D'
+
+
+def as_str(value):
+    if isinstance(value, bytes):
+        return value.decode('Latin-1')
+    return str(value)
+
+
+class ScanConfig(object):
+    """
+    immutable, validated scan configuration with precomputed commands and
+    conversion tables
+    """
+    def __init__(self, scan_lst, phys_ch_lst, gain_lst, xrate_command = default_xrate_command):
+        """
+        Parameters
+        ----------
+        scan_lst :: list
+            scan list members, e.g. ['0','1','2','3']
+        phys_ch_lst :: list
+            physical channel of every member, 0..3
+        gain_lst :: list
+            range (e.g. '5') or thermocouple type (e.g. 'T-thrmc') of every member
+        xrate_command :: bytes
+            sample rate command
+
+        Raises
+        ------
+        ValueError
+            if the configuration is not valid
+        """
+        from numpy import array
+        from dataq_di_245.cache import config_hash
+        scan_lst = tuple(as_str(item) for item in scan_lst)
+        phys_ch_lst = tuple(as_str(item) for item in phys_ch_lst)
+        gain_lst = tuple(as_str(item) for item in gain_lst)
+        if not 0 < len(scan_lst) <= max_scan_members:
+            raise ValueError('the scan list has {} members, expected 1 to {}'.format(len(scan_lst),
+                                                                                      max_scan_members))
+        if len(phys_ch_lst) != len(scan_lst) or len(gain_lst) != len(scan_lst):
+            raise ValueError('scan_lst, phys_ch_lst and gain_lst have different lengths: {}, {}, {}'.format(
+                len(scan_lst), len(phys_ch_lst), len(gain_lst)))
+        members = []
+        for item in scan_lst:
+            if not item.isdigit() or int(item) >= max_scan_members:
+                raise ValueError('invalid scan list member {!r}, expected 0..{}'.format(item, max_scan_members - 1))
+            members.append(int(item))
+        if len(set(members)) != len(members):
+            raise ValueError('duplicate scan list members in {}'.format(list(scan_lst)))
+        channels = []
+        for item in phys_ch_lst:
+            if not item.isdigit() or int(item) >= N_of_physical_channels:
+                raise ValueError('invalid physical channel {!r}, expected 0..{}'.format(
+                    item, N_of_physical_channels - 1))
+            channels.append(int(item))
+        for item in gain_lst:
+            if item not in gain_codes:
+                raise ValueError('unknown gain {!r}, expected one of {}'.format(item, sorted(gain_codes)))
+        xrate_command = bytes(xrate_command)
+        if not (xrate_command.startswith(b'xrate ') and xrate_command.endswith(b'\x0D')):
+            raise ValueError('invalid xrate command {!r}'.format(xrate_command))
+
+        set_ = object.__setattr__
+        set_(self, 'scan_lst', scan_lst)
+        set_(self, 'phys_ch_lst', phys_ch_lst)
+        set_(self, 'gain_lst', gain_lst)
+        set_(self, 'xrate_command', xrate_command)
+        set_(self, 'N_of_channels', len(scan_lst))
+        set_(self, 'frame_size', 2*len(scan_lst))
+        words = [(gain_codes[gain] << 8) | channel for gain, channel in zip(gain_lst, channels)]
+        set_(self, 'channel_commands', tuple('chn {} {} \x0D'.format(member, word).encode('Latin-1')
+                                             for member, word in zip(members, words)))
+        set_(self, 'commands', self.channel_commands + (xrate_command,))
+        slope = array([ranges[gain]/2**13 if gain in ranges else thermocouples[gain][0] for gain in gain_lst])
+        intercept = array([0.0 if gain in ranges else thermocouples[gain][1] for gain in gain_lst])
+        slope.flags.writeable = False
+        intercept.flags.writeable = False
+        set_(self, 'slope', slope)
+        set_(self, 'intercept', intercept)
+        set_(self, 'units', tuple('V' if gain in ranges else 'C' for gain in gain_lst))
+        set_(self, 'digest', config_hash(list(scan_lst), list(phys_ch_lst), list(gain_lst), xrate_command))
+
+    @property
+    def key(self):
+        return (self.scan_lst, self.phys_ch_lst, self.gain_lst, self.xrate_command)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ScanConfig is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ScanConfig is immutable')
+
+    def __eq__(self, other):
+        return isinstance(other, ScanConfig) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return 'ScanConfig(scan_lst={}, phys_ch_lst={}, gain_lst={})'.format(list(self.scan_lst),
+                                                                            list(self.phys_ch_lst),
+                                                                            list(self.gain_lst))
+
+    def to_units(self, value_array):
+        """
+        converts (N points x N channels) counts (offset removed) into Volts or degrees C
+        """
+        return value_array*self.slope + self.intercept
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Conversion of DI-245 counts into physical units.
+
+The DI-245 reports every measurement as a 14-bit number. After the 8192 offset
+is removed (see Device.run_once) the counts span -8192..8191 and map linearly
+onto the full scale range of the channel.
+
+Voltage ranges: counts * full_scale / 2**13
+Thermocouples:  counts * m + b (degrees C), coefficients from the DI-245
+                Communication Protocol.
+
+Valentyn Stadnytskyi
+"""
+
+# full scale, Volts
+ranges = {}
+ranges['0.010'] = 0.010
+ranges['0.025'] = 0.025
+ranges['0.05'] = 0.05
+ranges['0.1'] = 0.1
+ranges['0.25'] = 0.25
+ranges['0.5'] = 0.5
+ranges['1'] = 1.0
+ranges['2.5'] = 2.5
+ranges['5'] = 5.0
+ranges['10'] = 10.0
+ranges['25'] = 25.0
+ranges['50'] = 50.0
+
+# (m, b) Degrees C = m*counts + b
+thermocouples = {}
+thermocouples['B-thrmc'] = (0.023956, 1035.0)
+thermocouples['E-thrmc'] = (0.018311, 400.0)
+thermocouples['J-thrmc'] = (0.021515, 495.0)
+thermocouples['K-thrmc'] = (0.023987, 586.0)
+thermocouples['N-thrmc'] = (0.022888, 550.0)
+thermocouples['R-thrmc'] = (0.02774, 859.0)
+thermocouples['S-thrmc'] = (0.02774, 859.0)
+thermocouples['T-thrmc'] = (0.009155, 100.0)
+
+
+_coefficients = {}
+
+
+def coefficients(gain_lst):
+    """
+    returns per-channel slope and intercept for a list of gains
+
+    Parameters
+    ----------
+    gain_lst :: list or ScanConfig
+        list of gains as used in Driver.config_channels, or a compiled
+        ScanConfig whose precomputed tables are returned
+
+    Returns
+    -------
+    tuple :: (numpy.ndarray, numpy.ndarray)
+        slope and intercept, one entry per channel (read-only, shared
+        between calls with the same gains)
+
+    Examples
+    --------
+    >>> m, b = coefficients(['5','T-thrmc'])
+    >>> m
+    array([0.00061035, 0.009155  ])
+    """
+    from numpy import array
+    from dataq_di_245.config import ScanConfig
+    if isinstance(gain_lst, ScanConfig):
+        return gain_lst.slope, gain_lst.intercept
+    key = tuple(gain_lst)
+    if key in _coefficients:
+        return _coefficients[key]
+    slope = []
+    intercept = []
+    for gain in gain_lst:
+        if gain in ranges:
+            slope.append(ranges[gain]/2**13)
+            intercept.append(0.0)
+        elif gain in thermocouples:
+            slope.append(thermocouples[gain][0])
+            intercept.append(thermocouples[gain][1])
+        else:
+            raise ValueError('unknown gain {!r}'.format(gain))
+    slope, intercept = array(slope), array(intercept)
+    slope.flags.writeable = False
+    intercept.flags.writeable = False
+    _coefficients[key] = slope, intercept
+    return slope, intercept
+
+
+def to_units(value_array, gain_lst):
+    """
+    converts counts (offset removed) into Volts or degrees C.
+
+    Parameters
+    ----------
+    value_array :: numpy.ndarray
+        (N points x N channels) array of counts, as stored in Device.buffer
+    gain_lst :: list or ScanConfig
+        list of gains, one per channel, or the compiled scan configuration
+
+    Returns
+    -------
+    array :: numpy.ndarray
+        float64 array of the same shape
+
+    Examples
+    --------
+    >>> to_units(device.buffer.get_last_N(10), device.active_gain_lst)
+    """
+    slope, intercept = coefficients(gain_lst)
+    return value_array*slope + intercept
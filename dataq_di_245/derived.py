@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Derived channels: outputs defined as arithmetic expressions over the
+channels of a packet, compiled once and evaluated with NumPy over whole
+packets or buffer slices, one value per sample.
+
+Names available in expressions:
+
+    ch0, ch1, ...   counts of scan list member i (offset removed)
+    u0, u1, ...     the same in Volts/degrees C, if gain_lst is given
+    any derived channel defined in the same set, in any order
+    numpy functions listed in `functions` and the constants pi, e
+
+The default definitions reproduce the relative humidity rig that used to be
+hard coded into Device.run_once:
+
+    VS          = ch0*10.0/2**13
+    VO          = ch1*5.0/2**13
+    TEMP_TOP    = ch2*0.036621+100
+    TEMP_BOTTOM = ch3*0.036621+100
+    RH          = 149.09*((VO/VS)-0.1515)/(1-0.002048*(0.5*(TEMP_TOP+TEMP_BOTTOM)))
+
+Examples
+--------
+>>> derived = DerivedChannels([['V', 'ch0*10.0/2**13'], ['P', 'V**2/50']], N_of_channels = 4)
+>>> result = derived.evaluate(device.buffer.get_last_N(2000))
+>>> result['P'].shape
+(2000,)
+
+Valentyn Stadnytskyi
+"""
+default_definitions = [
+    ['TEMP_TOP', 'ch2*0.036621+100'],
+    ['TEMP_BOTTOM', 'ch3*0.036621+100'],
+    ['RH', '149.09*((VO/VS)-0.1515)/(1-0.002048*(0.5*(TEMP_TOP+TEMP_BOTTOM)))'],
+    ['VS', 'ch0*10.0/2**13'],
+    ['VO', 'ch1*5.0/2**13'],
+]
+
+functions = ['abs', 'sqrt', 'exp', 'log', 'log10', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan',
+             'arctan2', 'sinh', 'cosh', 'tanh', 'minimum', 'maximum', 'clip', 'where', 'sign', 'floor',
+             'ceil', 'round', 'polyval']
+constants = ['pi', 'e']
+
+
+def compile_expression(expression):
+    """
+    parses and validates an expression
+
+    Returns
+    -------
+    tuple :: (code, names)
+        code object for eval and set of names used in the expression
+    """
+    import ast
+    allowed_nodes = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp, ast.IfExp, ast.Call,
+                     ast.Name, ast.Load, ast.Constant, ast.List, ast.Tuple,
+                     ast.operator, ast.unaryop, ast.cmpop, ast.boolop)
+    try:
+        tree = ast.parse(expression, mode = 'eval')
+    except SyntaxError as err:
+        raise ValueError('invalid expression {!r}: {}'.format(expression, err))
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, allowed_nodes):
+            raise ValueError('{} is not allowed in expression {!r}'.format(type(node).__name__, expression))
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in functions:
+                raise ValueError('only functions {} are allowed in expression {!r}'.format(functions, expression))
+        elif isinstance(node, ast.Name):
+            names.add(node.id)
+    return compile(tree, '<{}>'.format(expression), 'eval'), names - set(functions)
+
+
+class DerivedChannels(object):
+    """
+    compiled set of derived channel definitions
+    """
+    def __init__(self, definitions = default_definitions, N_of_channels = 4, gain_lst = None,
+                 buffer_size = None):
+        """
+        Parameters
+        ----------
+        definitions :: list
+            list of [name, expression] pairs, the order defines the output order
+        N_of_channels :: integer
+            number of channels in the scan list
+        gain_lst :: list, optional
+            gains of the channels, makes u0, u1, ... available
+        buffer_size :: integer, optional
+            if given, evaluated packets are stored in self.buffer, a CircularBuffer
+            (buffer_size x N outputs)
+        """
+        import numpy
+        self.names = [name for name, expression in definitions]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError('derived channel names are not unique: {}'.format(self.names))
+        self.N_of_channels = N_of_channels
+        self.gain_lst = gain_lst
+        inputs = ['ch{}'.format(i) for i in range(N_of_channels)]
+        if gain_lst is not None:
+            from dataq_di_245.conversion import coefficients
+            self.slope, self.intercept = coefficients(gain_lst)
+            inputs += ['u{}'.format(i) for i in range(N_of_channels)]
+        self.namespace = {name: getattr(numpy, name) for name in functions + constants}
+        self.namespace['abs'] = numpy.abs
+        self.namespace['round'] = numpy.round
+        compiled = {}
+        for name, expression in definitions:
+            if name in inputs or name in self.namespace:
+                raise ValueError('derived channel name {!r} is reserved'.format(name))
+            compiled[name] = compile_expression(expression)
+        for name in compiled:
+            unknown = compiled[name][1] - set(inputs) - set(compiled) - set(constants)
+            if unknown:
+                raise ValueError('unknown names {} in {!r}'.format(sorted(unknown), name))
+        self.order = self._resolve(compiled)
+        self.code = [(name, compiled[name][0]) for name in self.order]
+        self.uses_units = any(n.startswith('u') and n in inputs for c in compiled.values() for n in c[1])
+        if buffer_size:
+            from circular_buffer_numpy.circular_buffer import CircularBuffer
+            self.buffer = CircularBuffer(shape = (buffer_size, len(self.names)), dtype = 'float64')
+        else:
+            self.buffer = None
+
+    def _resolve(self, compiled):
+        """
+        returns evaluation order, dependencies first
+        """
+        order = []
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError('circular definition: {}'.format(' -> '.join(path + [name])))
+            state[name] = 'visiting'
+            for dependency in sorted(compiled[name][1] & set(compiled)):
+                visit(dependency, path + [name])
+            state[name] = 'done'
+            order.append(name)
+        for name in self.names:
+            visit(name, [])
+        return order
+
+    def set_gains(self, gain_lst):
+        """
+        changes the conversion of the inputs u0, u1, ... after the ranges of
+        the device were changed; ch0, ch1, ... stay in counts
+        """
+        from dataq_di_245.conversion import coefficients
+        if self.gain_lst is None:
+            raise ValueError('derived channels were created without gain_lst')
+        self.gain_lst = gain_lst
+        self.slope, self.intercept = coefficients(gain_lst)
+
+    def evaluate(self, value_array, store = False):
+        """
+        evaluates all derived channels for every sample
+
+        Parameters
+        ----------
+        value_array :: numpy.ndarray
+            (N points x N channels) array of counts, offset removed
+        store :: boolean, optional
+            append the result to self.buffer
+
+        Returns
+        -------
+        result :: dict
+            {name: array (N points)}
+        """
+        value_array = value_array.astype('float64')
+        namespace = dict(self.namespace)
+        for i in range(self.N_of_channels):
+            namespace['ch{}'.format(i)] = value_array[:, i]
+        if self.uses_units:
+            units = value_array*self.slope + self.intercept
+            for i in range(self.N_of_channels):
+                namespace['u{}'.format(i)] = units[:, i]
+        result = {}
+        for name, code in self.code:
+            namespace[name] = result[name] = eval(code, {'__builtins__': {}}, namespace)
+        if store and self.buffer is not None:
+            self.buffer.append(self.as_array(result, value_array.shape[0]))
+        return result
+
+    def as_array(self, result, N_of_points):
+        """
+        returns (N points x N outputs) array of an evaluate() result in output order
+        """
+        from numpy import empty
+        array = empty((N_of_points, len(self.names)))
+        for i, name in enumerate(self.names):
+            array[:, i] = result[name]
+        return array
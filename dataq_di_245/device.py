@@ -62,19 +62,17 @@ Commands:
 Valentyn Stadnytskyi Nov 2017
 """
 
-from numpy import concatenate,zeros,mean,std,uint16,int16, nan
-from time import time, sleep, gmtime, strftime
-from sys import stdout
-import os.path
-from pdb import pm
-from logging import error,warn,info,debug
+# numpy, circular_buffer_numpy and the publishers are imported where they are
+# used; the settings DataBase is read on first access, not on import.
+from time import time, sleep
+from logging import error,warning,info,debug
 
 from dataq_di_245.driver import Driver
-from ubcs_auxiliary.saved_property import DataBase, SavedProperty
-from ubcs_auxiliary.threading import new_thread
-
-import msgpack
-import msgpack_numpy as m
+from dataq_di_245.derived import DerivedChannels, default_definitions
+from dataq_di_245.timebase import Timebase
+from dataq_di_245.subscriptions import Subscriptions
+from dataq_di_245.triggers import EventDetector
+from dataq_di_245.saved_property import DataBase, SavedProperty
 
 class Device(object):
     db = DataBase(root = 'TEMP', name = 'dataq_covid19')
@@ -89,6 +87,25 @@ class Device(object):
     time_out = SavedProperty(db,'time_out', 0).init()
     cjc_value = SavedProperty(db,'cjc_value', '').init()
     SN = SavedProperty(db,'SN', '').init()
+    pvs = SavedProperty(db,'pvs', {'TEMP_TOP': {'max_rate': 10.0, 'deadband': 0.0},
+                                   'TEMP_BOTTOM': {'max_rate': 10.0, 'deadband': 0.0},
+                                   'RH': {'max_rate': 10.0, 'deadband': 0.0},
+                                   'QUALITY': {'max_rate': 10.0, 'deadband': 0.0},
+                                   'CLIPPED': {'max_rate': 1.0, 'deadband': 0.0}}).init()
+    waveform = SavedProperty(db,'waveform', {'length': 1000, 'decimation': 80, 'rate': 1.0}).init()
+    derived = SavedProperty(db,'derived', default_definitions).init()
+    derived_buffer_size = SavedProperty(db,'derived_buffer_size', 0).init()
+    use_cache = SavedProperty(db,'use_cache', True).init()
+    triggers = SavedProperty(db,'triggers', []).init()
+    filters = SavedProperty(db,'filters', []).init()
+    filtered_buffer_size = SavedProperty(db,'filtered_buffer_size', 100000).init()
+    spectrum = SavedProperty(db,'spectrum', {}).init()
+    archive_directory = SavedProperty(db,'archive_directory', '').init()
+    archive_codec = SavedProperty(db,'archive_codec', 'delta+zlib:1').init()
+    buffer_file = SavedProperty(db,'buffer_file', '').init()
+    packet_sizing = SavedProperty(db,'packet_sizing', {'latency': 0.05, 'max_rate': 100.0, 'max_points': 4096}).init()
+    autorange = SavedProperty(db,'autorange', {}).init()
+    quality = SavedProperty(db,'quality', {'margin': 0, 'saturated_fraction': 0.5}).init()
 
     def __init__(self, name = None):
         if name is not None:
@@ -96,20 +113,65 @@ class Device(object):
         else:
             self.name = 'DI245_noname'
         self.recording_flag = False
+        self.cache = None
+        self.publishing = None
+        self.waveforms = None
+        self.subscriptions = None
+        self.event_detector = None
+        self.filter_chain = None
+        self.spectral_monitor = None
+        self.archive = None
+        self.persistent = False
+        self.packet_sizer = None
+        self.scan_config = None
+        self.autoranger = None
+        self.pending_gains = None
+        self.quality_monitor = None
+        self.active_gain_lst = None
+        self.running = False
 
 
-    def init(self, serial_number):
-        self.dev = Driver()
+    def init(self, serial_number, driver = None, publisher = None, prefix = None, cache = None):
+        """
+        Parameters
+        ----------
+        serial_number :: str
+            serial number of the DI-245
+        driver :: Driver, optional
+            driver object, default is a new Driver. Used to run on an emulator.
+        publisher :: object, optional
+            object with put(name, value) method, default is CAPublisher
+        prefix :: str, optional
+            PV prefix, default is self.prefix
+        cache :: DeviceCache, optional
+            device description and configuration cache for fast warm start,
+            default is the shared_cache() of the process if self.use_cache
+        """
+        if driver is None:
+            driver = Driver()
+        if cache is None and self.use_cache:
+            from dataq_di_245.cache import shared_cache
+            cache = shared_cache()
+        self.cache = cache
+        self.dev = driver
         self.driver = self.dev
-        success = self.driver.init(serial_number)
+        self.init_timing = {}
+        t = time()
+        success = self.driver.init(serial_number, cache = cache)
+        self.init_timing['driver.init'] = time() - t
 
         if success:
+            t = time()
             self.configure_device()
-            debug('DI245 is found: %r' % self.driver.available_ports)
+            self.init_timing['configure_device'] = time() - t
+            t = time()
+            self.configure_publishing(publisher, prefix = prefix)
+            self.init_timing['configure_publishing'] = time() - t
+            debug('DI245 is found: %r' % self.driver.port)
             self.info_dict = {}
             self.info_dict['scan_lst'] = self.scan_lst
             self.info_dict['phys_ch_lst'] = self.phys_ch_lst
-            self.info_dict['gain_lst'] = self.gain_lst
+            self.info_dict['gain_lst'] = self.active_gain_lst
             self.info_dict['RingBuffer_size'] = self.buffer_size
             self.info_dict['calib'] = self.calib
             self.info_dict['time_out'] = self.time_out
@@ -122,75 +184,522 @@ class Device(object):
 
         return reply
 
-    def stop(self):
-        self.full_stop()
-
-
     def configure_device(self):
+        from dataq_di_245.config import ScanConfig
+        self.scan_config = ScanConfig(self.scan_lst, self.phys_ch_lst, self.gain_lst,
+                                      xrate_command = self.dev.xrate_command)
+        # the gains in effect, auto-ranging changes them but not the saved setting
+        self.active_gain_lst = list(self.scan_config.gain_lst)
         self.driver.stop_scan()
-        from circular_buffer_numpy.circular_buffer import CircularBuffer
-        self.buffer = CircularBuffer(shape = (self.buffer_size,len(self.scan_lst)), dtype = 'int16')#4320000
+        from dataq_di_245.ring import RingBuffer
+        self.timebase = Timebase()
+        buffer_file = self.buffer_file
+        if buffer_file:
+            self.buffer = self.open_buffer_file(buffer_file)
+        else:
+            self.buffer = RingBuffer(shape = (self.buffer_size,len(self.scan_lst)), dtype = 'int16')#4320000
+        self.persistent = bool(buffer_file)
         self.buffer.packet_length = self.packet_length
-        print(self.scan_lst,self.phys_ch_lst,self.gain_lst)
-        self.dev.config_channels(scan_lst=self.scan_lst,phys_ch_lst=self.phys_ch_lst,gain_lst = self.gain_lst)
+        from dataq_di_245.quality import QualityMonitor
+        self.quality_monitor = QualityMonitor(len(self.scan_lst), length = self.buffer.length, **self.quality)
+        self.quality_monitor.follow(self.buffer)
+        self.subscriptions = Subscriptions(self.buffer, quality = self.quality_monitor)
+        self.event_detector = EventDetector(self.buffer, triggers = self.triggers,
+                                            gain_lst = self.active_gain_lst, timebase = self.timebase)
+        if self.filters:
+            from dataq_di_245.filters import FilterChain
+            self.filter_chain = FilterChain(self.filters)
+            self.filtered_buffer = RingBuffer(shape = (self.filtered_buffer_size,len(self.scan_lst)),
+                                              dtype = 'float64')
+        else:
+            self.filter_chain = None
+        if self.spectrum:
+            self.configure_spectrum(**self.spectrum)
+        if self.archive_directory:
+            from dataq_di_245.recording import Archive
+            self.archive = Archive(self.archive_directory, self.driver.serial_number)
+        else:
+            self.archive = None
+        self.derived_channels = DerivedChannels(self.derived, N_of_channels = len(self.scan_lst),
+                                                gain_lst = self.active_gain_lst,
+                                                buffer_size = self.derived_buffer_size)
+        if self.autorange:
+            from dataq_di_245.autorange import AutoRange
+            self.autoranger = AutoRange(self.active_gain_lst, **self.autorange)
+        else:
+            self.autoranger = None
+        self.pending_gains = None
+        debug('scan list {}, physical channels {}, gains {}'.format(self.scan_lst, self.phys_ch_lst,
+                                                                   self.active_gain_lst))
+        self.configure_channels()
+
+    def open_buffer_file(self, filename):
+        """
+        opens the memory-mapped ring buffer in filename. If it holds samples
+        acquired with the current configuration, they are kept and
+        self.timebase continues from them, otherwise it starts empty.
+        """
+        from dataq_di_245.ring import PersistentBuffer
+        from dataq_di_245.cache import config_hash
+        buffer = PersistentBuffer(filename, shape = (self.buffer_size,len(self.scan_lst)), dtype = 'int16',
+                                  config_hash = config_hash(self.scan_lst, self.phys_ch_lst, self.active_gain_lst,
+                                                            self.buffer_size))
+        sequence, t, rate = buffer.last_time
+        if buffer.restored and buffer.g_pointer >= buffer.oldest and rate is not None:
+            oldest = buffer.oldest
+            self.timebase.resume(oldest, buffer.g_pointer, t, rate, sequence)
+            info('{} samples restored from {}'.format(buffer.g_pointer - oldest + 1, filename))
+        return buffer
+
+    def configure_channels(self):
+        """
+        writes the channel configuration to the device unless the cache shows
+        that the device already has it
+        """
+        current_hash = self.scan_config.digest
+        if self.cache is not None and self.cache.get_config_hash(self.dev.serial_number) == current_hash:
+            info('channel configuration of the DI-245 {} is unchanged'.format(self.dev.serial_number))
+        else:
+            success, result = self.dev.config_channels(config = self.scan_config)
+            if self.cache is not None:
+                if all(result):
+                    self.cache.set_config_hash(self.dev.serial_number, current_hash)
+                else:
+                    self.cache.invalidate(self.dev.serial_number)
 
 
+    def configure_spectrum(self, segment_length = 1024, overlap = 0.5, averages = 16):
+        """
+        creates the spectral monitor of self.buffer. It is updated from a
+        subscription, outside of the acquisition thread, every time a new
+        segment is complete.
+        """
+        from dataq_di_245.spectral import SpectralMonitor
+        self.spectral_monitor = SpectralMonitor(self.buffer, segment_length = segment_length, overlap = overlap,
+                                                averages = averages, gain_lst = self.active_gain_lst,
+                                                timebase = self.timebase)
+        self.subscribe(lambda notification: self.spectral_monitor.update(), samples = self.spectral_monitor.step,
+                       queue_size = 1, policy = 'coalesce')
+
+    def configure_publishing(self, publisher = None, prefix = None):
+        """
+        creates the publishing stage with the PV map self.pvs under self.prefix
+        (or prefix) and the waveform stage configured by self.waveform
+        """
+        if prefix is None:
+            prefix = self.prefix
+        from dataq_di_245.publisher import PublishingStage, WaveformStage, CAPublisher, LocalPublisher
+        if publisher is None:
+            try:
+                publisher = CAPublisher()
+            except ImportError:
+                warning('EPICS_CA is not available, PVs are published locally only')
+                publisher = LocalPublisher()
+        self.publishing = PublishingStage(publisher, prefix = prefix, pvs = self.pvs)
+        self.waveforms = WaveformStage(publisher, self.buffer, prefix = prefix,
+                                       gain_lst = self.active_gain_lst, **self.waveform)
+
     def run_once(self):
         """
+        reads and processes one packet if it is available
+        """
+        length = self.packet_length
+        N_of_channels = len(self.scan_lst)
+        waiting = self.driver.waiting[0]
+        if waiting != waiting:
+            raise IOError('DI-245 {} is lost'.format(self.driver.serial_number))
+        if waiting >= length*N_of_channels*2:
+            raw = self.dev.read_buffer(N_of_channels = N_of_channels, N_of_points = length)
+            value_array = self.dev.convert_buffer_to_array(raw, N_of_channels = N_of_channels,
+                                                           N_of_points = length).T - 8192
+            self.process(value_array)
+        else:
+            sleep(0.01)
+
+    def process(self, value_array):
+        """
+        appends a packet, (N points x N channels) counts, to the buffer and
+        updates the timebase, clip detection, derived channels, recording and
+        publishing. The quality flags of the packet (see quality.py) are
+        published as QUALITY along with the means of the derived channels,
+        the per-channel clip counters as CLIPPED.
+        If filters are configured, the filtered (and decimated) packet goes
+        to self.filtered_buffer and the derived channels are computed from it.
         """
         from tempfile import gettempdir
         from numpy import mean
         from time import time
-        root = gettempdir()
-        length = self.packet_length
-        if self.driver.waiting[0] > length*4*2:
-            value_array = self.dev.read_number(N_of_channels = len(self.scan_lst), N_of_points = length).T - 8192
-            self.buffer.append(value_array)
-            T_top = mean(value_array[:,2])*0.036621+100
-            T_bottom = mean(value_array[:,3])*0.036621+100
-            Vs = mean(value_array[:,0]*10.0/(2**13))
-            Vo = mean(value_array[:,1]*5.0/(2**13))
-            rh = mean(self.relative_humidity(Vs,Vo,T_top,T_bottom))
-            if self.recording_flag:
-                with open(root + '/covid19_DI245.txt',"a") as f:
-                    string = f'{time()},{round(T_top,2)}, {round(T_bottom,2)}, {round(rh,2)}, {round(Vs,2)},{round(Vo,2)} \n'
-                    f.write(string)
-            from EPICS_CA.CAServer import casput
-            casput('BigBox:TEMP_TOP',T_top)
-            casput('BigBox:TEMP_BOTTOM',T_bottom)
-            casput('BigBox:RH',rh)
+        t = time()
+        self.buffer.append(value_array)
+        flags = self.quality_monitor.check(value_array)
+        self.timebase.update(self.buffer.g_pointer, t)
+        if self.persistent:
+            g_pointer = self.buffer.g_pointer
+            self.buffer.set_time(self.timebase.sequence_of(g_pointer), self.timebase.time_of(g_pointer),
+                                 self.timebase.rate)
+        if self.archive is not None and self.archive.recorder is not None:
+            first = self.buffer.g_pointer - value_array.shape[0] + 1
+            self.archive.recorder.write(value_array, sequence = self.timebase.sequence_of(first),
+                                        t = self.timebase.time_of(first), rate = self.timebase.rate)
+        if self.autoranger is not None and self.pending_gains is None:
+            self.pending_gains = self.autoranger.update(value_array)
+        if self.subscriptions is not None:
+            self.subscriptions.notify(self.buffer.g_pointer, t)
+        if self.event_detector is not None and (self.event_detector.triggers or self.event_detector.pending):
+            self.event_detector.process(value_array)
+        if self.filter_chain is not None:
+            value_array = self.filter_chain.process(value_array)
+            if value_array.shape[0] == 0:
+                return
+            self.filtered_buffer.append(value_array)
+        derived = self.derived_channels.evaluate(value_array, store = True)
+        means = [mean(derived[name]) for name in self.derived_channels.names]
+        if self.recording_flag:
+            with open(gettempdir() + '/covid19_DI245.txt',"a") as f:
+                string = ', '.join([str(time())] + [str(round(value,2)) for value in means]) + ' \n'
+                f.write(string)
+        if self.publishing is not None:
+            for name, value in zip(self.derived_channels.names, means):
+                self.publishing.update(name,value)
+            self.publishing.update('QUALITY', flags)
+            if flags:
+                self.publishing.update('CLIPPED', self.quality_monitor.clipped.tolist())
+
+    def subscribe(self, callback = None, samples = None, interval = None, queue_size = 16, policy = 'drop_oldest'):
+        """
+        notifies callback (in its own thread) or a waiting consumer about new
+        samples in self.buffer, see dataq_di_245.subscriptions
+
+        Parameters
+        ----------
+        callback :: callable, optional
+            callback(notification), default is to wait with subscription.get()
+        samples :: integer, optional
+            notify when at least this many new samples have accumulated
+        interval :: float, optional
+            notify when this many seconds have passed and there is new data
+        queue_size :: integer
+            maximum number of pending notifications of this subscriber
+        policy :: str
+            'drop_oldest', 'drop_newest' or 'coalesce' when the queue is full
+
+        Returns
+        -------
+        subscription :: Subscription
+
+        Examples
+        --------
+        >>> subscription = device.subscribe(lambda n: print(n.data.mean(axis = 0)), samples = 1000)
+        """
+        return self.subscriptions.subscribe(callback = callback, samples = samples, interval = interval,
+                                            queue_size = queue_size, policy = policy)
 
-        else:
-            sleep(0.01)
+    def unsubscribe(self, subscription):
+        self.subscriptions.unsubscribe(subscription)
 
     def run(self):
+        """
+        supervised acquisition loop over Driver.iter_packets: if the device is
+        lost, recover() waits for it to reappear and resumes streaming.
+
+        If self.packet_sizing is set (keyword arguments of PacketSizer), the
+        packet size adapts to the arrival rate and the backlog, starting from
+        self.packet_length; otherwise packets are self.packet_length scans.
+
+        If self.autorange is set, the loop leaves the stream when the
+        AutoRange proposes new gains and change_ranges() reconfigures the
+        device before streaming continues.
+        """
+        import traceback
+        from dataq_di_245.driver import PacketSizer
+        sizing = self.packet_sizing
+        if sizing:
+            self.packet_sizer = PacketSizer(initial_points = self.packet_length, **sizing)
+        else:
+            self.packet_sizer = None
         while self.running:
-            self.run_once()
+            try:
+                for value_array in self.driver.iter_packets(self.packet_length, N_of_channels = len(self.scan_lst),
+                                                            scan = False, abort = lambda: not self.running,
+                                                            sizer = self.packet_sizer):
+                    self.process(value_array)
+                    if self.pending_gains is not None:
+                        break
+                if self.pending_gains is not None and self.running:
+                    self.change_ranges(self.pending_gains)
+            except IOError:
+                error(traceback.format_exc())
+                self.recover()
         self.running = False
 
+    @property
+    def operating_point(self):
+        """
+        current operating point of the acquisition loop: arrival rate,
+        packet size, latency, packets per second and backlog (see
+        PacketSizer.operating_point), plus the stream counters
+        """
+        if self.packet_sizer is not None:
+            result = self.packet_sizer.operating_point()
+        else:
+            result = {'points_per_packet': self.packet_length}
+        stats = self.driver.stream_stats
+        if stats is not None:
+            result['scans'] = stats.scans
+            result['packets'] = stats.packets
+            result['dropped'] = stats.dropped
+        return result
+
+    def recover(self, interval = 0.5):
+        """
+        reconnects to the device with the same serial number after the USB link
+        was lost, reconfigures it and restarts the scan. The interruption is
+        recorded in self.timebase: a new segment starts with the next buffer
+        index and its sequence numbers skip the estimated number of missed
+        samples (see Timebase.gaps).
+
+        Returns
+        -------
+        flag :: boolean
+            True if streaming is resumed
+        """
+        serial_number = self.driver.serial_number
+        warning('DI-245 {} is lost, waiting for it to reappear'.format(serial_number))
+        if self.cache is not None:
+            self.cache.invalidate(serial_number)
+        if not self.driver.reconnect(interval = interval, abort = lambda: not self.running):
+            return False
+        self.configure_channels()
+        if self.filter_chain is not None:
+            self.filter_chain.reset()
+        self.driver.start_scan()
+        segment = self.timebase.mark_gap(self.buffer.g_pointer + 1, time())
+        warning('DI-245 {} resumed streaming after {:.3f} s, {} samples missed'.format(
+            serial_number, segment.gap, segment.missed))
+        return True
+
+    def change_ranges(self, gain_lst):
+        """
+        switches the channels to gain_lst during a brief stop of the scan,
+        self.active_gain_lst follows, the saved gain_lst setting stays. The
+        interruption is recorded in self.timebase as a gap segment that
+        carries the new gain list (see Timebase.mark_gap), the archive starts
+        a new recording with the new gains in its header and the stages that
+        convert counts into units follow the new gains. The samples acquired
+        before the change keep their gains, see get_range.
+
+        Parameters
+        ----------
+        gain_lst :: list
+            new gains, one per scan list member
+        """
+        from dataq_di_245.config import ScanConfig
+        self.pending_gains = None
+        gain_lst = list(gain_lst)
+        scan_config = ScanConfig(self.scan_lst, self.phys_ch_lst, gain_lst, xrate_command = self.dev.xrate_command)
+        previous = list(self.active_gain_lst)
+        self.driver.stop_scan()
+        self.active_gain_lst = gain_lst
+        self.scan_config = scan_config
+        self.configure_channels()
+        if self.persistent:
+            from dataq_di_245.cache import config_hash
+            self.buffer.set_config_hash(config_hash(self.scan_lst, self.phys_ch_lst, gain_lst, self.buffer_size))
+        for stage in (self.event_detector, self.waveforms, self.spectral_monitor):
+            if stage is not None:
+                stage.gain_lst = gain_lst
+        self.derived_channels.set_gains(gain_lst)
+        if self.filter_chain is not None:
+            self.filter_chain.reset()
+        if self.autoranger is not None:
+            self.autoranger.set_gains(gain_lst)
+        if hasattr(self, 'info_dict'):
+            self.info_dict['gain_lst'] = gain_lst
+        self.driver.start_scan()
+        t = time()
+        if self.archive is not None and self.archive.recorder is not None:
+            self.archive.close()
+            self.archive_first_index = self.buffer.g_pointer + 1
+            self.archive.new_recorder(t = t, N_of_channels = len(self.scan_lst), scan_lst = list(self.scan_lst),
+                                      phys_ch_lst = list(self.phys_ch_lst), gain_lst = gain_lst,
+                                      codec = self.archive_codec)
+        segment = self.timebase.mark_gap(self.buffer.g_pointer + 1, t, gain_lst = gain_lst)
+        info('DI-245 {} ranges {} -> {}, {:.3f} s gap, {} samples missed'.format(
+            self.driver.serial_number, previous, gain_lst, segment.gap, segment.missed))
+
+    def to_units(self, value_array, last = None, channels = None):
+        """
+        converts counts into Volts or degrees C with the gains in effect when
+        the samples were acquired (see change_ranges)
+
+        Parameters
+        ----------
+        value_array :: numpy.ndarray
+            (N points x N channels) counts
+        last :: integer, optional
+            buffer index of the last sample, default is to use self.active_gain_lst
+        channels :: integer, slice or list, optional
+            scan list members in value_array, default all
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            float64 array of the same shape
+        """
+        from numpy import arange, array, atleast_1d, empty, unique
+        from dataq_di_245.conversion import to_units
+
+        def gains(gain_lst):
+            gain_lst = array(gain_lst, dtype = object)
+            if channels is not None:
+                gain_lst = gain_lst[channels]
+            return atleast_1d(gain_lst).tolist()
+
+        segments = self.timebase.segments
+        if last is None or not any(segment.gain_lst is not None for segment in segments):
+            return to_units(value_array, gains(self.active_gain_lst))
+        position = self.timebase.segments_of(arange(last - value_array.shape[0] + 1, last + 1))
+        result = empty(value_array.shape)
+        for i in unique(position):
+            gain_lst = segments[i].gain_lst if segments[i].gain_lst is not None else self.active_gain_lst
+            rows = position == i
+            result[rows] = to_units(value_array[rows], gains(gain_lst))
+        return result
+
     def start(self, new_thread = True):
-        from ubcs_auxiliary.threading import new_thread as thread
+        from ubcs_auxiliary.multithreading import new_thread as thread
         from time import time
         self.driver.start_scan()
         self.time_start = self._time_start = time()
+        self.timebase.start(self.buffer.g_pointer + 1, self.time_start, gain_lst = list(self.active_gain_lst))
+        if self.archive is not None:
+            self.archive_first_index = self.buffer.g_pointer + 1
+            self.archive.new_recorder(t = self.time_start, N_of_channels = len(self.scan_lst),
+                                      scan_lst = list(self.scan_lst), phys_ch_lst = list(self.phys_ch_lst),
+                                      gain_lst = list(self.active_gain_lst), codec = self.archive_codec)
         self.running = True
+        if self.publishing is not None:
+            self.publishing.start()
+        if self.waveforms is not None:
+            self.waveforms.start()
         if new_thread:
             thread(self.run)
         else:
             self.run()
 
     def stop(self):
+        """
+        stops the acquisition. The subscriptions stay for the next start, their
+        dispatch threads run until unsubscribe() or full_stop().
+        """
         from time import sleep
         self.running = False
         sleep(1)
         self.driver.stop_scan()
+        self.driver.refresh_description_in_background()
+        if self.archive is not None:
+            self.archive.close()
+        if self.persistent:
+            self.buffer.flush()
+        if self.publishing is not None:
+            self.publishing.stop()
+        if self.waveforms is not None:
+            self.waveforms.stop()
+
+    def get_range(self, t0, t1, channels = None, units = False):
+        """
+        returns the samples acquired between t0 and t1 (inclusive). The times
+        are mapped to buffer indices through self.timebase. The samples in
+        self.buffer are copied with a validated read, which is safe while the
+        acquisition is running (see dataq_di_245.ring). The part of the range
+        that is no longer in the ring is read from the recordings in
+        self.archive_directory, if there are any: by buffer index from the
+        recording of the current session, so it joins the ring without a
+        seam, and by time from older recordings.
+
+        Parameters
+        ----------
+        t0, t1 :: float
+            start and end time, seconds
+        channels :: integer, slice or list, optional
+            scan list members, default all
+        units :: boolean, optional
+            convert counts to Volts or degrees C, with the gains the samples
+            were acquired with (see to_units)
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            (N points x N channels) array, int16 counts or float64 units
+
+        Examples
+        --------
+        >>> device.get_range(time() - 10, time(), channels = [0, 2], units = True).shape
+        (20000, 2)
+        """
+        from math import ceil, floor, inf
+        from numpy import concatenate, zeros
+        from dataq_di_245.ring import read_global
+        buffer = self.buffer
+        parts = []
+        first = 0
+        oldest = inf
+        data_last = None
+        if buffer.g_pointer >= 0 and len(self.timebase.segments) > 0:
+            first = int(ceil(self.timebase.index_of(t0) - 1e-3))
+            last = int(floor(self.timebase.index_of(t1) + 1e-3))
+            slack = 0
+            while True:
+                g_pointer = buffer.g_pointer
+                oldest = buffer.oldest + slack
+                end = min(g_pointer, last)
+                if end < max(first, oldest):
+                    break
+                try:
+                    parts.append(read_global(buffer, end - max(first, oldest) + 1, end))
+                    data_last = end
+                    break
+                except IndexError:
+                    # the writer reached the oldest samples during the copy, leave it more room
+                    slack = 2*slack + buffer.packet_length
+        if first < oldest and self.archive is not None:
+            session_first = oldest
+            if self.archive.filename is not None and oldest != inf:
+                session_first = self.archive_first_index
+                if oldest > session_first:
+                    parts.insert(0, self.archive.read_last(max(first, session_first) - session_first,
+                                                           oldest - session_first))
+                    if data_last is None:
+                        data_last = oldest - 1
+            if first < session_first:
+                if session_first == inf:
+                    t_end = t1
+                else:
+                    t_end = self.timebase.time_of(session_first) - 0.5/(self.timebase.rate or 1.0)
+                parts.insert(0, self.archive.get_range(t0, min(t1, t_end), N_of_channels = buffer.shape[1],
+                                                       exclude_last = True))
+        parts = [part for part in parts if part.shape[0] > 0]
+        if len(parts) == 0:
+            data = zeros((0, buffer.shape[1]), dtype = buffer.buffer.dtype)
+        elif len(parts) == 1:
+            data = parts[0]
+        else:
+            data = concatenate(parts)
+        if channels is not None:
+            data = data[:, channels]
+        if units:
+            data = self.to_units(data, last = data_last, channels = channels)
+        return data
 
     def full_stop(self):
-        try:
-            self.dev.full_stop()
-            self.running = False
-        except:
-            warn('dev is not initialized')
+        """
+        stops the acquisition (see stop) and then ends the dispatch threads of
+        all subscriptions, the subscribers are removed
+        """
+        if self.running:
+            self.stop()
+        if self.subscriptions is not None:
+            self.subscriptions.stop()
 
     def save_to_a_file(self):
         debug('save to a file pressed %r' % time())
@@ -211,6 +720,7 @@ class Device(object):
 
 
 if __name__ == "__main__":
+    import logging
     from tempfile import gettempdir
     logging.basicConfig(filename=gettempdir()+'/di_245_DL.log',
                         level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
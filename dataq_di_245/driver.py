@@ -60,15 +60,10 @@ last update: May 29, 2019
 
 """
 
-from numpy import concatenate,zeros,mean,std,uint16, nan
-from serial import Serial
-from time import time, sleep,gmtime, strftime
-from sys import stdout
-import os.path
-from pdb import pm
-from struct import unpack as struct_unpack
-
-import traceback
+# numpy, pyserial and traceback are imported where they are used, which keeps
+# 'import dataq_di_245.driver' fast and free of side effects.
+from threading import RLock
+from time import time, sleep
 
 import logging
 from logging import error,warning,info,debug
@@ -76,7 +71,316 @@ from logging import error,warning,info,debug
 
 __version__ = '2.0.2' #
 
+def decode(buffer, N_of_channels, N_of_points = None):
+    """
+    vectorized conversion of the raw DI-245 byte stream into 14-bit values.
+
+    Every measurement is a little-endian 16-bit word. Bit 0 is the sync bit
+    (0 marks the first member of the scan list) and bit 8 is always set,
+    the remaining 14 bits carry the value. The result is identical to
+    Driver.read_number, but is computed for the whole packet at once.
+
+    Parameters
+    ----------
+    buffer :: bytes string
+        raw data from the serial output buffer
+    N_of_channels :: integer
+        number of channels in the scan list
+    N_of_points :: integer, optional
+        number of datapoints, default is everything available in the buffer
+
+    Returns
+    -------
+    array :: numpy.ndarray
+        int16 array (N channels x N points)
+
+    Examples
+    --------
+    >>> decode(b'\\x00\\x01\\x03\\x01', N_of_channels = 2)
+    array([[0],
+           [1]], dtype=int16)
+    """
+    from numpy import frombuffer
+    words = frombuffer(buffer, dtype = '<u2')
+    if N_of_points is None:
+        N_of_points = words.shape[0]//N_of_channels
+    words = words[:N_of_channels*N_of_points]
+    values = ((words >> 9) << 7) | ((words >> 1) & 0x7F)
+    return values.astype('int16').reshape((N_of_points,N_of_channels)).T
+
+def encode(value_array):
+    """
+    inverse of decode: packs 14-bit values into the raw DI-245 byte stream,
+    including the sync bits.
+
+    Parameters
+    ----------
+    value_array :: numpy.ndarray
+        (N channels x N points) array of values in the range 0..16383
+
+    Returns
+    -------
+    buffer :: bytes string
+        raw data as it would be read from the serial port
+
+    Examples
+    --------
+    >>> encode(numpy.array([[0],[1]]))
+    b'\\x00\\x01\\x03\\x01'
+    """
+    from numpy import asarray
+    values = asarray(value_array).T.astype('<u2') & 0x3FFF
+    words = ((values >> 7) << 9) | 0x100 | ((values & 0x7F) << 1)
+    words[:,1:] |= 1
+    return words.astype('<u2').tobytes()
+
+def decode_into(buffer, out, work = None):
+    """
+    decodes the raw DI-245 byte stream into counts (offset removed) written
+    into a preallocated array, without allocating temporary arrays.
+
+    Parameters
+    ----------
+    buffer :: bytes string
+        raw data, whole scans
+    out :: numpy.ndarray
+        int16 array (N points x N channels), at least as many points as in buffer
+    work :: numpy.ndarray, optional
+        uint16 scratch array of the shape of out, allocated if not given
+
+    Returns
+    -------
+    array :: numpy.ndarray
+        view of out with the decoded points
+
+    Examples
+    --------
+    >>> out = numpy.zeros((100, 4), dtype = 'int16')
+    >>> decode_into(driver.read_buffer(N_of_channels = 4, N_of_points = 10), out).shape
+    (10, 4)
+    """
+    from numpy import frombuffer, right_shift, left_shift, bitwise_and, bitwise_or, subtract, empty_like
+    N_of_channels = out.shape[1]
+    words = frombuffer(buffer, dtype = '<u2')
+    N_of_points = words.shape[0]//N_of_channels
+    words = words[:N_of_points*N_of_channels].reshape((N_of_points, N_of_channels))
+    if work is None:
+        work = empty_like(out, dtype = 'uint16')
+    values = work[:N_of_points]
+    result = out[:N_of_points]
+    right_shift(words, 9, out = values)
+    left_shift(values, 7, out = values)
+    # the low 7 bits are collected in the output array before the offset is removed
+    low = result.view('uint16')
+    right_shift(words, 1, out = low)
+    bitwise_and(low, 0x7F, out = low)
+    bitwise_or(values, low, out = values)
+    subtract(values, 8192, out = result, casting = 'unsafe')
+    return result
+
+def sync_errors(buffer, N_of_channels):
+    """
+    counts scans with wrong sync bits: bit 0 must be 0 in the first word of
+    every scan and 1 in the others, bit 8 must be 1 in every word. A nonzero
+    result means bytes were lost and the stream is misaligned.
+
+    Parameters
+    ----------
+    buffer :: bytes string
+        raw data, starting at the beginning of a scan
+    N_of_channels :: integer
+        number of channels in the scan list
+
+    Returns
+    -------
+    count :: integer
+        number of scans with wrong sync bits
+
+    Examples
+    --------
+    >>> sync_errors(b'\\x00\\x01\\x03\\x01', N_of_channels = 2)
+    0
+    >>> sync_errors(b'\\x03\\x01\\x00\\x01', N_of_channels = 2)
+    1
+    """
+    from numpy import frombuffer
+    words = frombuffer(buffer, dtype = '<u2')
+    words = words[:(words.shape[0]//N_of_channels)*N_of_channels].reshape((-1,N_of_channels))
+    bad = (words & 0x100) == 0
+    bad[:,0] |= (words[:,0] & 1) != 0
+    bad[:,1:] |= (words[:,1:] & 1) != 1
+    return int(bad.any(axis = 1).sum())
+
+class StreamStats(object):
+    """
+    counters of a streaming run, see Driver.iter_raw_packets
+    """
+    def __init__(self, N_of_channels):
+        self.N_of_channels = N_of_channels
+        self.t_start = time()
+        self.t_stop = None
+        self.packets = 0
+        self.scans = 0
+        self.sync_errors = 0
+        self.dropped = 0
+        self.discarded_bytes = 0
+
+    @property
+    def elapsed(self):
+        return (self.t_stop or time()) - self.t_start
+
+    @property
+    def rate(self):
+        """
+        sustained rate, scans per second
+        """
+        return self.scans/self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        """
+        returns one line report
+
+        Examples
+        --------
+        >>> print(stats.summary())
+        received 20000 scans (4 channels) in 10.002 s: 1999.6 scans/s, 100.0 scans/packet, 0 dropped, 0 sync errors
+        """
+        return ('received {} scans ({} channels) in {:.3f} s: {:.1f} scans/s, {:.1f} scans/packet, {} dropped, '
+                '{} sync errors'.format(self.scans, self.N_of_channels, self.elapsed, self.rate,
+                                        self.scans/max(self.packets, 1), self.dropped, self.sync_errors))
+
+class PacketSizer(object):
+    """
+    chooses the number of scans per packet from the measured arrival rate and
+    the backlog of the serial port (see Driver.iter_raw_packets)
+
+    The packet is the smallest power of two that keeps the number of packets
+    per second (the per-call overhead of reading, decoding and processing) at
+    or below max_rate, unless it would take longer than latency to fill; then
+    the latency wins and the packet is the largest power of two that fills
+    within latency. Powers of two keep the operating point from flickering
+    with the rate estimate and the per-length caches (filters.Biquad) small. If the reader falls behind and more
+    than two packets are waiting, the backlog is read in one call of a
+    multiple of the packet size (up to max_points), which amortizes the
+    per-call overhead until the reader has caught up.
+
+    Examples
+    --------
+    >>> sizer = PacketSizer(latency = 0.05, max_rate = 100.0)
+    >>> for packet in driver.iter_packets(sizer = sizer):
+    ...     pass
+    >>> sizer.operating_point()
+    {'rate': 7999.1, 'points_per_packet': 128, 'latency': 0.016, 'packets_per_second': 62.5, ...}
+    """
+    def __init__(self, latency = 0.05, max_rate = 100.0, min_points = 1, max_points = 4096, initial_points = 10,
+                 interval = 0.1, smoothing = 0.3):
+        """
+        Parameters
+        ----------
+        latency :: float
+            maximum time to fill a packet, seconds
+        max_rate :: float
+            target maximum of packets per second
+        min_points, max_points :: integer
+            limits of the packet size, scans
+        initial_points :: integer
+            packet size until the arrival rate is measured
+        interval :: float
+            minimum interval between rate measurements, seconds
+        smoothing :: float
+            weight of a new rate measurement in the exponential average
+        """
+        self.latency = latency
+        self.max_rate = max_rate
+        self.min_points = min_points
+        self.max_points = max_points
+        self.interval = interval
+        self.smoothing = smoothing
+        self.points = max(min_points, min(max_points, initial_points))
+        self.rate = None
+        self.backlog = 0
+        self.catch_up = 0
+        self.changes = 0
+        self.last = None
+
+    def restart(self):
+        """
+        a new stream starts counting scans from zero, the next update only
+        takes the reference point; the rate estimate and packet size are kept
+        """
+        self.last = None
+
+    def update(self, arrived, t):
+        """
+        updates the arrival rate from the total number of scans that arrived
+        (read and waiting) until time t and chooses the packet size
+        """
+        from math import ceil, log2
+        if self.last is None:
+            self.last = arrived, t
+            return
+        dt = t - self.last[1]
+        if dt < self.interval:
+            return
+        rate = (arrived - self.last[0])/dt
+        self.last = arrived, t
+        if self.rate is None:
+            self.rate = rate
+        else:
+            self.rate += self.smoothing*(rate - self.rate)
+        if self.rate <= 0:
+            return
+        # next power of two up: at most max_rate packets per second
+        points = 2**int(ceil(log2(max(self.rate/self.max_rate, 1.0))))
+        if points > self.rate*self.latency:
+            # latency is the bound, next power of two down: fills within latency
+            points = 2**(int(max(self.rate*self.latency, 1.0)).bit_length() - 1)
+        points = max(self.min_points, min(self.max_points, points))
+        if points != self.points:
+            self.points = points
+            self.changes += 1
+            info('packet size {} scans: {:.1f} scans/s, {:.4f} s latency, {:.1f} packets/s'.format(
+                points, self.rate, points/self.rate, self.rate/points))
+
+    def next(self, waiting):
+        """
+        returns the number of scans to read now, 0 to wait for more
+        """
+        self.backlog = waiting
+        if waiting >= 2*self.points:
+            self.catch_up += 1
+            return min(self.max_points, (waiting//self.points)*self.points)
+        if waiting >= self.points:
+            return self.points
+        return 0
+
+    def wait_time(self, waiting):
+        """
+        time to sleep before the packet is complete, seconds
+        """
+        if not self.rate:
+            return 0.001
+        return min(0.01, max(0.001, 0.5*(self.points - waiting)/self.rate))
+
+    def operating_point(self):
+        """
+        returns dictionary: measured rate (scans/s), points_per_packet,
+        latency (s), packets_per_second, backlog (scans waiting), catch_up
+        (reads of a backlog) and changes (of the packet size)
+        """
+        result = {}
+        result['rate'] = self.rate
+        result['points_per_packet'] = self.points
+        result['latency'] = self.points/self.rate if self.rate else None
+        result['packets_per_second'] = self.rate/self.points if self.rate else None
+        result['backlog'] = self.backlog
+        result['catch_up'] = self.catch_up
+        result['changes'] = self.changes
+        return result
+
+
 class Driver(object):
+    xrate_command = b'xrate 4099 2000 \x0D'
 
     def __init__(self, serial_number = None):
         """        instance init command
@@ -84,15 +388,30 @@ class Driver(object):
         self.port = None
         self.timeout = 2
         self.acquiring = False
+        self.serial_number = None
+        self.cache = None
+        self.description = {}
+        self.description_cached = False
+        self.refresh_thread = None
+        # one command (a write, or a write and its reply) on the port at a time
+        self.lock = RLock()
+        self.scan_lst = []
+        self.scan_config = None
+        self.stream_stats = None
         #self.serial_number = '56671FE4A'
 
 
-    def init(self, serial_number = ''):
+    def init(self, serial_number = '', cache = None):
         """
         orderly initialization of the DI-245 driver object
 
         Parameters
         ----------
+        serial_number :: str, optional
+            USB serial number of the device, None selects the first available DI-245
+        cache :: DeviceCache, optional
+            if the cache has the description of this device, the slow
+            description queries are skipped. See refresh_description.
 
         Returns
         -------
@@ -101,6 +420,7 @@ class Driver(object):
         --------
         >>> driver.init()
         """
+        self.cache = cache
 
         if len(self.available_ports) != 0:
             if serial_number is None:
@@ -109,11 +429,15 @@ class Driver(object):
                 self.port = self.use_com_port(serial_number)
             if self.port is not None:
                 self.stop_scan()
-                self.description = {}
-                self.description['Device name'] = self.query(command=b'A1')[2:]
-                self.description['Firmware version'] = self.query(command=b'A2')[2:]
-                self.description['Last Calibration date in hex'] = self.query(command=b'A7')[2:]
-                self.description['Serial Number'] = self.query(command=b'NZ')[2:]
+                description = None
+                if cache is not None:
+                    description = cache.get_description(self.serial_number)
+                if description:
+                    self.description = description
+                    self.description_cached = True
+                    info('using cached description of the DI-245 {}'.format(self.serial_number))
+                else:
+                    self.refresh_description()
                 for i in self.description.keys():
                     info("{},{}".format(i, self.description[i]))
                 info('Complete: Initialization of the DI-245 with SN {}'.format(self.description['Serial Number']))
@@ -125,6 +449,102 @@ class Driver(object):
             info('no DI-245 available')
             return False
 
+    def refresh_description(self):
+        """
+        queries device name, firmware version, calibration date and serial
+        number from the device and updates the cache. The device must not be
+        scanning. The port is locked until all replies are read, other
+        commands (e.g. from another thread) wait.
+
+        Returns
+        -------
+        description :: dict
+
+        Examples
+        --------
+        >>> driver.refresh_description()
+        {'Device name': b'2450', 'Firmware version': b'6B', ...}
+        """
+        description = {}
+        with self.lock:
+            description['Device name'] = self.query(command=b'A1')[2:]
+            description['Firmware version'] = self.query(command=b'A2')[2:]
+            description['Last Calibration date in hex'] = self.query(command=b'A7')[2:]
+            description['Serial Number'] = self.query(command=b'NZ')[2:]
+        self.description = description
+        self.description_cached = False
+        if self.cache is not None:
+            self.cache.set_description(self.serial_number, description)
+        return description
+
+    def refresh_description_in_background(self):
+        """
+        refreshes a cached description in a separate thread while the device
+        is idle. Commands on the port wait for the refresh to finish (see
+        self.lock), start_scan joins it.
+        """
+        from threading import Thread
+        if self.description_cached and not self.acquiring:
+            self.refresh_thread = Thread(target = self.refresh_description)
+            self.refresh_thread.daemon = True
+            self.refresh_thread.start()
+
+    @property
+    def connected(self):
+        """
+        False if the serial port is closed or lost (e.g. USB cable unplugged)
+        """
+        if self.port is None:
+            return False
+        waiting = self.waiting[0]
+        return waiting == waiting
+
+    def reconnect(self, timeout = None, interval = 0.5, abort = None):
+        """
+        closes the lost port, waits for the DI-245 with the same serial number
+        to reappear and initializes it again (with the cached description, if
+        a cache was given to init).
+
+        Parameters
+        ----------
+        timeout :: float, optional
+            maximum time to wait, seconds. Default is to wait forever.
+        interval :: float, optional
+            polling interval of the available ports, seconds
+        abort :: callable, optional
+            returns True if waiting should be aborted
+
+        Returns
+        -------
+        flag :: boolean
+            True if the device is connected again
+
+        Examples
+        --------
+        >>> driver.reconnect(timeout = 60)
+        True
+        """
+        self.acquiring = False
+        try:
+            with self.lock:
+                self.port.close()
+        except Exception as err:
+            debug('closing lost port: {}'.format(err))
+        self.port = None
+        tstart = time()
+        while timeout is None or time() - tstart < timeout:
+            if abort is not None and abort():
+                break
+            if self.serial_number in [port[1] for port in self.available_ports]:
+                try:
+                    if self.init(self.serial_number, cache = self.cache):
+                        info('DI-245 {} is reconnected'.format(self.serial_number))
+                        return True
+                except Exception as err:
+                    warning('DI-245 {} reconnect failed: {}'.format(self.serial_number, err))
+            sleep(interval)
+        return False
+
     def use_com_port(self,serial_number = None):
         """
         1) connect to the serial port in self.available_ports(N)
@@ -157,9 +577,11 @@ class Driver(object):
                 for device in devices:
                     if device.serial_number == serial_number:
                         port_name = device.device
+                        self.serial_number = serial_number
             else:
-                port_name = self.available_ports[0][0]
+                port_name, self.serial_number = self.available_ports[0][:2]
         if port_name is not None:
+            from serial import Serial
             port = Serial(port_name, baudrate=115200, rtscts=True, timeout=0.1)
             #self.stop_scan()
             port.flushInput()
@@ -264,14 +686,16 @@ class Driver(object):
         if port is None:
             port = self.port
         try:
-            if port.isOpen():
-                port.flushInput()
-                port.flushOutput()
-                port.write(command)
-                result = True
-            else:
-                result = False
+            with self.lock:
+                if port.isOpen():
+                    port.flushInput()
+                    port.flushOutput()
+                    port.write(command)
+                    result = True
+                else:
+                    result = False
         except:
+            import traceback
             error(traceback.format_exc())
             result = False
         return result
@@ -300,8 +724,9 @@ class Driver(object):
         """
         if port is None:
             port = self.port
-        self.write(command = command, port = port)
-        response = self.read(Nbytes = Nbytes, port =port)
+        with self.lock:
+            self.write(command = command, port = port)
+            response = self.read(Nbytes = Nbytes, port =port)
         return response
 
     def flush(self,port=None, input = True, output = True):
@@ -349,12 +774,14 @@ class Driver(object):
         if port is None:
             port = self.port
         try:
-            if port.isOpen():
-                port.close()
-                result = True
-            else:
-                result = False
+            with self.lock:
+                if port.isOpen():
+                    port.close()
+                    result = True
+                else:
+                    result = False
         except:
+            import traceback
             error(traceback.format_exc())
             result = False
         return result
@@ -363,7 +790,7 @@ class Driver(object):
     #an example: chn(0x20)member(0x20)value(0x0D)
     #2-byte value needs to be converted from binary to int. The binary 2 byte start counting from right.
     #The values in the function definition are default values in case user does not specify them.
-    def config_channels(self,scan_lst = ['0','1','2','3'],phys_ch_lst = ['0','1','2','3'],gain_lst = ['5','5','5','T-thrmc'], rate = 0):
+    def config_channels(self,scan_lst = ['0','1','2','3'],phys_ch_lst = ['0','1','2','3'],gain_lst = ['5','5','5','T-thrmc'], rate = 0, config = None):
         """
         configures channels: maps physical channel list on the scan list with defined gains.
         configures readout rate.
@@ -382,63 +809,39 @@ class Driver(object):
         rate :: float
             rate of data collection
 
+        config :: ScanConfig, optional
+            compiled configuration, replaces scan_lst, phys_ch_lst and gain_lst
+
         Returns
         -------
-        ToDo... Add what is returned if any.
+        tuple :: (integer, list)
+            1 if every command was echoed correctly, 0 otherwise, and the
+            result (True/False) of every command
+
+        Raises
+        ------
+        ValueError
+            if the configuration is not valid, nothing is sent to the device
 
         Examples
         --------
-        >>> driver.config_channels
-        """
-
-        self.scan_lst = scan_lst
-        self.phys_ch_lst = phys_ch_lst
-        self.gain_lst = gain_lst
-
-        _config_dict_gain = {}
-        _config_dict_gain['0.010'] = '00101'
-        _config_dict_gain['0.025'] = '00100'
-        _config_dict_gain['0.05'] = '00011'
-        _config_dict_gain['0.1'] = '00010'
-        _config_dict_gain['0.25'] = '00001' #works
-        _config_dict_gain['0.5'] = '00000'
-        _config_dict_gain['1'] = '01101'
-        _config_dict_gain['2.5'] = '01100'
-        _config_dict_gain['5'] = '01011' #
-        _config_dict_gain['10'] = '01010'
-        _config_dict_gain['25'] = '01001'
-        _config_dict_gain['50'] = '01000'
-        _config_dict_gain['B-thrmc'] = b'10000'
-        _config_dict_gain['E-thrmc'] = b'10001'
-        _config_dict_gain['J-thrmc'] = b'10010'
-        _config_dict_gain['K-thrmc'] = b'10011'
-        _config_dict_gain['N-thrmc'] = '10100'
-        _config_dict_gain['R-thrmc'] = '10101'
-        _config_dict_gain['S-thrmc'] = '10110'
-        _config_dict_gain['T-thrmc'] = '10111'
+        >>> driver.config_channels(scan_lst = ['0','1'], phys_ch_lst = ['0','1'], gain_lst = ['5','T-thrmc'])
+        (1, [True, True, True])
+        """
+        from dataq_di_245.config import ScanConfig
+        if config is None:
+            config = ScanConfig(scan_lst, phys_ch_lst, gain_lst, xrate_command = self.xrate_command)
+        self.scan_config = config
+        self.scan_lst = list(config.scan_lst)
+        self.phys_ch_lst = list(config.phys_ch_lst)
+        self.gain_lst = list(config.gain_lst)
+
         result = []
-        for i in range(len(self.scan_lst)):
-            config_byte = str(int('000'+_config_dict_gain[self.gain_lst[i]]+'0000' +
-                                  bin(int(self.phys_ch_lst[i]))[2:].zfill(4),2))
-            ch_config_command = b'chn '+bytes(self.scan_lst[i],'Latin-1')+b' '+bytes(config_byte,'Latin-1')+b' \x0D'
-
-            command = ch_config_command
-            Nbytes = len(command)
-            debug('configuring: {}'.format(command))
-            if self.query(command = command, Nbytes = Nbytes, port = self.port) == ch_config_command:
-                result.append(True)
-            else:
-                result.append(False)
-
-        xrate_config_command = b'xrate 4099 2000 \x0D'
-        command = xrate_config_command
-        Nbytes = len(command)
-        debug('configuring: {}'.format(command))
-        if self.query(command = command, Nbytes = Nbytes, port = self.port) == xrate_config_command:
-            result.append(True)
-        else:
-            result.append(False)
-        return int(mean(result)), result
+        with self.lock:
+            for command in config.commands:
+                debug('configuring: {}'.format(command))
+                result.append(self.query(command = command, Nbytes = len(command), port = self.port) == command)
+        return int(all(result)), result
 
     def read_buffer(self, N_of_channels, N_of_points = 1):
         """
@@ -464,7 +867,11 @@ class Driver(object):
         --------
         >>> raw_data = driver.read_number(N_of_channels = 4, N_of_points = 2)
         """
-        data_bytes = self.port.read(2*N_of_channels*N_of_points)
+        Nbytes = 2*N_of_channels*N_of_points
+        data_bytes = self.port.read(Nbytes)
+        if len(data_bytes) < Nbytes:
+            raise IOError('read {} bytes out of {} from the DI-245 {}'.format(len(data_bytes), Nbytes,
+                                                                              self.serial_number))
         return data_bytes
 
     def convert_buffer_to_array(self, buffer, N_of_channels, N_of_points = 1):
@@ -494,11 +901,12 @@ class Driver(object):
 
         Examples
         --------
-        >>> arr = driver.read_number(buffer = raw_data, N_of_channels = 4, N_of_points = 2)
-
+        >>> raw_data = driver.read_buffer(N_of_channels = 4, N_of_points = 2)
+        >>> arr = driver.convert_buffer_to_array(buffer = raw_data, N_of_channels = 4, N_of_points = 2)
+        >>> arr.shape
+        (4,2)
         """
-
-        raise NotImplementedError
+        return decode(buffer, N_of_channels, N_of_points)
 
     def sync_read_buffer(self,N_of_channels = 4):
         from struct import unpack
@@ -512,6 +920,167 @@ class Driver(object):
             else:
                 syncronizing = False
 
+    def resync(self, N_of_channels):
+        """
+        realigns the stream after bytes were lost: skips bytes up to the first
+        word of the next scan (the only byte with bit 0 cleared is the low byte
+        of the first scan list member) and discards that scan.
+
+        Parameters
+        ----------
+        N_of_channels :: integer
+            number of channels in the scan list
+
+        Returns
+        -------
+        Nbytes :: integer
+            number of bytes discarded
+
+        Examples
+        --------
+        >>> driver.resync(N_of_channels = 4)
+        9
+        """
+        Nbytes = 0
+        while True:
+            byte = self.port.read(1)
+            if len(byte) == 0:
+                raise IOError('DI-245 {} stopped streaming while resynchronizing'.format(self.serial_number))
+            Nbytes += 1
+            if byte[0] & 1 == 0:
+                break
+        Nbytes += len(self.port.read(2*N_of_channels - 1))
+        return Nbytes
+
+    def iter_raw_packets(self, points_per_packet = 100, N_of_channels = None, max_latency = None,
+                         duration = None, scan = True, abort = None, sizer = None):
+        """
+        generator of raw packets. Packets with wrong sync bits are dropped and
+        the stream is realigned (see resync); the counters of the run are kept
+        in self.stream_stats.
+
+        Parameters
+        ----------
+        points_per_packet :: integer
+            scans per packet
+        N_of_channels :: integer, optional
+            number of channels in the scan list, default is the configured scan list
+        max_latency :: float, optional
+            if given, the scans available after max_latency seconds are yielded
+            as a shorter packet instead of waiting for a full one
+        duration :: float, optional
+            stop after duration seconds, default is to stream until closed
+        scan :: boolean, optional
+            start the scan before the first packet and stop it when the
+            generator is exhausted or closed. False if the caller controls the scan.
+        abort :: callable, optional
+            returns True if streaming should end
+        sizer :: PacketSizer, optional
+            chooses the packet size from the arrival rate and the backlog,
+            points_per_packet and max_latency are ignored
+
+        Yields
+        ------
+        packet :: tuple
+            (index of the first scan, arrival time, raw bytes)
+
+        Examples
+        --------
+        >>> for index, t, raw in driver.iter_raw_packets(100, duration = 10):
+        ...     f.write(raw)
+        """
+        if N_of_channels is None:
+            N_of_channels = len(self.scan_lst)
+        scan_size = 2*N_of_channels
+        stats = self.stream_stats = StreamStats(N_of_channels)
+        if sizer is not None:
+            sizer.restart()
+        if scan:
+            self.start_scan()
+            stats.t_start = time()
+        index = 0
+        t_last = time()
+        try:
+            while (duration is None or time() - stats.t_start < duration) and not (abort is not None and abort()):
+                waiting = self.waiting[0]
+                if waiting != waiting:
+                    raise IOError('DI-245 {} is lost'.format(self.serial_number))
+                if sizer is not None:
+                    sizer.update(stats.scans + stats.dropped + waiting//scan_size, time())
+                    N_of_points = sizer.next(waiting//scan_size)
+                    if N_of_points == 0:
+                        sleep(sizer.wait_time(waiting//scan_size))
+                        continue
+                elif waiting >= scan_size*points_per_packet:
+                    N_of_points = points_per_packet
+                elif max_latency is not None and waiting >= scan_size and time() - t_last >= max_latency:
+                    N_of_points = waiting//scan_size
+                else:
+                    sleep(0.001)
+                    continue
+                raw = self.read_buffer(N_of_channels = N_of_channels, N_of_points = N_of_points)
+                if sync_errors(raw, N_of_channels):
+                    stats.sync_errors += 1
+                    stats.dropped += N_of_points
+                    stats.discarded_bytes += len(raw) + self.resync(N_of_channels)
+                    index += N_of_points
+                    continue
+                t_last = time()
+                stats.packets += 1
+                stats.scans += N_of_points
+                yield index, t_last, raw
+                index += N_of_points
+        finally:
+            stats.t_stop = time()
+            if scan:
+                self.stop_scan()
+
+    def iter_packets(self, points_per_packet = 100, max_latency = None, N_of_channels = None, copy = False,
+                     sizer = None, **kwargs):
+        """
+        generator of decoded packets: (N points x N channels) int16 arrays of
+        counts (offset removed), the layout of Device.buffer. Starts and stops
+        the scan and resynchronizes internally, see iter_raw_packets for the
+        other keyword arguments.
+
+        The packets are views into one reusable array that is overwritten by
+        the next packet; use copy = True to keep them.
+
+        Parameters
+        ----------
+        points_per_packet :: integer
+            scans per packet
+        max_latency :: float, optional
+            maximum time to wait for a full packet, seconds
+        N_of_channels :: integer, optional
+            number of channels in the scan list, default is the configured scan list
+        copy :: boolean, optional
+            yield new arrays instead of views
+        sizer :: PacketSizer, optional
+            adaptive packet size, see PacketSizer
+
+        Examples
+        --------
+        >>> packets = driver.iter_packets(100, max_latency = 0.05)
+        >>> means = (packet.mean(axis = 0) for packet in packets)
+        >>> next(means)
+        array([ 12.3, -400.1, 3.0, 1.2])
+        """
+        from numpy import empty
+        if N_of_channels is None:
+            N_of_channels = len(self.scan_lst)
+        N_of_points = points_per_packet if sizer is None else sizer.max_points
+        out = empty((N_of_points, N_of_channels), dtype = 'int16')
+        work = empty((N_of_points, N_of_channels), dtype = 'uint16')
+        packets = self.iter_raw_packets(points_per_packet, N_of_channels = N_of_channels,
+                                        max_latency = max_latency, sizer = sizer, **kwargs)
+        try:
+            for index, t, raw in packets:
+                packet = decode_into(raw, out, work)
+                yield packet.copy() if copy else packet
+        finally:
+            packets.close()
+
 
     def read_number(self, N_of_channels, N_of_points = 1):
         """
@@ -537,6 +1106,7 @@ class Driver(object):
         (4,2)
         """
         from struct import unpack
+        from numpy import zeros
         channels_to_read = N_of_channels
         datapoints_to_read = N_of_points
         value_array = zeros((channels_to_read,N_of_points),dtype = 'int16')
@@ -581,6 +1151,7 @@ class Driver(object):
         >>> driver.waiting()
         (0,0)
         """
+        from math import nan
         if port is None:
             port = self.port
         try:
@@ -604,6 +1175,9 @@ class Driver(object):
         --------
         >>> driver.start_scan()
         """
+        if self.refresh_thread is not None:
+            self.refresh_thread.join()
+            self.refresh_thread = None
         self.flush()
         self.write(b'(0x00) S1')
         self.acquiring = True
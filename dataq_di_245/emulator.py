@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+DI-245 emulator: pyserial-like port object that answers the DI-245 command set
+and produces the binary data stream, and a Driver that uses it.
+
+The emulator answers the description queries (A1, A2, A7, NZ), echoes the
+"chn" and "xrate" configuration commands and streams 16-bit words with the
+proper sync bits after "S1" until "S0". Two timing modes are supported:
+
+    rate = None     free running, data is produced as fast as it is read.
+                    Used for throughput benchmarks.
+    rate = float    scans per second, data accumulates in real time as it
+                    would on the real device.
+
+The signal is given in raw values, or with voltage = callable in Volts at the
+inputs; then the emulator applies the ranges configured with "chn" like the
+device does, so switching ranges changes the counts (see autorange.py).
+
+Examples
+--------
+>>> from dataq_di_245.emulator import EmulatedDriver
+>>> driver = EmulatedDriver()
+>>> driver.port = driver.use_com_port()
+>>> driver.start_scan()
+>>> driver.read_number(N_of_channels = 4, N_of_points = 10).shape
+(4, 10)
+
+Valentyn Stadnytskyi
+"""
+from time import time, sleep
+from logging import debug
+
+from dataq_di_245.driver import Driver, encode
+
+
+def default_signal(t, N_of_channels):
+    """
+    default emulated signal: a sine wave of different frequency on every
+    channel plus some noise, raw 14-bit values (8192 is zero)
+
+    Parameters
+    ----------
+    t :: numpy.ndarray
+        time of every scan, seconds
+    N_of_channels :: integer
+        number of channels in the scan list
+
+    Returns
+    -------
+    array :: numpy.ndarray
+        (N channels x N points) array of values in the range 0..16383
+    """
+    from numpy import sin, pi, arange, newaxis
+    from numpy.random import normal
+    frequency = (arange(N_of_channels) + 1.0)[:, newaxis]
+    signal = 4000*sin(2*pi*frequency*t[newaxis, :]) + normal(0, 10, size = (N_of_channels, t.shape[0]))
+    return (signal + 8192).clip(0, 2**14 - 1)
+
+
+def full_scale_of(word):
+    """
+    returns the full scale (Volts) of a channel configuration word of the
+    chn command, None for thermocouples
+    """
+    from dataq_di_245.config import gain_codes
+    from dataq_di_245.conversion import ranges
+    code = word >> 8
+    for gain, value in gain_codes.items():
+        if value == code:
+            return ranges.get(gain)
+    return None
+
+
+class EmulatedPort(object):
+    """
+    pyserial-like emulated DI-245 serial port
+    """
+    description = {}
+    description[b'A1'] = b'2450'
+    description[b'A2'] = b'6B'
+    description[b'A7'] = b'FFFFFFFF'
+
+    def __init__(self, port = 'EMULATED', serial_number = 'EMULATED0', N_of_channels = 4,
+                 rate = None, signal = default_signal, timeout = 0.1, voltage = None):
+        self.port = port
+        self.serial_number = serial_number
+        self.N_of_channels = N_of_channels
+        self.rate = rate
+        self.signal = signal
+        self.voltage = voltage
+        self.full_scale = {}
+        self.timeout = timeout
+        self.is_open = True
+        self.scanning = False
+        self.out_waiting = 0
+        self.rx_size = 409200
+        self.scans = 0
+        self._output = bytearray()
+        self._channels = set()
+        self.lost = False
+
+    def _check(self):
+        if self.lost:
+            from serial import SerialException
+            raise SerialException('device reports readiness to read but returned no data '
+                                  '(device disconnected or multiple access on port?)')
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        self.is_open = False
+
+    def set_buffer_size(self, rx_size = 4096, tx_size = None):
+        self.rx_size = rx_size
+
+    def flushInput(self):
+        self._update()
+        del self._output[:]
+    reset_input_buffer = flushInput
+
+    def flushOutput(self):
+        pass
+    reset_output_buffer = flushOutput
+
+    def write(self, command):
+        """
+        interprets the command and queues the reply
+        """
+        self._check()
+        debug('emulator received {!r}'.format(command))
+        if b'S1' in command:
+            self._output += b'S1'
+            self.scanning = True
+            self.scans = 0
+            self.t_start = time()
+        elif b'S0' in command:
+            self._update()
+            self.scanning = False
+            self._output += b'S0'
+        elif command.startswith(b'chn') or command.startswith(b'xrate'):
+            if command.startswith(b'chn'):
+                member, word = command.split()[1:3]
+                self._channels.add(int(member))
+                self.N_of_channels = len(self._channels)
+                self.full_scale[int(member)] = full_scale_of(int(word))
+            self._output += command
+        elif command.strip(b'\x00') == b'NZ':
+            self._output += b'NZ' + self.serial_number.encode('Latin-1')
+        else:
+            key = command.strip(b'\x00')
+            self._output += key + self.description.get(key, b'')
+        return len(command)
+
+    def _update(self, Nbytes = 0):
+        """
+        appends newly acquired scans to the output
+        """
+        from numpy import arange
+        if not self.scanning:
+            return
+        scan_size = 2*self.N_of_channels
+        if self.rate is None:
+            missing = max(Nbytes, self.rx_size) - len(self._output)
+            N = -(-missing//scan_size)
+        else:
+            N = int((time() - self.t_start)*self.rate) - self.scans
+            N = min(N, (self.rx_size - len(self._output))//scan_size)
+        if N > 0:
+            rate = self.rate or 8000.0/self.N_of_channels
+            t = (self.scans + arange(N))/rate
+            self._output += encode(self.values(t))
+            self.scans += N
+
+    def values(self, t):
+        """
+        returns (N channels x N points) raw values at times t
+        """
+        from numpy import array, newaxis
+        if self.voltage is None:
+            return self.signal(t, self.N_of_channels)
+        scale = array([self.full_scale.get(member) or 0.0 for member in range(self.N_of_channels)])
+        gain = array([8192/value if value else 0.0 for value in scale])[:, newaxis]
+        return (self.voltage(t, self.N_of_channels)*gain + 8192).round().clip(0, 2**14 - 1)
+
+    def inWaiting(self):
+        self._check()
+        self._update()
+        return len(self._output)
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def read(self, size = 1):
+        """
+        reads size bytes, waits up to timeout if not enough data is available
+        """
+        self._check()
+        tstart = time()
+        self._update(size)
+        while len(self._output) < size and time() - tstart < self.timeout:
+            sleep(0.001)
+            self._update(size)
+        data = bytes(self._output[:size])
+        del self._output[:size]
+        return data
+
+    def readline(self):
+        self._update()
+        data = bytes(self._output)
+        del self._output[:]
+        return data
+
+
+class EmulatedDriver(Driver):
+    """
+    Driver connected to an emulated DI-245. The emulator answers immediately,
+    so queries wait read_timeout/10 instead of the 1 s needed by the hardware;
+    use read_timeout = 10 to reproduce the real timing.
+    """
+    def __init__(self, serial_number = 'EMULATED0', read_timeout = 0.1, **kwargs):
+        Driver.__init__(self)
+        self.emulator_serial_number = serial_number
+        self.read_timeout = read_timeout
+        self.emulator_kwargs = kwargs
+
+    def read(self, Nbytes = None, port = None, timeout = None):
+        if timeout is None:
+            timeout = self.read_timeout
+        return Driver.read(self, Nbytes = Nbytes, port = port, timeout = timeout)
+
+    plugged = True
+
+    def get_available_ports(self):
+        if not self.plugged:
+            return []
+        return [['EMULATED', self.emulator_serial_number, 'DI245 emulator']]
+    available_ports = property(get_available_ports)
+
+    def unplug(self):
+        """
+        emulates disconnect of the USB cable: the port is lost and the device
+        disappears from the available ports
+        """
+        self.plugged = False
+        if self.port is not None:
+            self.port.lost = True
+
+    def replug(self):
+        """
+        emulates reconnect of the USB cable, the device has lost its configuration
+        """
+        self.plugged = True
+
+    def use_com_port(self, serial_number = None):
+        if not self.plugged or serial_number not in (None, '', self.emulator_serial_number):
+            return None
+        self.serial_number = self.emulator_serial_number
+        port = EmulatedPort(serial_number = self.emulator_serial_number, **self.emulator_kwargs)
+        port.flushInput()
+        port.flushOutput()
+        return port
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Streaming digital filters with persistent per-channel state.
+
+Every filter processes one packet, a (N points x N channels) array, at a time
+with NumPy and keeps its state between packets, so the output is identical
+to filtering the whole stream at once: there are no transients at packet
+boundaries. The state is initialized from the first sample (steady state),
+which also avoids the start-up transient.
+
+    MovingAverage   mean of the last length samples
+    SOSFilter       cascade of biquad (second order) IIR sections
+    FIRDecimator    FIR low-pass filter keeping every factor-th sample
+
+An IIR section is a linear state-space system, so a packet of L samples is
+y = H x + G z0 and the state after it z = M x + F z0 with matrices that only
+depend on L. They are computed once per packet length; filtering a packet is
+then a few matrix products instead of a loop over samples.
+
+Averaging and low-pass filtering of the oversampled 14-bit stream reduces the
+noise, the output is float64 counts with resolution beyond 14 bits.
+
+Filters are configured with dictionaries (Device.filters):
+
+    {'type': 'moving_average', 'length': 10}
+    {'type': 'lowpass', 'order': 4, 'cutoff': 0.05}     cutoff relative to Nyquist
+    {'type': 'highpass', 'order': 2, 'cutoff': 0.001}
+    {'type': 'sos', 'sos': [[b0, b1, b2, 1, a1, a2], ...]}
+    {'type': 'fir_decimator', 'factor': 10}
+
+Examples
+--------
+>>> chain = FilterChain([{'type': 'lowpass', 'order': 4, 'cutoff': 0.1},
+...                      {'type': 'fir_decimator', 'factor': 10}])
+>>> for packet in driver.iter_packets(100):
+...     filtered = chain.process(packet)       # (10 x N channels) float64
+
+Valentyn Stadnytskyi
+"""
+
+
+class MovingAverage(object):
+    factor = 1
+
+    def __init__(self, length):
+        self.length = length
+        self.history = None
+
+    def reset(self):
+        self.history = None
+
+    def process(self, value_array):
+        from numpy import concatenate, cumsum, zeros, repeat
+        x = value_array.astype('float64')
+        if x.shape[0] == 0:
+            return x
+        if self.history is None:
+            self.history = repeat(x[:1], self.length - 1, axis = 0)
+        extended = concatenate((self.history, x))
+        sums = concatenate((zeros((1, x.shape[1])), cumsum(extended, axis = 0)))
+        self.history = extended[extended.shape[0] - (self.length - 1):]
+        return (sums[self.length:] - sums[:-self.length])/self.length
+
+
+def butterworth_sos(order, cutoff, kind = 'lowpass'):
+    """
+    second order sections of a digital Butterworth filter (bilinear
+    transform), equivalent to scipy.signal.butter(order, cutoff, kind, output = 'sos')
+
+    Parameters
+    ----------
+    order :: integer
+        filter order
+    cutoff :: float
+        -3 dB frequency relative to the Nyquist frequency, 0 < cutoff < 1
+    kind :: str
+        'lowpass' or 'highpass'
+
+    Returns
+    -------
+    sos :: numpy.ndarray
+        (N sections x 6) array of [b0, b1, b2, 1, a1, a2]
+    """
+    from numpy import pi, sin, cos, tan, array
+    if not 0 < cutoff < 1:
+        raise ValueError('cutoff must be between 0 and 1 (Nyquist), got {}'.format(cutoff))
+    if kind not in ('lowpass', 'highpass'):
+        raise ValueError('unknown filter kind {!r}'.format(kind))
+    w0 = pi*cutoff
+    sections = []
+    for k in range(order//2):
+        theta = pi*(2*(k + 1) + order - 1)/(2*order)
+        alpha = sin(w0)*(-cos(theta))
+        if kind == 'lowpass':
+            b = [(1 - cos(w0))/2, 1 - cos(w0), (1 - cos(w0))/2]
+        else:
+            b = [(1 + cos(w0))/2, -(1 + cos(w0)), (1 + cos(w0))/2]
+        a = [1 + alpha, -2*cos(w0), 1 - alpha]
+        sections.append([b[0]/a[0], b[1]/a[0], b[2]/a[0], 1.0, a[1]/a[0], a[2]/a[0]])
+    if order % 2:
+        K = tan(w0/2)
+        if kind == 'lowpass':
+            b = [K/(1 + K), K/(1 + K), 0.0]
+        else:
+            b = [1/(1 + K), -1/(1 + K), 0.0]
+        sections.append(b + [1.0, (K - 1)/(K + 1), 0.0])
+    return array(sections)
+
+
+class Biquad(object):
+    """
+    one second order section in transposed direct form II, as a state-space
+    system z[n+1] = A z[n] + B x[n], y[n] = C z[n] + D x[n]. Packets longer
+    than block_length are filtered in blocks, which bounds the size of the
+    (L x L) matrices.
+    """
+    block_length = 256
+
+    def __init__(self, section):
+        from numpy import array
+        b0, b1, b2, a0, a1, a2 = [value/section[3] for value in section]
+        self.A = array([[-a1, 1.0], [-a2, 0.0]])
+        self.B = array([b1 - a1*b0, b2 - a2*b0])
+        self.C = array([1.0, 0.0])
+        self.D = b0
+        self.state = None
+        self.matrices = {}
+
+    def reset(self):
+        self.state = None
+
+    def steady_state(self, x0):
+        """
+        state (2 x N channels) of the section after a constant input x0 (N channels)
+        """
+        from numpy import eye, outer
+        from numpy.linalg import solve
+        return outer(solve(eye(2) - self.A, self.B), x0)
+
+    def get_matrices(self, L):
+        """
+        returns H (L x L), G (L x 2), M (2 x L) and F (2 x 2) for packets of L samples
+        """
+        from numpy import zeros, eye
+        if L not in self.matrices:
+            powers = [eye(2)]
+            for i in range(L):
+                powers.append(self.A.dot(powers[-1]))
+            h = zeros(L)
+            h[0] = self.D
+            for k in range(1, L):
+                h[k] = self.C.dot(powers[k - 1]).dot(self.B)
+            H = zeros((L, L))
+            for k in range(L):
+                H[range(k, L), range(0, L - k)] = h[k]
+            G = zeros((L, 2))
+            M = zeros((2, L))
+            for i in range(L):
+                G[i] = self.C.dot(powers[i])
+                M[:, i] = powers[L - 1 - i].dot(self.B)
+            if len(self.matrices) > 16:
+                self.matrices.clear()
+            self.matrices[L] = (H, G, M, powers[L])
+        return self.matrices[L]
+
+    def process(self, x):
+        from numpy import concatenate
+        if x.shape[0] > self.block_length:
+            B = self.block_length
+            return concatenate([self.process(x[i:i + B]) for i in range(0, x.shape[0], B)])
+        if self.state is None:
+            self.state = self.steady_state(x[0])
+        H, G, M, F = self.get_matrices(x.shape[0])
+        y = H.dot(x) + G.dot(self.state)
+        self.state = M.dot(x) + F.dot(self.state)
+        return y
+
+
+class SOSFilter(object):
+    factor = 1
+
+    def __init__(self, sos):
+        """
+        Parameters
+        ----------
+        sos :: array_like
+            (N sections x 6) second order sections [b0, b1, b2, a0, a1, a2]
+        """
+        self.sections = [Biquad(section) for section in sos]
+
+    def reset(self):
+        for section in self.sections:
+            section.reset()
+
+    def process(self, value_array):
+        x = value_array.astype('float64')
+        if x.shape[0] == 0:
+            return x
+        for section in self.sections:
+            x = section.process(x)
+        return x
+
+
+def lowpass_taps(factor, N_of_taps = None):
+    """
+    windowed-sinc (Hamming) low-pass FIR taps for decimation by factor,
+    cutoff at the new Nyquist frequency, unit gain at DC
+    """
+    from numpy import arange, sinc, hamming
+    if N_of_taps is None:
+        N_of_taps = 8*factor + 1
+    n = arange(N_of_taps) - (N_of_taps - 1)/2.0
+    taps = sinc(n/factor)*hamming(N_of_taps)
+    return taps/taps.sum()
+
+
+class FIRDecimator(object):
+    def __init__(self, factor, taps = None):
+        """
+        Parameters
+        ----------
+        factor :: integer
+            decimation factor
+        taps :: array_like, optional
+            FIR filter taps, default lowpass_taps(factor)
+        """
+        from numpy import asarray
+        self.factor = factor
+        if taps is None:
+            taps = lowpass_taps(factor)
+        self.taps = asarray(taps, dtype = 'float64')
+        self.history = None
+        self.phase = 0
+
+    def reset(self):
+        self.history = None
+        self.phase = 0
+
+    def process(self, value_array):
+        """
+        returns the decimated output for the packet, (N points//factor (+1) x N channels)
+        """
+        from numpy import concatenate, repeat, arange
+        from numpy.lib.stride_tricks import sliding_window_view
+        x = value_array.astype('float64')
+        if x.shape[0] == 0:
+            return x
+        K = self.taps.shape[0]
+        if self.history is None:
+            self.history = repeat(x[:1], K - 1, axis = 0)
+        extended = concatenate((self.history, x))
+        # positions (in extended) of the output samples: the newest input sample of every window
+        positions = arange(K - 1 + self.phase, extended.shape[0], self.factor)
+        windows = sliding_window_view(extended, K, axis = 0)[positions - (K - 1)]
+        y = windows.dot(self.taps[::-1])
+        next_position = positions[-1] + self.factor if positions.shape[0] else K - 1 + self.phase
+        self.phase = next_position - extended.shape[0]
+        self.history = extended[extended.shape[0] - (K - 1):]
+        return y
+
+
+types = {'moving_average': MovingAverage, 'sos': SOSFilter, 'fir_decimator': FIRDecimator}
+
+
+def from_definition(definition):
+    """
+    returns filter from a dictionary with 'type' and the keyword arguments of the filter
+    """
+    definition = dict(definition)
+    kind = definition.pop('type')
+    if kind in ('lowpass', 'highpass'):
+        return SOSFilter(butterworth_sos(kind = kind, **definition))
+    if kind not in types:
+        raise ValueError('unknown filter type {!r}'.format(kind))
+    return types[kind](**definition)
+
+
+class FilterChain(object):
+    """
+    filters applied one after another
+    """
+    def __init__(self, filters):
+        self.filters = [from_definition(item) if isinstance(item, dict) else item for item in filters]
+
+    @property
+    def factor(self):
+        """
+        total decimation factor
+        """
+        factor = 1
+        for item in self.filters:
+            factor *= item.factor
+        return factor
+
+    def reset(self):
+        """
+        forgets the state, e.g. after an interruption of the stream
+        """
+        for item in self.filters:
+            item.reset()
+
+    def process(self, value_array):
+        x = value_array
+        for item in self.filters:
+            x = item.process(x)
+        return x
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+DeviceGroup: several DI-245 units acquiring together.
+
+All DI-245 units found on the host (or the ones given by serial number) are
+initialized in parallel, their scans are started from separate threads
+released by a common barrier, and their streams are merged onto a common
+timebase using every device's Timebase. Consumers see one array with the
+channels of all devices side by side.
+
+Examples
+--------
+>>> group = DeviceGroup()
+>>> group.init()
+>>> group.start()
+>>> t, data = group.get_last_N(1000)
+>>> data.shape
+(1000, 8)
+>>> group.channels
+[('56671FE4A', 0), ('56671FE4A', 1), ..., ('5667201AB', 3)]
+>>> group.stop()
+
+Valentyn Stadnytskyi
+"""
+from logging import info, error
+
+
+class DeviceGroup(object):
+    def __init__(self, serial_numbers = None, driver_factory = None, publisher = None, cache = None):
+        """
+        Parameters
+        ----------
+        serial_numbers :: list, optional
+            serial numbers of the devices, default is all DI-245 found
+        driver_factory :: callable, optional
+            driver_factory(serial_number) returns a Driver, default is Driver()
+        publisher :: object, optional
+            publisher shared by all devices, PVs are published as prefix:serial_number:key
+        cache :: DeviceCache, optional
+            device cache shared by all devices, default is the shared_cache() of the process
+        """
+        self.serial_numbers = serial_numbers
+        self.driver_factory = driver_factory
+        self.publisher = publisher
+        self.cache = cache
+        self.devices = []
+
+    def discover(self):
+        """
+        returns serial numbers of all DI-245 connected to the host
+        """
+        from dataq_di_245.driver import Driver
+        return [port[1] for port in Driver().available_ports]
+
+    def _new_driver(self, serial_number):
+        if self.driver_factory is None:
+            from dataq_di_245.driver import Driver
+            return Driver()
+        return self.driver_factory(serial_number)
+
+    def _new_device(self, serial_number):
+        """
+        returns a new Device. Called in the calling thread, one device after
+        the other: the Device writes its settings DataBase.
+        """
+        from dataq_di_245.device import Device
+        device = Device(name = 'DI245_{}'.format(serial_number))
+        device.serial_number = serial_number
+        return device
+
+    def _init_device(self, serial_number, device):
+        """
+        initializes one device, never raises
+
+        Returns
+        -------
+        result :: dict
+            serial_number, device, success, error, timing (per step) and duration, seconds
+        """
+        from time import time
+        import traceback
+        result = {'serial_number': serial_number, 'device': device, 'success': False, 'error': None,
+                  'timing': {}}
+        tstart = time()
+        try:
+            prefix = '{}:{}'.format(device.prefix, serial_number)
+            result['success'] = device.init(serial_number, driver = self._new_driver(serial_number),
+                                            publisher = self.publisher, prefix = prefix, cache = self.cache)
+            result['timing'] = device.init_timing
+            if not result['success']:
+                result['error'] = 'not found'
+        except Exception as err:
+            result['error'] = repr(err)
+            error(traceback.format_exc())
+        result['duration'] = time() - tstart
+        return result
+
+    def init(self, max_workers = None):
+        """
+        initializes and configures all devices concurrently in a thread pool.
+        The Device objects are created first, in the calling thread; only
+        their initialization (the serial I/O) runs in parallel. The
+        per-device results and timing are stored in self.report.
+
+        Parameters
+        ----------
+        max_workers :: integer, optional
+            number of threads, default one per device
+
+        Returns
+        -------
+        success :: boolean
+            True if every device was initialized
+        """
+        from time import time
+        from concurrent.futures import ThreadPoolExecutor
+        if self.serial_numbers is None:
+            self.serial_numbers = self.discover()
+        if len(self.serial_numbers) == 0:
+            info('no DI-245 available')
+            return False
+        tstart = time()
+        devices = [self._new_device(serial_number) for serial_number in self.serial_numbers]
+        with ThreadPoolExecutor(max_workers = max_workers or len(self.serial_numbers)) as executor:
+            results = list(executor.map(self._init_device, self.serial_numbers, devices))
+        self.report = {}
+        self.report['devices'] = results
+        self.report['duration'] = time() - tstart
+        self.report['sequential_duration'] = sum(result['duration'] for result in results)
+        self.devices = [result['device'] for result in results if result['success']]
+        for result in results:
+            if not result['success']:
+                error('DI-245 {} failed to initialize: {}'.format(result['serial_number'], result['error']))
+        info(self.format_report())
+        return all(result['success'] for result in results)
+
+    def format_report(self):
+        """
+        returns the initialization report as a table
+
+        Examples
+        --------
+        >>> print(group.format_report())
+        serial number    result   total, s  driver.init, s  configure_device, s  configure_publishing, s
+        56671FE4A        ok          9.012           4.008                5.003                    0.001
+        5667201AB        ok          9.010           4.007                5.002                    0.001
+        2 devices initialized in 9.013 s (sequential 18.022 s)
+        """
+        steps = ['driver.init', 'configure_device', 'configure_publishing']
+        lines = ['{:<16} {:<8} {:>8}'.format('serial number', 'result', 'total, s') +
+                 ''.join('  {:>{}}'.format(step + ', s', len(step) + 3) for step in steps)]
+        for result in self.report['devices']:
+            line = '{:<16} {:<8} {:>8.3f}'.format(str(result['serial_number']),
+                                                  'ok' if result['success'] else 'FAILED', result['duration'])
+            for step in steps:
+                value = result['timing'].get(step)
+                line += '  {:>{}}'.format('-' if value is None else '{:.3f}'.format(value), len(step) + 3)
+            if result['error'] is not None:
+                line += '  ' + result['error']
+            lines.append(line)
+        lines.append('{} devices initialized in {:.3f} s (sequential {:.3f} s)'.format(
+            len(self.devices), self.report['duration'], self.report['sequential_duration']))
+        return '\n'.join(lines)
+
+    def start(self):
+        """
+        starts scans of all devices. Every device waits on a common barrier
+        in its own thread so the start commands are issued together.
+        """
+        from threading import Barrier, Thread
+        barrier = Barrier(len(self.devices))
+
+        def start(device):
+            barrier.wait()
+            device.start()
+        threads = [Thread(target = start, args = (device,)) for device in self.devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        info('started {} devices, start time spread {:.3f} s'.format(len(self.devices), self.start_spread))
+
+    def stop(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers = max(1, len(self.devices))) as executor:
+            list(executor.map(lambda device: device.stop(), self.devices))
+
+    @property
+    def start_spread(self):
+        """
+        difference between the first and the last scan start, seconds
+        """
+        times = [device.time_start for device in self.devices]
+        return max(times) - min(times)
+
+    @property
+    def channels(self):
+        """
+        list of (serial number, scan list member) for every column of the merged array
+        """
+        return [(device.serial_number, i) for device in self.devices for i in range(device.buffer.shape[1])]
+
+    @property
+    def rate(self):
+        """
+        common sample rate: the lowest rate of all devices, None until every
+        device has a rate estimate
+        """
+        rates = [device.timebase.rate for device in self.devices]
+        if len(rates) == 0 or any(rate is None for rate in rates):
+            return None
+        return min(rates)
+
+    def get_range(self, t, method = 'linear'):
+        """
+        returns all channels of all devices sampled at times t
+
+        Parameters
+        ----------
+        t :: numpy.ndarray
+            times, seconds. Must be covered by the buffers of all devices.
+        method :: str, optional
+            'linear' interpolation between neighbouring samples or 'nearest' sample
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            (N points x N channels of all devices) float64 array of counts
+
+        Raises
+        ------
+        IndexError
+            if the samples were overwritten while they were read
+        """
+        from numpy import asarray, floor, rint, concatenate
+        from dataq_di_245.ring import read_global
+        if method not in ('nearest', 'linear'):
+            raise ValueError('unknown method {!r}'.format(method))
+        columns = []
+        for device in self.devices:
+            buffer = device.buffer
+            g_pointer = buffer.g_pointer
+            index = asarray(device.timebase.index_of(t), dtype = 'float64').clip(buffer.oldest, g_pointer)
+            # a validated copy of the samples between the first and the last time
+            first = int(floor(index.min()))
+            last = min(int(floor(index.max())) + 1, g_pointer)
+            block = read_global(buffer, last - first + 1, last).astype('float64')
+            if method == 'nearest':
+                columns.append(block[rint(index).astype('int64') - first])
+            else:
+                i0 = floor(index).astype('int64') - first
+                i1 = (i0 + 1).clip(None, last - first)
+                w = (index - first - i0)[:, None]
+                columns.append(block[i0]*(1 - w) + block[i1]*w)
+        return concatenate(columns, axis = 1)
+
+    def get_last_N(self, N, rate = None, method = 'linear'):
+        """
+        returns the last N samples of all devices on a common time grid
+
+        Parameters
+        ----------
+        N :: integer
+            number of points
+        rate :: float, optional
+            rate of the common grid, default is self.rate
+        method :: str, optional
+            'linear' or 'nearest'
+
+        Returns
+        -------
+        tuple :: (t, array)
+            times (N points) and (N points x N channels of all devices) array
+        """
+        from numpy import arange
+        if rate is None:
+            rate = self.rate
+        if rate is None:
+            raise ValueError('the sample rate of the devices is not known yet')
+        t_end = min(device.timebase.time_of(device.buffer.g_pointer) for device in self.devices)
+        t = t_end - arange(N)[::-1]/rate
+        return t, self.get_range(t, method = method)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Rate-limited, coalescing publishing of process variables.
+
+The acquisition thread only hands the latest value of every PV to the
+PublishingStage (a dictionary assignment under a lock). A separate thread
+pushes the values to the publisher:
+
+    - only the most recent value is kept, intermediate values are coalesced
+    - every PV is published at most max_rate times per second
+    - a value is skipped if it differs from the last published one by less
+      than the deadband
+
+WaveformStage publishes array PVs with the last N decimated samples of every
+channel of a CircularBuffer at a fixed refresh rate. Only the samples that
+arrived since the previous refresh are read from the buffer.
+
+Publishers implement put(name, value):
+
+    CAPublisher     EPICS Channel Access via EPICS_CA.CAServer.casput
+    LocalPublisher  keeps values and history in memory, used in tests
+
+Examples
+--------
+>>> stage = PublishingStage(LocalPublisher(), prefix = 'NIH:DI245',
+...                         pvs = {'RH': {'max_rate': 10.0, 'deadband': 0.1}})
+>>> stage.start()
+>>> stage.update('RH', 45.2)
+>>> stage.stop()
+>>> stage.publisher.values
+{'NIH:DI245:RH': 45.2}
+
+Valentyn Stadnytskyi
+"""
+from time import time
+from threading import RLock, Event
+from logging import error, debug
+import traceback
+
+
+class CAPublisher(object):
+    """
+    publishes PVs via EPICS Channel Access server
+    """
+    def __init__(self):
+        from EPICS_CA.CAServer import casput
+        self.casput = casput
+
+    def put(self, name, value):
+        self.casput(name, value)
+
+
+class LocalPublisher(object):
+    """
+    in-memory stand-in for the Channel Access server
+
+    :ivar values: last value of every PV
+    :ivar history: list of (time, name, value) for every put
+    """
+    def __init__(self):
+        self.values = {}
+        self.history = []
+
+    def put(self, name, value):
+        self.values[name] = value
+        self.history.append((time(), name, value))
+
+
+class PV(object):
+    """
+    publishing parameters and state of one process variable
+    """
+    def __init__(self, name, max_rate = 10.0, deadband = 0.0):
+        self.name = name
+        self.max_rate = max_rate
+        self.deadband = deadband
+        self.value = None
+        self.pending = False
+        self.last_value = None
+        self.last_time = -float('inf')
+
+    @property
+    def period(self):
+        if self.max_rate:
+            return 1.0/self.max_rate
+        else:
+            return 0.0
+
+    def within_deadband(self, value):
+        """
+        returns True if value differs from the last published value by less than the deadband.
+        """
+        if self.last_value is None or not self.deadband:
+            return False
+        try:
+            return abs(value - self.last_value) < self.deadband
+        except TypeError:
+            return False
+
+
+class PublishingStage(object):
+    """
+    publishing thread with per-PV rate limit, deadband and coalescing
+    """
+    def __init__(self, publisher, prefix = '', pvs = None):
+        """
+        Parameters
+        ----------
+        publisher :: object
+            object with put(name, value) method
+        prefix :: str
+            PV name prefix, the full PV name is prefix:key
+        pvs :: dict
+            {key: {'max_rate': Hz, 'deadband': value}}
+        """
+        self.publisher = publisher
+        self.prefix = prefix
+        self.lock = RLock()
+        self.event = Event()
+        self.running = False
+        self.thread = None
+        self.pvs = {}
+        if pvs is not None:
+            for key in pvs:
+                self.add(key, **pvs[key])
+
+    def pv_name(self, key):
+        if self.prefix:
+            return '{}:{}'.format(self.prefix, key)
+        else:
+            return key
+
+    def add(self, key, max_rate = 10.0, deadband = 0.0):
+        """
+        adds (or reconfigures) PV with the name prefix:key
+        """
+        with self.lock:
+            self.pvs[key] = PV(self.pv_name(key), max_rate = max_rate, deadband = deadband)
+
+    def update(self, key, value):
+        """
+        sets new value of the PV, called from the acquisition thread. Never blocks on publishing.
+        """
+        pv = self.pvs.get(key)
+        if pv is None:
+            return
+        with self.lock:
+            pv.value = value
+            pv.pending = True
+        self.event.set()
+
+    def publish_once(self):
+        """
+        publishes all pending values that are due
+
+        Returns
+        -------
+        wait :: float
+            time until the next pending value is due, None if nothing is pending
+        """
+        now = time()
+        due = []
+        wait = None
+        with self.lock:
+            for pv in self.pvs.values():
+                if not pv.pending:
+                    continue
+                remaining = pv.last_time + pv.period - now
+                if remaining > 0:
+                    wait = remaining if wait is None else min(wait, remaining)
+                    continue
+                pv.pending = False
+                if pv.within_deadband(pv.value):
+                    continue
+                pv.last_value = pv.value
+                pv.last_time = now
+                due.append((pv.name, pv.value))
+        for name, value in due:
+            try:
+                self.publisher.put(name, value)
+            except Exception:
+                error(traceback.format_exc())
+        return wait
+
+    def run(self):
+        debug('publishing thread started')
+        while self.running:
+            wait = self.publish_once()
+            self.event.wait(timeout = wait if wait is not None else 1.0)
+            self.event.clear()
+        self.publish_once()
+        debug('publishing thread stopped')
+
+    def start(self):
+        from ubcs_auxiliary.multithreading import new_thread
+        if not self.running:
+            self.running = True
+            self.thread = new_thread(self.run)
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class WaveformStage(object):
+    """
+    publishes decimated buffer slices as waveform PVs
+    """
+    def __init__(self, publisher, buffer, prefix = '', keys = None, length = 1000, decimation = 10,
+                 rate = 1.0, gain_lst = None):
+        """
+        Parameters
+        ----------
+        publisher :: object
+            object with put(name, value) method
+        buffer :: CircularBuffer
+            (N points x N channels) buffer of counts, e.g. Device.buffer
+        prefix :: str
+            PV name prefix, the full PV name is prefix:key
+        keys :: list, optional
+            PV key of every channel, default CH0_WF, CH1_WF, ...
+        length :: integer
+            number of decimated samples in the waveform
+        decimation :: integer
+            number of buffer samples averaged into one waveform sample
+        rate :: float
+            refresh rate, Hz
+        gain_lst :: list, optional
+            gains of the channels, if given waveforms are in Volts/degrees C
+        """
+        from circular_buffer_numpy.circular_buffer import CircularBuffer
+        self.publisher = publisher
+        self.buffer = buffer
+        self.prefix = prefix
+        N_of_channels = buffer.shape[1]
+        if keys is None:
+            keys = ['CH{}_WF'.format(i) for i in range(N_of_channels)]
+        self.keys = keys
+        self.length = length
+        self.decimation = decimation
+        self.rate = rate
+        self.gain_lst = gain_lst
+        self.waveforms = CircularBuffer(shape = (length, N_of_channels), dtype = 'float64')
+        self.g_pointer = buffer.g_pointer
+        self.running = False
+        self.thread = None
+        self.event = Event()
+
+    def pv_name(self, key):
+        if self.prefix:
+            return '{}:{}'.format(self.prefix, key)
+        else:
+            return key
+
+    def update(self):
+        """
+        decimates the samples that arrived since the last update (complete
+        decimation blocks only) into the waveform buffer
+
+        Returns
+        -------
+        N :: integer
+            number of new decimated samples
+        """
+        from dataq_di_245.ring import read_global
+        new = self.buffer.g_pointer - self.g_pointer
+        N = min(new//self.decimation, self.length, self.buffer.length//self.decimation)
+        if N <= 0:
+            return 0
+        end = self.g_pointer + (new//self.decimation)*self.decimation
+        try:
+            data = read_global(self.buffer, N*self.decimation, end)
+        except IndexError:
+            # overwritten while copying, continue with the next samples
+            self.g_pointer = end
+            return 0
+        data = data.reshape((N, self.decimation, data.shape[1])).mean(axis = 1)
+        if self.gain_lst is not None:
+            from dataq_di_245.conversion import to_units
+            data = to_units(data, self.gain_lst)
+        self.waveforms.append(data)
+        self.g_pointer = end
+        return N
+
+    def get_waveforms(self):
+        """
+        returns (N points x N channels) array of decimated samples, oldest first
+        """
+        N = min(self.waveforms.g_pointer + 1, self.length)
+        return self.waveforms.get_last_N(N)
+
+    def publish_once(self):
+        if self.update() > 0:
+            waveforms = self.get_waveforms()
+            for i, key in enumerate(self.keys):
+                try:
+                    self.publisher.put(self.pv_name(key), waveforms[:, i].copy())
+                except Exception:
+                    error(traceback.format_exc())
+
+    def run(self):
+        debug('waveform thread started')
+        while self.running:
+            self.publish_once()
+            self.event.wait(timeout = 1.0/self.rate)
+        debug('waveform thread stopped')
+
+    def start(self):
+        from ubcs_auxiliary.multithreading import new_thread
+        if not self.running:
+            self.running = True
+            self.event.clear()
+            self.thread = new_thread(self.run)
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Saturation and over-range detection for blocks of DI-245 counts.
+
+A sample is clipped if its count (offset removed) is within margin of the
+rails, -8192 or 8191: the input is at or beyond the full scale of the range
+and the value is not a measurement. Blocks (packets, windows) get quality
+flags:
+
+    OK          0   no clipped sample
+    CLIPPED     1   at least one clipped sample
+    SATURATED   2   in at least one channel a fraction saturated_fraction or
+                    more of the samples is clipped, the channel is pinned
+
+QualityMonitor checks every packet of Device.process with a few vectorized
+operations, counts the clipped samples per channel and stores a per-sample
+bitmask of the clipped channels (bit i is scan list member i) in a ring
+buffer in lockstep with Device.buffer, so the quality of any window of
+global indices that is still in the ring is known without rereading the
+samples. Notification.flags and Notification.clipped use it; the flags of the
+latest packet and the clip counters are published as the QUALITY and CLIPPED
+PVs.
+
+Examples
+--------
+>>> monitor = QualityMonitor(N_of_channels = 4, length = 100000)
+>>> monitor.check(value_array)
+1
+>>> monitor.clipped
+array([12,  0,  0,  0])
+>>> monitor.quality_of(first = 1000, last = 1999)
+(3, array([800,   0,   0,   0]))
+
+Valentyn Stadnytskyi
+"""
+OK = 0
+CLIPPED = 1
+SATURATED = 2
+
+names = {CLIPPED: 'CLIPPED', SATURATED: 'SATURATED'}
+
+
+def clip_mask(value_array, margin = 0):
+    """
+    returns boolean array of the shape of value_array, True where the count
+    (offset removed) is within margin of -8192 or 8191
+    """
+    from numpy import bitwise_xor, right_shift, greater_equal
+    # x ^ (x >> 15) maps -x - 1 onto x: both rails become 8191
+    folded = bitwise_xor(value_array, right_shift(value_array, 15))
+    return greater_equal(folded, 8191 - margin)
+
+
+def block_flags(counts, N_of_points, saturated_fraction = 0.5):
+    """
+    returns the quality flags of a block with per-channel clip counts
+    """
+    if N_of_points == 0 or not counts.any():
+        return OK
+    if counts.max() >= saturated_fraction*N_of_points:
+        return CLIPPED | SATURATED
+    return CLIPPED
+
+
+def describe(flags):
+    """
+    returns the names of the flags, e.g. 'CLIPPED|SATURATED', or 'OK'
+    """
+    return '|'.join(name for flag, name in sorted(names.items()) if flags & flag) or 'OK'
+
+
+class QualityMonitor(object):
+    """
+    per-channel clip counters, block flags and the per-sample clip bitmask
+    of a stream of packets
+    """
+    def __init__(self, N_of_channels = 4, length = 100000, margin = 0, saturated_fraction = 0.5):
+        """
+        Parameters
+        ----------
+        N_of_channels :: integer
+            number of channels in the scan list, at most 8
+        length :: integer
+            samples kept in the bitmask ring, the length of Device.buffer
+        margin :: integer
+            counts from the rails that are considered clipped
+        saturated_fraction :: float
+            fraction of clipped samples of a channel that flags a block SATURATED
+        """
+        from numpy import zeros, arange
+        from dataq_di_245.ring import RingBuffer
+        if N_of_channels > 8:
+            raise ValueError('at most 8 channels fit the clip bitmask, got {}'.format(N_of_channels))
+        self.N_of_channels = N_of_channels
+        self.margin = margin
+        self.saturated_fraction = saturated_fraction
+        self.buffer = RingBuffer(shape = (length, 1), dtype = 'uint8')
+        self.bits = (1 << arange(N_of_channels)).astype('uint8')
+        self.clipped = zeros(N_of_channels, dtype = 'int64')
+        self.blocks = 0
+        self.bad_blocks = 0
+        self.flags = OK
+
+    def check(self, value_array):
+        """
+        checks a packet, (N points x N channels) counts, that was appended to
+        the data buffer; appends its bitmask and updates the counters.
+
+        Returns
+        -------
+        flags :: integer
+            quality flags of the packet
+        """
+        mask = clip_mask(value_array, self.margin)
+        counts = mask.sum(axis = 0)
+        self.buffer.append(mask.view('uint8').dot(self.bits)[:, None])
+        self.clipped += counts
+        self.flags = block_flags(counts, value_array.shape[0], self.saturated_fraction)
+        self.blocks += 1
+        if self.flags:
+            self.bad_blocks += 1
+        return self.flags
+
+    def follow(self, buffer):
+        """
+        starts in step with a data buffer that already holds samples (a
+        restored PersistentBuffer): the bitmask of the samples still in it is
+        computed, the counters stay at zero
+        """
+        ring = self.buffer
+        first = buffer.oldest
+        ring.g_pointer = ring.reserved = first - 1
+        ring.pointer = (first - 1) % ring.length if first > 0 else -1
+        if buffer.g_pointer >= first:
+            self.check(buffer.read(buffer.g_pointer - first + 1))
+            self.reset()
+
+    def mask_of(self, first, last):
+        """
+        returns (N points x N channels) boolean clip mask of the samples
+        first..last (global indices, inclusive); IndexError if they are no
+        longer in the ring
+        """
+        from dataq_di_245.ring import read_global
+        from numpy import bitwise_and
+        bitmask = read_global(self.buffer, last - first + 1, last)
+        return bitwise_and(bitmask, self.bits) != 0
+
+    def quality_of(self, first, last):
+        """
+        returns quality flags and per-channel clip counts of the samples
+        first..last (global indices, inclusive)
+        """
+        mask = self.mask_of(first, last)
+        counts = mask.sum(axis = 0)
+        return block_flags(counts, mask.shape[0], self.saturated_fraction), counts
+
+    def reset(self):
+        """
+        resets the counters, the bitmask stays in step with the data buffer
+        """
+        self.clipped[:] = 0
+        self.blocks = 0
+        self.bad_blocks = 0
+        self.flags = OK
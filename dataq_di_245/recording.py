@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Binary recording format for DI-245 data.
+
+A recording file starts with a header followed by chunks of samples:
+
+    b'DI245REC'                 magic
+    uint32                      length of the JSON header
+    JSON header                 version, serial_number, scan_lst, phys_ch_lst,
+                                gain_lst, N_of_channels, dtype, codec
+    chunk                       repeated
+        b'CHNK'
+        int64   sequence        sequence number of the first sample
+        float64 time            time of the first sample, seconds
+        float64 rate            sample rate, scans per second
+        uint32  N_of_points     number of scans in the chunk
+        uint32  nbytes          length of the payload
+        payload                 N_of_points x N_of_channels counts (offset
+                                removed) encoded with the codec of the header,
+                                'raw' is little-endian int16 (see codec.py)
+
+Every chunk carries its own sequence number and time, so interruptions of the
+acquisition are preserved and the time of every sample is known.
+
+An Archive is a directory of recordings of one device (Device.archive_directory);
+Device.get_range reads from it when a time range is no longer in the ring buffer.
+
+Examples
+--------
+>>> with Recorder('data.di245', gain_lst = ['5','5','5','5'], codec = 'delta+zlib:1') as recorder:
+...     recorder.write(value_array, sequence = 0, t = time(), rate = 1000.0)
+>>> reader = Reader('data.di245')
+>>> data = reader.read()
+
+Valentyn Stadnytskyi
+"""
+from struct import Struct
+
+magic = b'DI245REC'
+version = 1
+chunk_header = Struct('<4sqddII')
+chunk_magic = b'CHNK'
+
+
+class Recorder(object):
+    """
+    writes (N points x N channels) int16 arrays of counts into a recording file
+    """
+    def __init__(self, filename, N_of_channels = 4, serial_number = None, scan_lst = None, phys_ch_lst = None,
+                 gain_lst = None, codec = 'raw', **kwargs):
+        import json
+        from struct import pack
+        from dataq_di_245.codec import Codec
+        self.codec = Codec(codec)
+        self.filename = filename
+        self.header = {}
+        self.header['version'] = version
+        self.header['serial_number'] = serial_number
+        self.header['scan_lst'] = scan_lst
+        self.header['phys_ch_lst'] = phys_ch_lst
+        self.header['gain_lst'] = gain_lst
+        self.header['N_of_channels'] = N_of_channels
+        self.header['dtype'] = '<i2'
+        self.header['codec'] = codec
+        self.header.update(kwargs)
+        self.file = open(filename, 'wb')
+        header = json.dumps(self.header).encode('utf-8')
+        self.file.write(magic + pack('<I', len(header)) + header)
+        self.N_of_points = 0
+        self.N_of_chunks = 0
+
+    def encode(self, value_array):
+        """
+        returns payload bytes of a chunk
+        """
+        return self.codec.encode(value_array)
+
+    def write(self, value_array, sequence, t, rate):
+        """
+        appends one chunk
+
+        Parameters
+        ----------
+        value_array :: numpy.ndarray
+            (N points x N channels) counts, offset removed
+        sequence :: integer
+            sequence number of the first sample
+        t :: float
+            time of the first sample, seconds
+        rate :: float
+            sample rate, scans per second
+        """
+        payload = self.encode(value_array)
+        self.file.write(chunk_header.pack(chunk_magic, int(sequence), float(t), float(rate or 0.0),
+                                          value_array.shape[0], len(payload)))
+        self.file.write(payload)
+        self.N_of_points += value_array.shape[0]
+        self.N_of_chunks += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Chunk(object):
+    """
+    location and timing of one chunk in a recording file
+    """
+    def __init__(self, offset, sequence, time, rate, N_of_points, nbytes):
+        self.offset = offset
+        self.sequence = sequence
+        self.time = time
+        self.rate = rate
+        self.N_of_points = N_of_points
+        self.nbytes = nbytes
+
+    @property
+    def end_time(self):
+        """
+        time just after the last sample of the chunk
+        """
+        return self.time + self.N_of_points/self.rate if self.rate else self.time
+
+    def __repr__(self):
+        return 'Chunk(sequence={}, time={}, rate={}, N_of_points={})'.format(
+            self.sequence, self.time, self.rate, self.N_of_points)
+
+
+class Reader(object):
+    """
+    reads a recording file. The chunk index (self.chunks) is built on open
+    by skipping over the payloads.
+    """
+    def __init__(self, filename):
+        import json
+        from struct import unpack
+        from dataq_di_245.codec import Codec
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        if self.file.read(len(magic)) != magic:
+            raise ValueError('{} is not a DI-245 recording'.format(filename))
+        length, = unpack('<I', self.file.read(4))
+        self.header = json.loads(self.file.read(length).decode('utf-8'))
+        self.N_of_channels = self.header['N_of_channels']
+        self.codec = Codec(self.header.get('codec', 'raw'))
+        self.chunks = []
+        offset = self.file.tell()
+        while True:
+            data = self.file.read(chunk_header.size)
+            if len(data) < chunk_header.size:
+                break
+            tag, sequence, t, rate, N_of_points, nbytes = chunk_header.unpack(data)
+            if tag != chunk_magic:
+                raise ValueError('corrupted chunk at {} in {}'.format(offset, filename))
+            self.chunks.append(Chunk(offset + chunk_header.size, sequence, t, rate, N_of_points, nbytes))
+            offset += chunk_header.size + nbytes
+            self.file.seek(offset)
+
+    @property
+    def N_of_points(self):
+        return sum(chunk.N_of_points for chunk in self.chunks)
+
+    def decode(self, payload, N_of_points):
+        """
+        returns (N points x N channels) int16 array of a chunk payload
+        """
+        return self.codec.decode(payload, N_of_points, self.N_of_channels)
+
+    def read_chunk(self, chunk):
+        self.file.seek(chunk.offset)
+        return self.decode(self.file.read(chunk.nbytes), chunk.N_of_points)
+
+    def get_range(self, t0, t1):
+        """
+        returns the samples acquired between t0 and t1 (inclusive)
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            (N points x N channels) int16 array of counts
+        """
+        from math import ceil, floor
+        from numpy import concatenate, zeros
+        parts = []
+        for chunk in self.chunks:
+            if chunk.time > t1 or (chunk.end_time <= t0 and chunk.rate):
+                continue
+            if chunk.rate:
+                i0 = max(0, int(ceil((t0 - chunk.time)*chunk.rate - 1e-3)))
+                i1 = min(chunk.N_of_points - 1, int(floor((t1 - chunk.time)*chunk.rate + 1e-3)))
+            else:
+                i0, i1 = 0, chunk.N_of_points - 1
+            if i1 >= i0:
+                parts.append(self.read_chunk(chunk)[i0:i1 + 1])
+        if len(parts) == 0:
+            return zeros((0, self.N_of_channels), dtype = 'int16')
+        return concatenate(parts)
+
+    def read_points(self, start, stop):
+        """
+        returns samples start..stop-1 counted from the beginning of the recording
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            (N points x N channels) int16 array of counts
+        """
+        from numpy import concatenate, zeros
+        parts = []
+        position = 0
+        for chunk in self.chunks:
+            if position + chunk.N_of_points > start and position < stop:
+                data = self.read_chunk(chunk)
+                parts.append(data[max(0, start - position):stop - position])
+            position += chunk.N_of_points
+        if len(parts) == 0:
+            return zeros((0, self.N_of_channels), dtype = 'int16')
+        return concatenate(parts)
+
+    def __iter__(self):
+        """
+        iterates over (chunk, data) pairs
+        """
+        for chunk in self.chunks:
+            yield chunk, self.read_chunk(chunk)
+
+    def read(self):
+        """
+        returns all samples as (N points x N channels) int16 array
+        """
+        from numpy import concatenate, zeros
+        if len(self.chunks) == 0:
+            return zeros((0, self.N_of_channels), dtype = 'int16')
+        return concatenate([data for chunk, data in self])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Archive(object):
+    """
+    directory of recordings of one device, used to read data that is no
+    longer in the ring buffer
+    """
+    extension = '.di245'
+
+    def __init__(self, directory, serial_number = None):
+        self.directory = directory
+        self.serial_number = serial_number
+        self.recorder = None
+        # the recording in progress, or the last one after close()
+        self.filename = None
+
+    def new_recorder(self, t = None, **header):
+        """
+        starts a new recording file named after the serial number and the time
+        """
+        from os import makedirs
+        from os.path import join
+        from time import time, strftime, localtime
+        if t is None:
+            t = time()
+        makedirs(self.directory, exist_ok = True)
+        filename = join(self.directory, 'DI245_{}_{}-{:03d}{}'.format(self.serial_number,
+                                                                     strftime('%Y%m%d-%H%M%S', localtime(t)),
+                                                                     int((t % 1)*1000), self.extension))
+        self.recorder = Recorder(filename, serial_number = self.serial_number, **header)
+        self.filename = filename
+        return self.recorder
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    @property
+    def filenames(self):
+        from os import listdir
+        from os.path import join, isdir
+        if not isdir(self.directory):
+            return []
+        prefix = 'DI245_{}_'.format(self.serial_number)
+        return sorted(join(self.directory, name) for name in listdir(self.directory)
+                      if name.startswith(prefix) and name.endswith(self.extension))
+
+    def read_last(self, start, stop):
+        """
+        returns samples start..stop-1 of the recording in progress, or of the
+        last one if it is closed
+        """
+        if self.recorder is not None:
+            self.recorder.flush()
+        with Reader(self.filename) as reader:
+            return reader.read_points(start, stop)
+
+    def get_range(self, t0, t1, N_of_channels, exclude_last = False):
+        """
+        returns the recorded samples acquired between t0 and t1 (inclusive),
+        oldest first, from all recordings of the device. The recording in
+        progress (or the last one) is skipped if exclude_last.
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            (N points x N channels) int16 array of counts
+        """
+        from numpy import concatenate, zeros
+        if self.recorder is not None:
+            self.recorder.flush()
+        parts = []
+        for filename in self.filenames:
+            if exclude_last and filename == self.filename:
+                continue
+            with Reader(filename) as reader:
+                if reader.N_of_channels != N_of_channels or len(reader.chunks) == 0:
+                    continue
+                if reader.chunks[0].time > t1 or reader.chunks[-1].end_time < t0:
+                    continue
+                parts.append(reader.get_range(t0, t1))
+        if len(parts) == 0:
+            return zeros((0, N_of_channels), dtype = 'int16')
+        return concatenate(parts)
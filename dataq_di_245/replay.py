@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Replay of recorded DI-245 data through the live acquisition path.
+
+ReplayDriver is an EmulatedDriver whose port streams a recording instead of
+a synthetic signal: the recorded samples are turned back into the DI-245 byte
+stream and read, resynchronized and decoded by the unchanged Driver read path
+(iter_packets, read_buffer, waiting). A Device initialized with a
+ReplayDriver runs its whole chain (buffer, timebase, quality, derived
+channels, subscriptions, publishers, archive) exactly as on the hardware.
+The streams that can be replayed:
+
+    recording   a file of dataq_di_245.recording (Recorder, di245 record), or
+                a list of them, decoded chunk by chunk with their codec
+    raw         the DI-245 byte stream as read from the port (di245 stream
+                --format raw); N_of_channels and the recorded rate are given
+
+Timing:
+
+    speed = 1.0     real time, scans arrive at the recorded rate
+    speed = N       N times the recorded rate
+    speed = None    as fast as the reader takes them (throughput benchmarks)
+
+Samples are replayed back to back; interruptions recorded as chunks with a
+sequence gap are closed up. After the last sample driver.finished is True,
+unless loop = True restarts the stream from the beginning. A rest shorter
+than the packet the reader waits for is left unread, as at the end of a live
+stream: finished is also True once nothing was read for idle seconds.
+
+Examples
+--------
+>>> device = replay_device('data.di245', speed = 10.0)
+>>> device.start()
+>>> while not device.driver.finished:
+...     sleep(0.1)
+>>> device.stop()
+
+>>> driver = ReplayDriver('stream.raw', speed = None, N_of_channels = 4, rate = 2000.0)
+>>> driver.init()
+>>> for packet in driver.iter_packets(100, abort = lambda: driver.finished):
+...     pass
+
+Valentyn Stadnytskyi
+"""
+from time import time
+
+from dataq_di_245.emulator import EmulatedDriver, EmulatedPort
+
+
+class RecordingSource(object):
+    """
+    raw byte stream of one or more recording files
+    """
+    def __init__(self, filenames):
+        from dataq_di_245.recording import Reader
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        self.filenames = list(filenames)
+        if len(self.filenames) == 0:
+            raise ValueError('no recordings to replay')
+        with Reader(self.filenames[0]) as reader:
+            self.header = dict(reader.header)
+            rates = [chunk.rate for chunk in reader.chunks if chunk.rate]
+        self.N_of_channels = self.header['N_of_channels']
+        self.rate = sorted(rates)[len(rates)//2] if rates else None
+
+    def blocks(self):
+        """
+        generator of raw byte blocks, one per chunk
+        """
+        from dataq_di_245.driver import encode
+        from dataq_di_245.recording import Reader
+        for filename in self.filenames:
+            with Reader(filename) as reader:
+                if reader.N_of_channels != self.N_of_channels:
+                    raise ValueError('{} has {} channels, the replay {}'.format(filename, reader.N_of_channels,
+                                                                                self.N_of_channels))
+                for chunk, value_array in reader:
+                    yield encode(value_array.T + 8192)
+
+
+class RawSource(object):
+    """
+    DI-245 byte stream stored in a file
+    """
+    def __init__(self, filename, N_of_channels = 4, rate = None, block_size = 2**16):
+        self.filename = filename
+        self.N_of_channels = N_of_channels
+        self.rate = rate
+        self.header = {'N_of_channels': N_of_channels}
+        self.block_size = block_size
+
+    def blocks(self):
+        scan_size = 2*self.N_of_channels
+        with open(self.filename, 'rb') as f:
+            while True:
+                data = f.read(self.block_size*scan_size)
+                if len(data) == 0:
+                    break
+                yield data
+
+
+class ReplayPort(EmulatedPort):
+    """
+    pyserial-like port that streams the raw blocks of a source
+    """
+    def __init__(self, source, speed = 1.0, loop = False, port = 'REPLAY', serial_number = 'REPLAY0',
+                 timeout = 0.1, idle = 0.5):
+        """
+        Parameters
+        ----------
+        source :: RecordingSource or RawSource
+            recorded stream
+        speed :: float or None
+            multiple of the recorded rate, None is as fast as possible
+        loop :: boolean
+            start again from the beginning after the last sample
+        idle :: float
+            seconds without a read after the last sample until finished
+        """
+        if speed is not None and not source.rate:
+            raise ValueError('the rate of the recorded stream is not known, replay with speed = None')
+        rate = None if speed is None else source.rate*speed
+        EmulatedPort.__init__(self, port = port, serial_number = serial_number,
+                              N_of_channels = source.N_of_channels, rate = rate, timeout = timeout)
+        self.source = source
+        self.speed = speed
+        self.loop = loop
+        self.replayed = 0
+        self.exhausted = False
+        self.idle = idle
+        self.last_read = time()
+        self._blocks = source.blocks()
+        self._pending = b''
+        self._offset = 0
+
+    def write(self, command):
+        result = EmulatedPort.write(self, command)
+        # the scan list of the stream is fixed by the recording
+        self.N_of_channels = self.source.N_of_channels
+        return result
+
+    def _take(self, Nbytes):
+        """
+        returns up to Nbytes of the stream, whole scans
+        """
+        parts = []
+        while Nbytes > 0 and not self.exhausted:
+            if self._offset >= len(self._pending):
+                try:
+                    self._pending = memoryview(next(self._blocks))
+                    self._offset = 0
+                except StopIteration:
+                    if self.loop and (self.replayed > 0 or parts):
+                        self._blocks = self.source.blocks()
+                    else:
+                        self.exhausted = True
+                    continue
+            part = self._pending[self._offset:self._offset + Nbytes]
+            self._offset += len(part)
+            parts.append(part)
+            Nbytes -= len(part)
+        data = b''.join(parts)
+        self.replayed += len(data)//(2*self.N_of_channels)
+        return data
+
+    def _update(self, Nbytes = 0):
+        if not self.scanning or self.exhausted:
+            return
+        scan_size = 2*self.N_of_channels
+        if self.rate is None:
+            N = -(-(max(Nbytes, self.rx_size) - len(self._output))//scan_size)
+        else:
+            N = int((time() - self.t_start)*self.rate) - self.scans
+            N = min(N, (self.rx_size - len(self._output))//scan_size)
+        if N > 0:
+            data = self._take(N*scan_size)
+            self._output += data
+            self.scans += len(data)//scan_size
+
+    def read(self, size = 1):
+        self.last_read = time()
+        return EmulatedPort.read(self, size)
+
+    @property
+    def finished(self):
+        """
+        True after the last sample was read from the port, or if the rest
+        was not read for idle seconds
+        """
+        return self.exhausted and (len(self._output) == 0 or time() - self.last_read > self.idle)
+
+
+class ReplayDriver(EmulatedDriver):
+    """
+    Driver that reads a recorded stream through the live read path
+    """
+    def __init__(self, source, speed = 1.0, loop = False, N_of_channels = None, rate = None,
+                 serial_number = None, read_timeout = 0.1):
+        """
+        Parameters
+        ----------
+        source :: str, list, RecordingSource or RawSource
+            recording file(s), or a raw byte stream file if N_of_channels is given
+        speed :: float or None
+            multiple of the recorded rate, None is as fast as possible
+        loop :: boolean
+            replay the stream again and again
+        N_of_channels :: integer, optional
+            channels of a raw byte stream
+        rate :: float, optional
+            recorded rate of a raw byte stream, scans per second
+        serial_number :: str, optional
+            serial number of the replayed device, default from the recording
+        """
+        if isinstance(source, (RecordingSource, RawSource)):
+            pass
+        elif N_of_channels is not None:
+            source = RawSource(source, N_of_channels = N_of_channels, rate = rate)
+        else:
+            source = RecordingSource(source)
+        self.source = source
+        self.speed = speed
+        self.loop = loop
+        if serial_number is None:
+            serial_number = source.header.get('serial_number') or 'REPLAY0'
+        EmulatedDriver.__init__(self, serial_number, read_timeout = read_timeout)
+        # the stream has its scan list before config_channels
+        self.scan_lst = [str(i) for i in range(source.N_of_channels)]
+
+    def use_com_port(self, serial_number = None):
+        if serial_number not in (None, '', self.emulator_serial_number):
+            return None
+        self.serial_number = self.emulator_serial_number
+        return ReplayPort(self.source, speed = self.speed, loop = self.loop,
+                          serial_number = self.emulator_serial_number)
+
+    def config_channels(self, *args, **kwargs):
+        """
+        Driver.config_channels, the scan list must have the number of
+        channels of the recorded stream
+        """
+        from logging import warning
+        success, result = EmulatedDriver.config_channels(self, *args, **kwargs)
+        config = self.scan_config
+        if config.N_of_channels != self.source.N_of_channels:
+            raise ValueError('the scan list has {} members, the replayed stream {} channels'.format(
+                config.N_of_channels, self.source.N_of_channels))
+        recorded = self.source.header.get('gain_lst')
+        if recorded is not None and list(recorded) != list(config.gain_lst):
+            warning('replay with gains {}, recorded with {}'.format(list(config.gain_lst), recorded))
+        return success, result
+
+    @property
+    def finished(self):
+        """
+        True after the last recorded sample was read
+        """
+        return self.port is not None and self.port.finished
+
+
+def replay_device(source, speed = 1.0, loop = False, device_class = None, publisher = None, cache = None,
+                  **settings):
+    """
+    returns a Device initialized with a ReplayDriver. The scan list and gains
+    come from the recording header, settings (e.g. buffer_size, filters,
+    archive_directory) override the class defaults of the Device without
+    touching the saved settings.
+
+    Parameters
+    ----------
+    source :: str, list, RecordingSource or RawSource
+        see ReplayDriver
+    speed :: float or None
+        multiple of the recorded rate, None is as fast as possible
+    loop :: boolean
+        replay the stream again and again
+    device_class :: type, optional
+        Device or a subclass, default Device
+    publisher :: object, optional
+        default LocalPublisher
+    cache :: DeviceCache, optional
+        default none
+
+    Examples
+    --------
+    >>> device = replay_device('data.di245', speed = None, buffer_size = 100000)
+    """
+    from dataq_di_245.publisher import LocalPublisher
+    if device_class is None:
+        from dataq_di_245.device import Device as device_class
+    driver = source if isinstance(source, ReplayDriver) else ReplayDriver(source, speed = speed, loop = loop)
+    header = driver.source.header
+    N_of_channels = driver.source.N_of_channels
+    attributes = {}
+    attributes['scan_lst'] = header.get('scan_lst') or [str(i) for i in range(N_of_channels)]
+    attributes['phys_ch_lst'] = header.get('phys_ch_lst') or [str(i) for i in range(N_of_channels)]
+    attributes['gain_lst'] = header.get('gain_lst') or ['5']*N_of_channels
+    attributes['use_cache'] = False
+    attributes['buffer_file'] = ''
+    attributes.update(settings)
+    ReplayDevice = type('Replay' + device_class.__name__, (device_class,), attributes)
+    device = ReplayDevice()
+    if publisher is None:
+        publisher = LocalPublisher()
+    if not device.init(driver.emulator_serial_number, driver = driver, publisher = publisher, cache = cache):
+        raise IOError('replay of {} could not be started'.format(driver.source))
+    return device
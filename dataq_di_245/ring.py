@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Ring buffers of the acquisition: RingBuffer, a CircularBuffer with
+sequence-validated lock-free reads, and PersistentBuffer, a RingBuffer backed
+by a memory-mapped file that survives restarts of the process.
+
+Concurrency contract
+--------------------
+One writer, any number of readers, no lock:
+
+    writer      a single thread (the acquisition thread of the Device) calls
+                append() and reset(). It is never blocked by readers.
+    readers     any thread calls read() or get_last_N(). They return a copy
+                that is guaranteed to be consistent.
+
+append() works like a seqlock over global indices: it first announces the
+highest index it is about to write (self.reserved), then writes the samples,
+then publishes them by advancing self.g_pointer. A reader takes g_pointer,
+copies the samples and afterwards checks self.reserved: if the writer may
+have overwritten any of the copied slots in the meantime (it lapped the
+reader), the copy is discarded and repeated for the newest samples, or
+IndexError is raised if the reader asked for a fixed range that no longer
+exists. The attribute stores are atomic and ordered under the GIL.
+
+get_N_global() and the buffer array itself are unvalidated views. They are
+safe in the writer thread (e.g. the EventDetector in Device.process) and for
+ranges the writer cannot reach; other threads use read().
+
+Persistent buffer
+-----------------
+The file of a PersistentBuffer starts with a 4096-byte header followed by the
+(length x N channels) samples:
+
+    magic           b'DI245RNG'
+    version         file format version
+    length          number of samples in the ring
+    N_of_channels   number of channels
+    dtype           numpy dtype of the samples, e.g. b'<i2'
+    config_hash     hash of the configuration the samples were acquired with
+    g_pointer       global index of the last sample written
+    reserved        highest global index an append has started to write
+    sequence        sequence number of the last sample (see Timebase)
+    time            time of the last sample, seconds
+    rate            sample rate, scans per second
+
+The samples live in the OS page cache rather than in the heap of the process.
+append() follows the seqlock in the file too: it stores reserved in the
+header, writes the samples and then stores g_pointer. After a crash of the
+process during an append the ring is restored up to the last complete packet,
+and the slots the torn append may have overwritten, every index up to
+reserved - length, count as lost (see oldest).
+(The page cache is written to disk by the OS; call flush() to force it, e.g.
+before a power cycle.)
+
+On reopen the header is validated: if the shape, dtype or configuration hash
+do not match, the stored samples were acquired with a different configuration
+and the ring starts empty.
+
+Examples
+--------
+>>> buffer = RingBuffer(shape = (4320000, 4), dtype = 'int16')
+>>> buffer.append(value_array)                  # acquisition thread
+>>> buffer.read(N = 1000)                       # any thread, latest 1000 samples
+
+>>> buffer = PersistentBuffer('/var/tmp/DI245.ring', shape = (4320000, 4), config_hash = 'b182d2c5...')
+>>> buffer.restored
+True
+>>> buffer.g_pointer
+12563999
+
+Valentyn Stadnytskyi
+"""
+from logging import warning
+
+from circular_buffer_numpy.circular_buffer import CircularBuffer
+
+magic = b'DI245RNG'
+version = 2
+header_size = 4096
+
+
+def header_dtype():
+    from numpy import dtype
+    return dtype([('magic', 'S8'), ('version', '<u4'), ('length', '<i8'), ('N_of_channels', '<i8'),
+                  ('dtype', 'S8'), ('config_hash', 'S64'), ('g_pointer', '<i8'), ('sequence', '<i8'),
+                  ('time', '<f8'), ('rate', '<f8'), ('reserved', '<i8')])
+
+
+def read_global(buffer, N, M, out = None):
+    """
+    returns N samples ending with global index M of any CircularBuffer: a
+    validated copy from a RingBuffer (IndexError if they were overwritten),
+    get_N_global of other buffers (into out if given)
+    """
+    if isinstance(buffer, RingBuffer):
+        return buffer.read(N, M, out = out)
+    data = buffer.get_N_global(N = N, M = M)
+    if out is not None:
+        out[:] = data
+        return out
+    return data
+
+
+class RingBuffer(CircularBuffer):
+    """
+    CircularBuffer with vectorized append and validated reads, see the
+    concurrency contract above
+    """
+    def __init__(self, shape = (100, 2), dtype = 'float64', packet_length = 1):
+        CircularBuffer.__init__(self, shape = shape, dtype = dtype, packet_length = packet_length)
+        self.reserved = -1
+        self.retries = 0
+
+    def append(self, data):
+        """
+        appends (N points x N channels) data. Writer thread only.
+        """
+        if data.ndim == self.buffer.ndim - 1:
+            data = data.reshape((1, data.shape[0]))
+        N = data.shape[0]
+        length = self.length
+        if N > length:
+            data = data[N - length:]
+        last = self.g_pointer + N
+        # reserved never decreases: slots lost by a torn append stay invalid
+        self.reserved = max(self.reserved, last)
+        start = (last - data.shape[0] + 1) % length
+        end = start + data.shape[0]
+        if end <= length:
+            self.buffer[start:end] = data
+        else:
+            self.buffer[start:] = data[:length - start]
+            self.buffer[:end - length] = data[length - start:]
+        self.pointer = last % length
+        self.g_pointer = last
+
+    @property
+    def oldest(self):
+        """
+        global index of the oldest sample that can be read
+        """
+        return max(0, self.reserved - self.length + 1)
+
+    def reset(self, clear = False):
+        """
+        empties the buffer. Writer thread only.
+        """
+        CircularBuffer.reset(self, clear = clear)
+        self.reserved = -1
+
+    def read(self, N, M = None, out = None, attempts = 100):
+        """
+        returns a consistent copy of N samples ending with global index M,
+        from any thread
+
+        Parameters
+        ----------
+        N :: integer
+            number of samples
+        M :: integer, optional
+            global index of the last sample, default the newest sample. The
+            newest samples are read again if the writer laps the reader.
+        out :: numpy.ndarray, optional
+            (N x N channels) array the samples are copied into
+        attempts :: integer
+            maximum number of copies of the newest samples
+
+        Returns
+        -------
+        array :: numpy.ndarray
+            (N x N channels) copy
+
+        Raises
+        ------
+        IndexError
+            if the requested samples are not (or no longer) in the buffer
+        """
+        from numpy import empty
+        length = self.length
+        if out is None:
+            out = empty((N,) + self.buffer.shape[1:], dtype = self.buffer.dtype)
+        for i in range(attempts):
+            last = self.g_pointer if M is None else M
+            first = last - N + 1
+            if N > length or first < 0 or last > self.g_pointer:
+                raise IndexError('samples {}..{} are not in the buffer (0..{}, length {})'.format(
+                    first, last, self.g_pointer, length))
+            start = first % length
+            end = start + N
+            if end <= length:
+                out[:] = self.buffer[start:end]
+            else:
+                out[:length - start] = self.buffer[start:]
+                out[length - start:] = self.buffer[:end - length]
+            if self.reserved - length < first:
+                return out
+            if M is not None:
+                raise IndexError('samples {}..{} were overwritten'.format(first, last))
+            self.retries += 1
+        raise IndexError('the writer lapped the reader {} times'.format(attempts))
+
+    def get_last_N(self, N):
+        """
+        returns a consistent copy of the newest N samples, from any thread
+        """
+        return self.read(N)
+
+
+class PersistentBuffer(RingBuffer):
+    """
+    CircularBuffer in a memory-mapped file
+    """
+    def __init__(self, filename, shape = (100, 2), dtype = 'int16', config_hash = '', packet_length = 1):
+        """
+        Parameters
+        ----------
+        filename :: str
+            file of the ring, created if it does not exist
+        shape :: tuple
+            (length, N channels)
+        dtype :: str
+            numpy dtype of the samples
+        config_hash :: str
+            hash of the acquisition configuration, e.g. cache.config_hash(...)
+        packet_length :: integer
+            see CircularBuffer
+        """
+        from os.path import exists, getsize
+        from numpy import memmap, dtype as as_dtype
+        self.__info__ = "Persistent RingBuffer"
+        self.name = 'persistent circular buffer'
+        self.type = 'server'
+        self.packet_length = packet_length
+        self.filename = filename
+        self.config_hash = config_hash
+        self.retries = 0
+        dtype = as_dtype(dtype)
+        size = header_size + shape[0]*shape[1]*dtype.itemsize
+        self.restored = False
+        if exists(filename) and getsize(filename) == size:
+            self.header_map = memmap(filename, dtype = header_dtype(), mode = 'r+', shape = (1,))
+            self.header = self.header_map[0]
+            self.restored = self.validate(shape, dtype)
+            if not self.restored:
+                warning('{} was written with a different configuration, the ring buffer starts empty'.format(
+                    filename))
+        else:
+            with open(filename, 'wb') as f:
+                f.truncate(size)
+            self.header_map = memmap(filename, dtype = header_dtype(), mode = 'r+', shape = (1,))
+            self.header = self.header_map[0]
+        self.buffer = memmap(filename, dtype = dtype, mode = 'r+', offset = header_size, shape = tuple(shape))
+        if self.restored:
+            self.g_pointer = int(self.header['g_pointer'])
+            self.reserved = max(self.g_pointer, int(self.header['reserved']))
+            if self.reserved > self.g_pointer:
+                warning('{} was closed during an append, samples up to {} are lost'.format(
+                    filename, self.reserved - shape[0]))
+            self.pointer = -1 if self.g_pointer < 0 else self.g_pointer % shape[0]
+        else:
+            self.header['magic'] = magic
+            self.header['version'] = version
+            self.header['length'] = shape[0]
+            self.header['N_of_channels'] = shape[1]
+            self.header['dtype'] = dtype.str.encode('ascii')
+            self.header['config_hash'] = config_hash.encode('ascii')
+            self.reset()
+
+    def set_config_hash(self, config_hash):
+        """
+        records that the samples from now on are acquired with another
+        configuration, the ring is not restored by a reopen with the old one
+        """
+        self.config_hash = config_hash
+        self.header['config_hash'] = config_hash.encode('ascii')
+
+    def validate(self, shape, dtype):
+        """
+        returns True if the header matches the shape, dtype and configuration hash
+        """
+        header = self.header
+        return (bytes(header['magic']) == magic and int(header['version']) == version and
+                int(header['length']) == shape[0] and int(header['N_of_channels']) == shape[1] and
+                bytes(header['dtype']) == dtype.str.encode('ascii') and
+                bytes(header['config_hash']) == self.config_hash.encode('ascii'))
+
+    def append(self, data):
+        """
+        appends (N points x N channels) data, reserved is stored in the file
+        before the samples and the write pointer after them. Writer thread only.
+        """
+        N = data.shape[0] if data.ndim == self.buffer.ndim else 1
+        self.header['reserved'] = max(self.reserved, self.g_pointer + N)
+        RingBuffer.append(self, data)
+        self.header['g_pointer'] = self.g_pointer
+
+    def set_time(self, sequence, t, rate):
+        """
+        records sequence number, time and rate of the last sample, used to
+        restore the Timebase on reopen
+        """
+        self.header['sequence'] = sequence
+        self.header['time'] = t
+        self.header['rate'] = rate if rate else 0.0
+
+    @property
+    def last_time(self):
+        """
+        (sequence, time, rate) of the last sample, rate is None if unknown
+        """
+        rate = float(self.header['rate'])
+        return int(self.header['sequence']), float(self.header['time']), rate if rate > 0 else None
+
+    def reset(self, clear = False):
+        if clear:
+            self.buffer[:] = 0
+        self.pointer = -1
+        self.g_pointer = -1
+        self.reserved = -1
+        self.header['g_pointer'] = -1
+        self.header['reserved'] = -1
+        self.header['sequence'] = -1
+        self.header['time'] = 0.0
+        self.header['rate'] = 0.0
+
+    def flush(self):
+        """
+        writes the samples and the header to disk
+        """
+        self.buffer.flush()
+        self.header_map.flush()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy counterparts of ubcs_auxiliary.saved_property DataBase and SavedProperty.
+
+Importing ubcs_auxiliary imports NumPy and creating a DataBase reads its file,
+both of which used to happen when dataq_di_245.device was imported. Here the
+ubcs_auxiliary DataBase is created on first access and SavedProperty follows
+the same get/set semantics, so the settings file format is unchanged.
+
+Examples
+--------
+>>> db = DataBase(root = 'TEMP', name = 'dataq_covid19')
+>>> class Device(object):
+...     prefix = SavedProperty(db, 'prefix', 'NIH:DI245').init()
+"""
+
+
+class DataBase(object):
+    """
+    ubcs_auxiliary DataBase that is created (and its file read) on first use
+    """
+    def __init__(self, root, name):
+        self.root = root
+        self.name = name
+        self._db = None
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr == '_db':
+            raise AttributeError(attr)
+        if self._db is None:
+            from ubcs_auxiliary.saved_property import DataBase as _DataBase
+            self._db = _DataBase(root = self.root, name = self.name)
+        return getattr(self._db, attr)
+
+
+class SavedProperty(object):
+    def __init__(self, db, name, value):
+        self.name = name
+        self.db = db
+        self.default_value = value
+
+    def init(self):
+        """
+        returns property object with get and set functions
+        """
+        return property(self.get, self.set)
+
+    def set(self, instance, value):
+        self.db.database[self.name] = value
+        self.db.write()
+
+    def get(self, instance):
+        return self.db.database.get(self.name, self.default_value)
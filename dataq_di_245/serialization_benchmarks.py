@@ -1,2 +1,438 @@
 # -*- coding: utf-8 -*-
 ####!/bin/env python
+"""
+Benchmark suite for the DI-245 acquisition pipeline.
+
+Measures:
+    replay        headline benchmark: a recording replayed as fast as possible
+                  through the Driver read path and Device.process, the whole
+                  processing chain, scans per second and per-packet latency
+    decode        legacy Driver.read_number versus vectorized decode
+    buffer        CircularBuffer and RingBuffer append and reads
+    conversion    counts to Volts/degrees C
+    serialization msgpack/msgpack_numpy versus raw bytes versus .npy
+    codec         lossless codecs of dataq_di_245.codec: compression ratio and
+                  encode/decode throughput
+    pipeline      emulator driven read, decode, buffer and convert loop with
+                  per-packet latency
+    import        time to import the package modules in a fresh interpreter
+
+Every benchmark returns a list of records (dictionaries) with the name,
+parameters, best time per call in seconds and throughput. run_all() adds
+a header with versions and platform so results from different releases
+can be compared. The command line writes the results as JSON:
+
+    python -m dataq_di_245.serialization_benchmarks --output results.json
+
+Valentyn Stadnytskyi
+"""
+from time import perf_counter
+from logging import debug, info
+
+N_of_channels = 4
+packet_sizes = [10, 100, 1000, 10000]
+
+
+def timeit(func, number = 1, repeat = 5):
+    """
+    returns the best time per call of func, seconds
+
+    Parameters
+    ----------
+    func :: callable
+        function without arguments
+    number :: integer, optional
+        number of calls per repeat
+    repeat :: integer, optional
+        number of repeats, the best one is reported
+
+    Returns
+    -------
+    time :: float
+        best time per call, seconds
+
+    Examples
+    --------
+    >>> timeit(lambda: sum(range(100)), number = 100)
+    """
+    best = float('inf')
+    for i in range(repeat):
+        t = perf_counter()
+        for j in range(number):
+            func()
+        best = min(best, (perf_counter() - t)/number)
+    return best
+
+
+def record(name, seconds, N_of_points, N_of_channels = N_of_channels, **params):
+    """
+    returns benchmark record as a dictionary
+    """
+    params['N_of_points'] = N_of_points
+    params['N_of_channels'] = N_of_channels
+    result = {}
+    result['name'] = name
+    result['params'] = params
+    result['seconds'] = seconds
+    result['samples_per_second'] = N_of_points*N_of_channels/seconds
+    debug('{}: {}'.format(name, result))
+    return result
+
+
+def synthetic_values(N_of_points, N_of_channels = N_of_channels, seed = 0):
+    """
+    returns (N channels x N points) array of 14-bit values
+    """
+    from numpy.random import RandomState
+    return RandomState(seed).randint(0, 2**14, size = (N_of_channels, N_of_points))
+
+
+def bench_decode(sizes = packet_sizes, repeat = 5, legacy_limit = 1000):
+    """
+    legacy read_number (bit strings, one word at a time) versus vectorized
+    decode. The legacy path is only measured for packets up to legacy_limit
+    points because it is slow.
+    """
+    from io import BytesIO
+    from dataq_di_245.driver import Driver, decode, encode
+    results = []
+    driver = Driver()
+    for N in sizes:
+        raw = encode(synthetic_values(N))
+        t = timeit(lambda: decode(raw, N_of_channels, N), number = max(1, 10000//N), repeat = repeat)
+        results.append(record('decode.vectorized', t, N))
+        if N <= legacy_limit:
+            def legacy():
+                driver.port = BytesIO(raw)
+                driver.read_number(N_of_channels, N)
+            t = timeit(legacy, number = 1, repeat = repeat)
+            results.append(record('decode.read_number', t, N))
+    return results
+
+
+def synthetic_signal(N_of_points, N_of_channels = N_of_channels, seed = 0, noise = 3.0):
+    """
+    returns (N points x N channels) int16 counts of slowly varying signals
+    with Gaussian noise (noise counts rms), a stand-in for measured data
+    """
+    from numpy import arange, sin, pi, clip
+    from numpy.random import RandomState
+    t = arange(N_of_points)[:, None]
+    periods = 1000.0*(1 + arange(N_of_channels))
+    signal = 4000*sin(2*pi*t/periods) + RandomState(seed).normal(0, noise, size = (N_of_points, N_of_channels))
+    return clip(signal.round(), -8192, 8191).astype('int16')
+
+
+def bench_buffer(sizes = packet_sizes, repeat = 5, buffer_size = 100000):
+    """
+    CircularBuffer.append of one packet and get_last_N of the same length,
+    RingBuffer.append and the validated RingBuffer.read
+    """
+    from circular_buffer_numpy.circular_buffer import CircularBuffer
+    from dataq_di_245.ring import RingBuffer
+    results = []
+    for N in sizes:
+        buffer = CircularBuffer(shape = (buffer_size, N_of_channels), dtype = 'int16')
+        data = synthetic_values(N).T.astype('int16')
+        t = timeit(lambda: buffer.append(data), number = max(1, 10000//N), repeat = repeat)
+        results.append(record('buffer.append', t, N))
+        t = timeit(lambda: buffer.get_last_N(N), number = max(1, 10000//N), repeat = repeat)
+        results.append(record('buffer.get_last_N', t, N))
+        ring = RingBuffer(shape = (buffer_size, N_of_channels), dtype = 'int16')
+        t = timeit(lambda: ring.append(data), number = max(1, 10000//N), repeat = repeat)
+        results.append(record('buffer.ring.append', t, N))
+        t = timeit(lambda: ring.read(N), number = max(1, 10000//N), repeat = repeat)
+        results.append(record('buffer.ring.read', t, N))
+    return results
+
+
+def bench_conversion(sizes = packet_sizes, repeat = 5, gain_lst = ('5', '5', '5', 'T-thrmc')):
+    """
+    counts to physical units
+    """
+    from dataq_di_245.conversion import to_units
+    results = []
+    for N in sizes:
+        data = synthetic_values(N).T.astype('int16') - 8192
+        t = timeit(lambda: to_units(data, gain_lst), number = max(1, 10000//N), repeat = repeat)
+        results.append(record('conversion.to_units', t, N))
+    return results
+
+
+def bench_serialization(sizes = packet_sizes, repeat = 5):
+    """
+    serialization and deserialization of one packet: msgpack with
+    msgpack_numpy, raw bytes and the .npy format
+    """
+    from io import BytesIO
+    from numpy import frombuffer, save, load
+    import msgpack
+    import msgpack_numpy
+    results = []
+    for N in sizes:
+        data = synthetic_values(N).T.astype('int16')
+        number = max(1, 10000//N)
+
+        packed = msgpack.packb(data, default = msgpack_numpy.encode)
+        t = timeit(lambda: msgpack.packb(data, default = msgpack_numpy.encode), number = number, repeat = repeat)
+        results.append(record('serialization.msgpack.dumps', t, N, nbytes = len(packed)))
+        t = timeit(lambda: msgpack.unpackb(packed, object_hook = msgpack_numpy.decode), number = number,
+                   repeat = repeat)
+        results.append(record('serialization.msgpack.loads', t, N, nbytes = len(packed)))
+
+        raw = data.tobytes()
+        t = timeit(lambda: data.tobytes(), number = number, repeat = repeat)
+        results.append(record('serialization.raw.dumps', t, N, nbytes = len(raw)))
+        t = timeit(lambda: frombuffer(raw, dtype = 'int16').reshape((N, N_of_channels)), number = number,
+                   repeat = repeat)
+        results.append(record('serialization.raw.loads', t, N, nbytes = len(raw)))
+
+        def npy_dumps():
+            f = BytesIO()
+            save(f, data)
+            return f.getvalue()
+        npy = npy_dumps()
+        t = timeit(npy_dumps, number = number, repeat = repeat)
+        results.append(record('serialization.npy.dumps', t, N, nbytes = len(npy)))
+        t = timeit(lambda: load(BytesIO(npy)), number = number, repeat = repeat)
+        results.append(record('serialization.npy.loads', t, N, nbytes = len(npy)))
+    return results
+
+
+def bench_codec(sizes = packet_sizes, repeat = 5,
+                specs = ('pack14', 'zlib:1', 'delta+zlib:1', 'delta+zlib:6', 'delta+pack14+zlib:1', 'delta+lzma:0')):
+    """
+    encode and decode of one block of synthetic_signal with every codec in
+    specs. The records report the compressed size and the ratio (raw int16
+    bytes over compressed bytes).
+    """
+    from dataq_di_245.codec import Codec
+    results = []
+    for N in sizes:
+        data = synthetic_signal(N)
+        number = max(1, 10000//N)
+        for spec in specs:
+            codec = Codec(spec)
+            payload = codec.encode(data)
+            ratio = data.nbytes/float(len(payload))
+            t = timeit(lambda: codec.encode(data), number = number, repeat = repeat)
+            results.append(record('codec.{}.encode'.format(spec), t, N, nbytes = len(payload), ratio = ratio))
+            t = timeit(lambda: codec.decode(payload, N, N_of_channels), number = number, repeat = repeat)
+            results.append(record('codec.{}.decode'.format(spec), t, N, nbytes = len(payload), ratio = ratio))
+    return results
+
+
+def percentile(values, q):
+    from numpy import percentile as _percentile
+    return float(_percentile(values, q))
+
+
+def bench_pipeline(sizes = packet_sizes, repeat = 5, N_of_samples = 100000, gain_lst = ('5', '5', '5', 'T-thrmc')):
+    """
+    end-to-end acquisition loop against a free running emulator: read raw
+    packet from the port, decode, remove offset, append to CircularBuffer and
+    convert to units. Reports throughput over N_of_samples scans and the
+    per-packet latency (time from the read request until the converted
+    packet is available) percentiles.
+    """
+    from numpy import array
+    from circular_buffer_numpy.circular_buffer import CircularBuffer
+    from dataq_di_245.emulator import EmulatedDriver
+    from dataq_di_245.conversion import to_units
+    results = []
+    for N in sizes:
+        N_of_packets = max(1, N_of_samples//N)
+        best = None
+        for i in range(repeat):
+            driver = EmulatedDriver()
+            driver.port = driver.use_com_port()
+            driver.start_scan()
+            buffer = CircularBuffer(shape = (N_of_packets*N, N_of_channels), dtype = 'int16')
+            latency = []
+            tstart = perf_counter()
+            for j in range(N_of_packets):
+                t = perf_counter()
+                raw = driver.read_buffer(N_of_channels, N)
+                value_array = driver.convert_buffer_to_array(raw, N_of_channels, N).T - 8192
+                buffer.append(value_array)
+                to_units(value_array, gain_lst)
+                latency.append(perf_counter() - t)
+            seconds = perf_counter() - tstart
+            driver.stop_scan()
+            if best is None or seconds < best[0]:
+                best = seconds, array(latency)
+        seconds, latency = best
+        results.append(record('pipeline.emulator', seconds, N*N_of_packets, packet_length = N,
+                              latency_p50 = percentile(latency, 50), latency_p95 = percentile(latency, 95),
+                              latency_max = float(latency.max())))
+    return results
+
+
+def bench_replay(sizes = packet_sizes, repeat = 5, N_of_samples = 100000, codec = 'raw'):
+    """
+    headline benchmark: a recording of synthetic_signal is replayed as fast
+    as possible (dataq_di_245.replay) and every packet goes through the read
+    path of Device.run (Driver.iter_packets: read, sync check, decode) and
+    Device.process (buffer, timebase, quality, derived channels,
+    subscriptions, publishing) with the default processing settings. The
+    Device settings that add optional stages are pinned, so the result does
+    not depend on the saved settings. Reports the processing throughput and
+    the per-packet latency percentiles.
+    """
+    import os
+    import shutil
+    from tempfile import mkdtemp
+    from numpy import array, errstate
+    from dataq_di_245.derived import default_definitions
+    from dataq_di_245.recording import Recorder
+    from dataq_di_245.replay import replay_device
+    settings = dict(packet_sizing = {}, buffer_size = N_of_samples, derived = default_definitions,
+                    derived_buffer_size = 0, filters = [], spectrum = {}, triggers = [], autorange = {},
+                    archive_directory = '')
+    scan_lst = [str(i) for i in range(N_of_channels)]
+    directory = mkdtemp()
+    filename = os.path.join(directory, 'replay.di245')
+    results = []
+    try:
+        data = synthetic_signal(N_of_samples)
+        with Recorder(filename, N_of_channels = N_of_channels, scan_lst = scan_lst, phys_ch_lst = scan_lst,
+                      gain_lst = ['5']*N_of_channels, codec = codec) as recorder:
+            for i in range(0, N_of_samples, 1000):
+                recorder.write(data[i:i + 1000], sequence = i, t = i/1000.0, rate = 1000.0)
+        for N in sizes:
+            total = max(1, N_of_samples//N)*N
+            best = None
+            for i in range(repeat):
+                device = replay_device(filename, speed = None, packet_length = N, **settings)
+                driver = device.driver
+                driver.start_scan()
+                device.timebase.start(0)
+                latency = []
+                packets = driver.iter_packets(N, N_of_channels = N_of_channels, scan = False,
+                                              abort = lambda: device.buffer.g_pointer + 1 >= total)
+                with errstate(all = 'ignore'):
+                    tstart = perf_counter()
+                    t = perf_counter()
+                    for value_array in packets:
+                        device.process(value_array)
+                        latency.append(perf_counter() - t)
+                        t = perf_counter()
+                    seconds = perf_counter() - tstart
+                driver.stop_scan()
+                driver.close()
+                if best is None or seconds < best[0]:
+                    best = seconds, array(latency)
+            seconds, latency = best
+            results.append(record('replay.device', seconds, total, packet_length = N, codec = codec,
+                                  latency_p50 = percentile(latency, 50), latency_p95 = percentile(latency, 95),
+                                  latency_max = float(latency.max())))
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+    return results
+
+
+def bench_import(sizes = None, repeat = 5,
+                 modules = ('dataq_di_245', 'dataq_di_245.driver', 'dataq_di_245.device')):
+    """
+    import time of the package modules, each measured in a fresh interpreter
+    (best of repeat). The record reports imports per second as throughput
+    and lists heavy modules (numpy, serial, yaml, ...) loaded by the import.
+    sizes is ignored.
+    """
+    import json
+    import os
+    import subprocess
+    from sys import executable
+    # the interpreter imports this package, wherever it was started from
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = [root] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(path))
+    heavy = ['numpy', 'serial', 'yaml', 'msgpack', 'msgpack_numpy', 'ubcs_auxiliary', 'circular_buffer_numpy',
+             'pdb', 'subprocess']
+    script = ('import sys, json, time; t = time.perf_counter(); import {}; t = time.perf_counter() - t; '
+              'print(json.dumps([t, [m for m in {!r} if m in sys.modules]]))')
+    results = []
+    for module in modules:
+        best = None
+        for i in range(repeat):
+            output = subprocess.check_output([executable, '-c', script.format(module, heavy)], env = env)
+            seconds, loaded = json.loads(output.decode())
+            if best is None or seconds < best[0]:
+                best = seconds, loaded
+        results.append(record('import.' + module, best[0], 1, N_of_channels = 1, heavy_modules = best[1]))
+    return results
+
+
+benchmarks = {}
+benchmarks['replay'] = bench_replay
+benchmarks['decode'] = bench_decode
+benchmarks['buffer'] = bench_buffer
+benchmarks['conversion'] = bench_conversion
+benchmarks['serialization'] = bench_serialization
+benchmarks['codec'] = bench_codec
+benchmarks['pipeline'] = bench_pipeline
+benchmarks['import'] = bench_import
+
+
+def run_all(names = None, sizes = packet_sizes, repeat = 5):
+    """
+    runs selected (default all) benchmarks and returns a dictionary with
+    a header and a list of results
+
+    Examples
+    --------
+    >>> results = run_all(names = ['decode'], sizes = [10, 100])
+    >>> results['results'][0]['name']
+    'decode.vectorized'
+    """
+    import platform
+    import numpy
+    from time import time
+    from dataq_di_245 import __version__
+    if names is None:
+        names = list(benchmarks.keys())
+    header = {}
+    header['version'] = __version__
+    header['python'] = platform.python_version()
+    header['numpy'] = numpy.__version__
+    header['platform'] = platform.platform()
+    header['time'] = time()
+    results = []
+    for name in names:
+        info('running benchmark {}'.format(name))
+        results += benchmarks[name](sizes = sizes, repeat = repeat)
+    return {'header': header, 'results': results}
+
+
+def main(argv = None):
+    """
+    command line interface, writes JSON to --output or stdout
+    """
+    import json
+    from sys import stdout
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description = 'DI-245 acquisition pipeline benchmarks')
+    parser.add_argument('names', nargs = '*',
+                        help = 'benchmarks to run: {}, default all'.format(', '.join(benchmarks)))
+    parser.add_argument('--sizes', type = int, nargs = '+', default = packet_sizes,
+                        help = 'packet sizes, points')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--output', default = None, help = 'JSON file, default stdout')
+    args = parser.parse_args(argv)
+    for name in args.names:
+        if name not in benchmarks:
+            parser.error('unknown benchmark {!r}'.format(name))
+    results = run_all(names = args.names or None, sizes = args.sizes, repeat = args.repeat)
+    if args.output is None:
+        json.dump(results, stdout, indent = 1)
+        stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+    return results
+
+
+if __name__ == "__main__":
+    import logging
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
+    main()
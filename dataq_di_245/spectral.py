@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Rolling spectral monitor: Welch-averaged power spectral density of every
+channel of a CircularBuffer, updated incrementally as packets arrive.
+
+The buffer is cut into segments of segment_length samples that overlap by
+the overlap fraction. Every new complete segment is copied from the ring into
+a preallocated array (a validated read from a RingBuffer), its mean is removed, it is multiplied
+by a Hann window and transformed with a real FFT. The power spectra of the
+last `averages` segments are kept in a preallocated array together with their
+running sum, so the averaged PSD can be queried at any time without
+recomputing anything. All work arrays are preallocated; numpy.fft caches the
+FFT plan of the segment length between calls.
+
+The CPU cost is bounded: at most max_segments segments are processed per
+update; if the monitor falls behind, older segments are skipped (counted in
+self.skipped). At 8000 samples per second, 1024-sample segments with 50%
+overlap are about 16 FFTs per second.
+
+Examples
+--------
+>>> monitor = SpectralMonitor(device.buffer, segment_length = 1024, timebase = device.timebase,
+...                           gain_lst = device.active_gain_lst)
+>>> monitor.update()
+>>> frequencies, psd = monitor.get_psd()
+>>> monitor.peaks(channel = 0)
+[(60.0, 2.1e-07), (120.0, 1.3e-08), ...]
+
+Valentyn Stadnytskyi
+"""
+from threading import RLock
+
+
+class SpectralMonitor(object):
+    def __init__(self, buffer, segment_length = 1024, overlap = 0.5, averages = 16, gain_lst = None,
+                 timebase = None, rate = None, max_segments = None):
+        """
+        Parameters
+        ----------
+        buffer :: CircularBuffer
+            (N points x N channels) buffer of counts, e.g. Device.buffer
+        segment_length :: integer
+            samples per FFT segment
+        overlap :: float
+            overlap of consecutive segments, fraction of segment_length
+        averages :: integer
+            number of segments in the average
+        gain_lst :: list, optional
+            gains of the channels, if given the PSD is in (Volts or degrees C)**2/Hz
+        timebase :: Timebase, optional
+            provides the sample rate, e.g. Device.timebase
+        rate :: float, optional
+            sample rate, scans per second, overrides the timebase
+        max_segments :: integer, optional
+            maximum number of segments processed per update, default averages
+        """
+        from numpy import hanning, zeros, empty
+        self.buffer = buffer
+        self.segment_length = segment_length
+        self.step = max(1, int(round(segment_length*(1 - overlap))))
+        self.averages = averages
+        self.gain_lst = gain_lst
+        self.timebase = timebase
+        self.rate = rate
+        self.max_segments = max_segments or averages
+        N_of_channels = buffer.shape[1]
+        self.N_of_frequencies = segment_length//2 + 1
+        self.window = hanning(segment_length)[:, None]
+        self.window_power = float((self.window**2).sum())
+        self.segment = empty((segment_length, N_of_channels))
+        self.data = empty((segment_length, N_of_channels), dtype = buffer.dtype)
+        self.powers = zeros((averages, self.N_of_frequencies, N_of_channels))
+        self.sum = zeros((self.N_of_frequencies, N_of_channels))
+        self.count = 0
+        self.slot = 0
+        self.skipped = 0
+        self.lock = RLock()
+        self.reset()
+
+    def reset(self):
+        """
+        forgets the average and starts with the next complete segment
+        """
+        with self.lock:
+            self.powers[:] = 0
+            self.sum[:] = 0
+            self.count = 0
+            self.slot = 0
+            # global index of the last sample of the next segment
+            self.next_end = self.buffer.g_pointer + self.segment_length
+
+    def update(self):
+        """
+        adds the complete segments that arrived since the last update
+
+        Returns
+        -------
+        N :: integer
+            number of segments added
+        """
+        from numpy import subtract, multiply, absolute
+        from numpy.fft import rfft
+        from dataq_di_245.ring import read_global
+        with self.lock:
+            g_pointer = self.buffer.g_pointer
+            if g_pointer < self.next_end:
+                return 0
+            N = (g_pointer - self.next_end)//self.step + 1
+            skip = max(0, N - self.max_segments)
+            # segments that start before the oldest sample still in the ring are lost
+            lost = g_pointer - self.buffer.length + 1 - (self.next_end - self.segment_length + 1)
+            if lost > 0:
+                skip = max(skip, -(-lost//self.step))
+            if skip > 0:
+                self.next_end += skip*self.step
+                self.skipped += skip
+                N -= skip
+            added = 0
+            for i in range(N):
+                try:
+                    data = read_global(self.buffer, self.segment_length, self.next_end, out = self.data)
+                except IndexError:
+                    # overwritten by the writer while copying
+                    self.skipped += 1
+                    self.next_end += self.step
+                    continue
+                subtract(data, data.mean(axis = 0), out = self.segment)
+                multiply(self.segment, self.window, out = self.segment)
+                power = self.powers[self.slot]
+                self.sum -= power
+                absolute(rfft(self.segment, axis = 0), out = power)
+                multiply(power, power, out = power)
+                self.sum += power
+                self.slot = (self.slot + 1) % self.averages
+                if self.slot == 0:
+                    # the running sum is recomputed once per cycle to bound the rounding errors
+                    self.powers.sum(axis = 0, out = self.sum)
+                self.count = min(self.count + 1, self.averages)
+                self.next_end += self.step
+                added += 1
+            return added
+
+    def get_rate(self):
+        if self.rate is not None:
+            return self.rate
+        if self.timebase is not None and self.timebase.rate:
+            return self.timebase.rate
+        return 1.0
+
+    def get_psd(self):
+        """
+        returns the averaged one-sided power spectral density
+
+        Returns
+        -------
+        tuple :: (frequencies, psd)
+            frequencies (N frequencies), Hz (cycles per sample if the rate is
+            unknown), and (N frequencies x N channels) PSD in counts**2/Hz or
+            units**2/Hz if gain_lst is given. Zeros before the first segment.
+        """
+        from numpy.fft import rfftfreq
+        rate = self.get_rate()
+        with self.lock:
+            psd = self.sum/max(self.count, 1)
+        psd *= 1.0/(rate*self.window_power)
+        if self.segment_length % 2:
+            psd[1:] *= 2
+        else:
+            psd[1:-1] *= 2
+        if self.gain_lst is not None:
+            from dataq_di_245.conversion import coefficients
+            slope, intercept = coefficients(self.gain_lst)
+            psd *= slope**2
+        return rfftfreq(self.segment_length, 1.0/rate), psd
+
+    def peaks(self, channel = 0, N = 5):
+        """
+        returns the N strongest frequency bins of a channel (DC excluded)
+
+        Returns
+        -------
+        list :: [(frequency, psd), ...]
+            strongest first
+        """
+        frequencies, psd = self.get_psd()
+        order = psd[1:, channel].argsort()[::-1][:N] + 1
+        return [(float(frequencies[i]), float(psd[i, channel])) for i in order]
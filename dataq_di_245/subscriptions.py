@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Subscriptions: notifications about new samples in a CircularBuffer.
+
+Instead of polling Device.buffer, consumers subscribe and are notified when
+
+    samples = N     at least N new samples have accumulated
+    interval = T    T seconds have passed and there is new data
+    neither         every new packet
+
+The acquisition thread only calls Subscriptions.notify(g_pointer, t), which
+compares a few numbers per subscriber and appends a Notification to the
+subscriber's own bounded queue. Callbacks run in a separate thread per
+subscriber, so a slow subscriber never stalls the reader. When the queue of a
+subscriber is full the drop policy decides what happens:
+
+    'drop_oldest'   the oldest pending notification is discarded (default)
+    'drop_newest'   the new notification is discarded
+    'coalesce'      the new samples are merged into the last pending notification
+
+Subscribers without a callback wait for notifications with get(timeout).
+
+A Notification carries the global indices of the new samples; the samples stay
+in the ring buffer and are read with Notification.data, safely from the
+dispatch thread (see the concurrency contract in dataq_di_245.ring). Check
+Notification.overwritten if a subscriber can fall behind by more than the
+buffer length. If the Subscriptions have a QualityMonitor (Device does),
+Notification.flags tells whether any of the new samples were clipped, so a
+consumer can discard a bad window without reading it (see quality.py).
+
+Examples
+--------
+>>> subscription = device.subscribe(callback = print, samples = 1000)
+>>> device.unsubscribe(subscription)
+
+>>> subscription = device.subscribe(interval = 1.0)
+>>> notification = subscription.get(timeout = 2.0)
+>>> notification.data.mean(axis = 0)
+
+Valentyn Stadnytskyi
+"""
+from time import time
+from threading import RLock, Condition
+from logging import error, debug
+import traceback
+
+policies = ('drop_oldest', 'drop_newest', 'coalesce')
+
+
+class Notification(object):
+    """
+    new samples first..last (global indices, inclusive) in the buffer, time is
+    the time of the notification
+    """
+    def __init__(self, buffer, first, last, time, quality = None):
+        self.buffer = buffer
+        self.first = first
+        self.last = last
+        self.time = time
+        self.quality = quality
+
+    @property
+    def N(self):
+        return self.last - self.first + 1
+
+    @property
+    def overwritten(self):
+        """
+        True if some of the samples were already overwritten in the ring buffer
+        """
+        return self.buffer.g_pointer - self.first >= self.buffer.length
+
+    @property
+    def data(self):
+        """
+        (N points x N channels) samples, a validated copy if the buffer is a
+        RingBuffer (IndexError if they were overwritten), otherwise a view
+        """
+        from dataq_di_245.ring import read_global
+        return read_global(self.buffer, self.N, self.last)
+
+    @property
+    def flags(self):
+        """
+        quality flags of the samples (quality.CLIPPED, quality.SATURATED), 0
+        without a QualityMonitor
+        """
+        if self.quality is None:
+            return 0
+        return self.quality.quality_of(self.first, self.last)[0]
+
+    @property
+    def clipped(self):
+        """
+        number of clipped samples per channel, None without a QualityMonitor
+        """
+        if self.quality is None:
+            return None
+        return self.quality.quality_of(self.first, self.last)[1]
+
+    def __repr__(self):
+        return 'Notification(first={}, last={}, time={})'.format(self.first, self.last, self.time)
+
+
+class Subscription(object):
+    """
+    one subscriber: trigger condition, bounded queue and dispatch thread
+    """
+    def __init__(self, buffer, callback = None, samples = None, interval = None, queue_size = 16,
+                 policy = 'drop_oldest', quality = None):
+        """
+        Parameters
+        ----------
+        buffer :: CircularBuffer
+            buffer the indices refer to, e.g. Device.buffer
+        callback :: callable, optional
+            callback(notification), called in the dispatch thread
+        samples :: integer, optional
+            notify when at least this many new samples have accumulated
+        interval :: float, optional
+            notify when this many seconds have passed and there is new data
+        queue_size :: integer
+            maximum number of pending notifications
+        policy :: str
+            'drop_oldest', 'drop_newest' or 'coalesce'
+        quality :: QualityMonitor, optional
+            clip bitmask in step with buffer, see Notification.flags
+        """
+        from collections import deque
+        if policy not in policies:
+            raise ValueError('unknown drop policy {!r}, expected one of {}'.format(policy, policies))
+        self.buffer = buffer
+        self.callback = callback
+        self.samples = samples
+        self.interval = interval
+        self.queue_size = queue_size
+        self.policy = policy
+        self.quality = quality
+        self.queue = deque()
+        self.condition = Condition(RLock())
+        self.first = buffer.g_pointer + 1
+        self.last_time = time()
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.running = False
+        self.thread = None
+
+    def check(self, g_pointer, t):
+        """
+        returns Notification if the trigger condition is met, None otherwise.
+        Called from the acquisition thread.
+        """
+        new = g_pointer - self.first + 1
+        if new <= 0:
+            return None
+        if self.samples is None and self.interval is None:
+            due = True
+        else:
+            due = ((self.samples is not None and new >= self.samples) or
+                   (self.interval is not None and t - self.last_time >= self.interval))
+        if not due:
+            return None
+        notification = Notification(self.buffer, self.first, g_pointer, t, quality = self.quality)
+        self.first = g_pointer + 1
+        self.last_time = t
+        return notification
+
+    def put(self, notification):
+        """
+        queues notification, applying the drop policy if the queue is full. Never blocks.
+        """
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                if self.policy == 'drop_oldest':
+                    self.queue.popleft()
+                    self.dropped += 1
+                elif self.policy == 'drop_newest':
+                    self.dropped += 1
+                    return
+                else:
+                    pending = self.queue[-1]
+                    pending.last = notification.last
+                    pending.time = notification.time
+                    self.coalesced += 1
+                    return
+            self.queue.append(notification)
+            self.condition.notify()
+
+    def get(self, timeout = None):
+        """
+        returns the next notification, waits up to timeout seconds. None if
+        there is none.
+        """
+        with self.condition:
+            if len(self.queue) == 0:
+                self.condition.wait(timeout)
+            if len(self.queue) == 0:
+                return None
+            self.delivered += 1
+            return self.queue.popleft()
+
+    def run(self):
+        debug('subscription thread started')
+        while self.running:
+            notification = self.get(timeout = 1.0)
+            if notification is None:
+                continue
+            try:
+                self.callback(notification)
+            except Exception:
+                error(traceback.format_exc())
+        debug('subscription thread stopped')
+
+    def start(self):
+        from ubcs_auxiliary.multithreading import new_thread
+        if self.callback is not None and not self.running:
+            self.running = True
+            self.thread = new_thread(self.run)
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+class Subscriptions(object):
+    """
+    subscribers of one buffer
+    """
+    def __init__(self, buffer, quality = None):
+        self.buffer = buffer
+        self.quality = quality
+        self.lock = RLock()
+        self.subscriptions = []
+
+    def subscribe(self, callback = None, samples = None, interval = None, queue_size = 16, policy = 'drop_oldest'):
+        """
+        adds a subscriber, see Subscription for the parameters
+
+        Returns
+        -------
+        subscription :: Subscription
+        """
+        subscription = Subscription(self.buffer, callback = callback, samples = samples, interval = interval,
+                                    queue_size = queue_size, policy = policy, quality = self.quality)
+        subscription.start()
+        with self.lock:
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions = [item for item in self.subscriptions if item is not subscription]
+        subscription.stop()
+
+    def notify(self, g_pointer, t = None):
+        """
+        called from the acquisition thread after new samples up to g_pointer
+        were appended to the buffer
+        """
+        if t is None:
+            t = time()
+        for subscription in self.subscriptions:
+            notification = subscription.check(g_pointer, t)
+            if notification is not None:
+                subscription.put(notification)
+
+    def stop(self):
+        """
+        removes all subscribers
+        """
+        for subscription in list(self.subscriptions):
+            self.unsubscribe(subscription)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep
+
+import numpy as np
+
+from ubcs_auxiliary.saved_property import DataBase, SavedProperty
+
+from dataq_di_245.autorange import AutoRange
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+from dataq_di_245.recording import Reader
+
+amplitudes = np.array([0.15, 3.0, 0.03, 15.0])
+
+
+def voltage(t, N_of_channels):
+    return amplitudes[:N_of_channels, None]*np.sin(2*np.pi*10*t[None, :])
+
+
+def test_select_tightest_range():
+    autorange = AutoRange(['5', '5', '5', 'T-thrmc'], window=100, headroom=0.8)
+    counts = np.zeros((60, 4), dtype='int16')
+    counts[0] = [int(0.3/5*8192), 8191, int(4.0/5*8192), 8191]
+    assert autorange.update(counts) is None
+    assert autorange.update(-counts) == ['0.5', '10', '5', 'T-thrmc']
+    assert autorange.count == 0
+    assert autorange.update(np.zeros((100, 4), dtype='int16'))[:3] == ['0.010']*3
+    assert AutoRange(['50'], window=1).update(np.array([[-8192]])) is None
+
+
+def test_device_switches_ranges(tmp_path):
+    "Auto-ranging changes the gains in effect, never the saved gain_lst setting."
+    db = DataBase(root=str(tmp_path), name='AutoRangeDevice')
+    AutoRangeDevice = type('AutoRangeDevice', (Device,), {'gain_lst': SavedProperty(db, 'gain_lst',
+                                                                                    ['5', '5', '5', '5']).init(),
+                                                          'autorange': {'window': 300, 'headroom': 0.8},
+                                                          'archive_directory': str(tmp_path / 'archive'),
+                                                          'buffer_size': 20000})
+    device = AutoRangeDevice()
+    assert device.init('EMU1', driver=EmulatedDriver('EMU1', rate=1000, voltage=voltage),
+                       publisher=LocalPublisher(), cache=DeviceCache(str(tmp_path)))
+    device.start()
+    sleep(2.5)
+    device.stop()
+    assert device.active_gain_lst == ['0.25', '5', '0.05', '25']
+    assert device.gain_lst == ['5', '5', '5', '5'] and AutoRangeDevice().gain_lst == ['5', '5', '5', '5']
+    assert 'gain_lst' not in DataBase(root=str(tmp_path), name='AutoRangeDevice').read()
+    assert device.autoranger.changes >= 2
+    gaps = device.timebase.gaps
+    assert len(gaps) == device.autoranger.changes
+    assert gaps[-1].gain_lst == device.active_gain_lst and gaps[-1].gap > 0
+    assert device.timebase.segments[0].gain_lst == ['5', '5', '5', '5']
+
+    # every sample is converted with the gains it was acquired with
+    last = device.buffer.g_pointer
+    volts = device.get_range(device.timebase.time_of(0), device.timebase.time_of(last), units=True)
+    assert volts.shape == (last + 1, 4)
+    assert np.allclose(np.abs(volts[:, :3]).max(axis=0), amplitudes[:3], rtol=0.05)
+    segment = device.timebase.segments[-1]
+    assert np.allclose(np.abs(volts[segment.index:, 3]).max(), amplitudes[3], rtol=0.05)
+
+    # a new recording for every configuration
+    filenames = device.archive.filenames
+    assert len(filenames) == device.autoranger.changes + 1
+    with Reader(filenames[-1]) as reader:
+        assert reader.header['gain_lst'] == device.active_gain_lst
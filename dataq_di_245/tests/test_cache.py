@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import time, sleep
+
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+
+
+def test_warm_start(tmp_path):
+    "With a cached description and unchanged configuration the device skips all slow queries."
+    cache = DeviceCache(str(tmp_path))
+    device = Device()
+    assert device.init('EMU1', driver=EmulatedDriver('EMU1', read_timeout=0.1), publisher=LocalPublisher(),
+                       cache=cache)
+    assert not device.driver.description_cached
+    assert cache.get_description('EMU1')['Serial Number'] == b'EMU1'
+    assert cache.get_config_hash('EMU1') is not None
+
+    device = Device()
+    t = time()
+    # read_timeout=10 reproduces the real 1 s wait per query
+    assert device.init('EMU1', driver=EmulatedDriver('EMU1', read_timeout=10, rate=1000),
+                       publisher=LocalPublisher(), cache=DeviceCache(str(tmp_path)))
+    device.start()
+    while device.buffer.g_pointer < 0:
+        sleep(0.01)
+    assert time() - t < 1.0
+    assert device.driver.description_cached
+    assert device.driver.description['Device name'] == b'2450'
+    device.running = False
+    device.driver.stop_scan()
+    device.publishing.stop()
+    device.waveforms.stop()
+
+
+def test_devices_share_cache_file(tmp_path):
+    "Devices with their own DeviceCache over the same file keep each other's entries."
+    from concurrent.futures import ThreadPoolExecutor
+    serial_numbers = ['EMU1', 'EMU2', 'EMU3']
+    # every cache reads the file before any device has written to it
+    caches = [DeviceCache(str(tmp_path)) for serial_number in serial_numbers]
+
+    def init(serial_number, cache):
+        return Device().init(serial_number, driver=EmulatedDriver(serial_number, read_timeout=0.1),
+                             publisher=LocalPublisher(), cache=cache)
+    with ThreadPoolExecutor(3) as executor:
+        assert all(executor.map(init, serial_numbers, caches))
+    cache = DeviceCache(str(tmp_path))
+    assert sorted(cache.db.database) == serial_numbers
+    assert all(cache.get_config_hash(serial_number) for serial_number in serial_numbers)
+    caches[0].invalidate('EMU2')
+    cache = DeviceCache(str(tmp_path))
+    assert cache.get_config_hash('EMU2') is None and cache.get_config_hash('EMU3') is not None
+
+
+def test_background_refresh_does_not_interleave_commands():
+    "Commands sent while the description is refreshed in the background wait for its replies."
+    driver = EmulatedDriver('EMU1', read_timeout=0.1)
+    assert driver.init('EMU1')
+    for i in range(5):
+        driver.description_cached = True
+        driver.refresh_description_in_background()
+        success, result = driver.config_channels(scan_lst=['0', '1'], phys_ch_lst=['0', '1'], gain_lst=['5', '5'])
+        driver.refresh_thread.join()
+        assert success and all(result)
+        assert driver.description['Serial Number'] == b'EMU1'
+        assert driver.description['Device name'] == b'2450'
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from numpy import loadtxt
+
+from dataq_di_245.cli import main, parser, record
+from dataq_di_245.driver import encode, sync_errors
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.recording import Reader
+
+
+def test_record_emulator(tmp_path, capsys):
+    "record writes every received scan into the recording file and reports the rate."
+    filename = str(tmp_path / 'data.di245')
+    stats = record(parser().parse_args(['record', filename, '--emulator', '--emulator-rate', '1000', '--no-cache',
+                                        '--channels', '0', '1', '--gains', '5', 'T-thrmc', '--points', '50',
+                                        '--duration', '0.5']))
+    assert 'scans/s' in capsys.readouterr().err
+    assert stats.dropped == 0 and stats.scans >= 300
+    with Reader(filename) as reader:
+        assert reader.header['gain_lst'] == ['5', 'T-thrmc']
+        data = reader.read()
+        assert data.shape == (stats.scans, 2)
+        assert reader.chunks[1].sequence == 50
+        assert abs(reader.chunks[0].rate - 1000) < 200
+
+
+def test_stream_csv(capsysbinary):
+    "main returns the exit status of the console script."
+    assert main(['stream', '--emulator', '--no-cache', '--points', '10', '--duration', '0.2', '--format', 'csv']) == 0
+    rows = loadtxt(capsysbinary.readouterr().out.decode().splitlines(), delimiter = ',')
+    assert rows.shape[1] == 5
+    assert (abs(rows[:, 1:]) <= 8192).all()
+
+
+def test_resync_after_lost_bytes():
+    "A lost byte is detected by the sync bits and the stream is realigned on the next scan."
+    from numpy import arange
+    driver = EmulatedDriver()
+    driver.port = driver.use_com_port()
+    driver.start_scan()
+    raw = driver.read_buffer(N_of_channels = 4, N_of_points = 10)
+    assert sync_errors(raw, 4) == 0
+    driver.port.read(3)
+    assert sync_errors(driver.read_buffer(N_of_channels = 4, N_of_points = 10), 4) > 0
+    driver.resync(4)
+    assert sync_errors(driver.read_buffer(N_of_channels = 4, N_of_points = 10), 4) == 0
+    assert sync_errors(encode(arange(8).reshape((2, 4)) + 8000), 2) == 0
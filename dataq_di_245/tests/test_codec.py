@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+import pytest
+
+from dataq_di_245.codec import Codec
+from dataq_di_245.recording import Recorder, Reader
+from dataq_di_245.serialization_benchmarks import synthetic_signal
+
+specs = ['raw', 'pack14', 'delta', 'delta+pack14', 'zlib:1', 'delta+zlib:1', 'delta+pack14+zlib:6',
+         'delta+lzma:0']
+
+
+@pytest.mark.parametrize('spec', specs)
+def test_round_trip(spec):
+    codec = Codec(spec)
+    extremes = np.array([[-8192, 8191, 0], [8191, -8192, -1], [0, 0, 1]], dtype='int16')
+    noise = np.random.RandomState(0).randint(-8192, 8192, size=(101, 3)).astype('int16')
+    for data in (extremes, noise, synthetic_signal(7, 3), np.zeros((0, 3), dtype='int16')):
+        decoded = codec.decode(codec.encode(data), data.shape[0], 3)
+        assert decoded.dtype == np.int16
+        assert np.array_equal(decoded, data)
+
+
+def test_compression():
+    data = synthetic_signal(10000)
+    assert len(Codec('pack14').encode(data)) == data.nbytes*7//8
+    assert data.nbytes/len(Codec('delta+zlib:1').encode(data)) > 2
+    with pytest.raises(ValueError):
+        Codec('delta+gzip')
+
+
+def test_compressed_recording(tmp_path):
+    filename = str(tmp_path / 'data.di245')
+    data = synthetic_signal(1000)
+    with Recorder(filename, codec='delta+zlib:1') as recorder:
+        recorder.write(data[:400], sequence=0, t=0.0, rate=1000.0)
+        recorder.write(data[400:], sequence=400, t=0.4, rate=1000.0)
+    with Reader(filename) as reader:
+        assert reader.header['codec'] == 'delta+zlib:1'
+        assert np.array_equal(reader.read(), data)
+        assert np.array_equal(reader.read_points(390, 410), data[390:410])
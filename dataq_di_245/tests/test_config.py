@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+import pytest
+
+from dataq_di_245.cache import config_hash
+from dataq_di_245.config import ScanConfig
+from dataq_di_245.conversion import to_units
+from dataq_di_245.emulator import EmulatedDriver
+
+
+def test_commands_and_tables():
+    config = ScanConfig(['0', '1', '2', '3'], ['0', '3', '1', '2'], ['5', 'T-thrmc', 'B-thrmc', 'N-thrmc'])
+    assert config.channel_commands == (b'chn 0 2816 \r', b'chn 1 5891 \r', b'chn 2 4097 \r', b'chn 3 5122 \r')
+    assert config.commands[-1] == b'xrate 4099 2000 \r'
+    assert config.frame_size == 8 and config.units == ('V', 'C', 'C', 'C')
+    counts = np.array([[8191, -8192, 0, 100]])
+    assert np.allclose(config.to_units(counts), to_units(counts, list(config.gain_lst)))
+    assert config.digest == config_hash(['0', '1', '2', '3'], ['0', '3', '1', '2'],
+                                        ['5', 'T-thrmc', 'B-thrmc', 'N-thrmc'], b'xrate 4099 2000 \r')
+
+
+def test_immutable_and_hashable():
+    config = ScanConfig(['0', '1'], ['0', '1'], ['5', '5'])
+    same = ScanConfig([0, 1], [b'0', b'1'], ('5', '5'))
+    assert config == same and hash(config) == hash(same) and len({config, same}) == 1
+    assert config != ScanConfig(['0', '1'], ['0', '1'], ['5', '10'])
+    with pytest.raises(AttributeError):
+        config.gain_lst = ('10', '10')
+    with pytest.raises(ValueError):
+        config.slope[0] = 1.0
+
+
+@pytest.mark.parametrize('scan_lst, phys_ch_lst, gain_lst', [
+    ([], [], []),
+    (['0', '1'], ['0'], ['5', '5']),
+    (['0', '0'], ['0', '1'], ['5', '5']),
+    (['0'], ['4'], ['5']),
+    (['0'], ['0'], ['7']),
+    (['x'], ['0'], ['5']),
+])
+def test_invalid_configurations(scan_lst, phys_ch_lst, gain_lst):
+    with pytest.raises(ValueError):
+        ScanConfig(scan_lst, phys_ch_lst, gain_lst)
+
+
+def test_driver_configures_thermocouples():
+    "B, E, J and K thermocouples are configured like the other gains."
+    driver = EmulatedDriver()
+    driver.port = driver.use_com_port()
+    success, result = driver.config_channels(scan_lst=['0', '1', '2', '3'], phys_ch_lst=['0', '1', '2', '3'],
+                                             gain_lst=['B-thrmc', 'E-thrmc', 'J-thrmc', 'K-thrmc'])
+    assert success == 1 and result == [True]*5
+    assert driver.scan_config.gain_lst == ('B-thrmc', 'E-thrmc', 'J-thrmc', 'K-thrmc')
+    with pytest.raises(ValueError):
+        driver.config_channels(scan_lst=['0'], phys_ch_lst=['0'], gain_lst=['X-thrmc'])
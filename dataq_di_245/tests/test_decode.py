@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from io import BytesIO
+
+import numpy as np
+
+from dataq_di_245.driver import Driver, decode, encode
+
+
+def test_decode_matches_read_number():
+    "Vectorized decode gives the same values as the legacy read_number."
+    values = np.random.RandomState(1).randint(0, 2**14, size=(4, 200))
+    raw = encode(values)
+    driver = Driver()
+    driver.port = BytesIO(raw)
+    legacy = driver.read_number(N_of_channels=4, N_of_points=200)
+    assert np.array_equal(decode(raw, N_of_channels=4, N_of_points=200), legacy)
+    assert np.array_equal(driver.convert_buffer_to_array(raw, N_of_channels=4, N_of_points=200), values)
+
+
+def test_encode_sets_sync_bits():
+    "Only the first member of the scan list has the sync bit cleared."
+    words = np.frombuffer(encode(np.zeros((3, 5), dtype='int16')), dtype='<u2').reshape((5, 3))
+    assert (words[:, 0] & 1 == 0).all()
+    assert (words[:, 1:] & 1 == 1).all()
+    assert (words & 0x100 == 0x100).all()
+
+
+def test_to_units():
+    from dataq_di_245.conversion import to_units
+    counts = np.array([[8191, -8192], [0, 0]])
+    result = to_units(counts, ['5', 'T-thrmc'])
+    assert np.allclose(result[0], [5.0*8191/8192, 0.009155*-8192 + 100])
+    assert np.allclose(result[1], [0.0, 100.0])
+
+
+def test_benchmarks_run():
+    from dataq_di_245.serialization_benchmarks import run_all
+    results = run_all(sizes=[10], repeat=1)
+    names = [r['name'] for r in results['results']]
+    assert 'decode.vectorized' in names
+    assert 'serialization.msgpack.dumps' in names
+    assert all(r['samples_per_second'] > 0 for r in results['results'])
+
+
+def test_decode_into_reuses_output():
+    from dataq_di_245.driver import decode_into
+    values = np.random.RandomState(2).randint(0, 2**14, size=(4, 50))
+    out = np.zeros((100, 4), dtype='int16')
+    result = decode_into(encode(values), out)
+    assert result.base is out or result.base is out.base
+    assert np.array_equal(result, values.T - 8192)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+import pytest
+
+from dataq_di_245.derived import DerivedChannels
+
+
+def test_default_definitions_match_relative_humidity():
+    "The default definitions reproduce the hand coded relative humidity rig, per sample."
+    from dataq_di_245.device import Device
+    counts = np.random.RandomState(0).randint(1000, 8000, size=(50, 4)).astype('int16')
+    derived = DerivedChannels(N_of_channels=4, buffer_size=100)
+    result = derived.evaluate(counts, store=True)
+    Vs = counts[:, 0]*10.0/2**13
+    Vo = counts[:, 1]*5.0/2**13
+    T1 = counts[:, 2]*0.036621 + 100
+    T2 = counts[:, 3]*0.036621 + 100
+    assert np.allclose(result['RH'], Device.relative_humidity(None, Vs, Vo, T1, T2))
+    assert derived.names == ['TEMP_TOP', 'TEMP_BOTTOM', 'RH', 'VS', 'VO']
+    assert np.allclose(derived.buffer.get_last_N(50)[:, 2], result['RH'])
+
+
+def test_units_and_functions():
+    derived = DerivedChannels([['P', 'V**2/50'], ['V', 'u0'], ['M', 'maximum(ch1, 0)']],
+                              N_of_channels=2, gain_lst=['10', '5'])
+    result = derived.evaluate(np.array([[4096, -5], [-8192, 7]]))
+    assert np.allclose(result['V'], [5.0, -10.0])
+    assert np.allclose(result['P'], [0.5, 2.0])
+    assert np.allclose(result['M'], [0, 7])
+
+
+@pytest.mark.parametrize('definitions', [
+    [['X', '__import__("os")']],
+    [['X', 'ch0.real']],
+    [['X', 'Y'], ['Y', 'X']],
+    [['X', 'ch4']],
+    [['ch0', '1']],
+])
+def test_invalid_definitions(definitions):
+    with pytest.raises(ValueError):
+        DerivedChannels(definitions, N_of_channels=4)
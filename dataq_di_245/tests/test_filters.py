@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+import pytest
+
+from dataq_di_245.filters import FilterChain, FIRDecimator, MovingAverage, SOSFilter, butterworth_sos
+
+
+def reference_sos(sos, x):
+    "Sample by sample transposed direct form II, started from rest at the first sample value."
+    y = x.astype('float64')
+    for b0, b1, b2, a0, a1, a2 in sos:
+        out = np.zeros_like(y)
+        z1, z2 = [state*y[0] for state in np.linalg.solve(np.array([[1 + a1, -1.0], [a2, 1.0]]),
+                                                          [b1 - a1*b0, b2 - a2*b0])]
+        for n in range(y.shape[0]):
+            out[n] = b0*y[n] + z1
+            z1, z2 = b1*y[n] - a1*out[n] + z2, b2*y[n] - a2*out[n]
+        y = out
+    return y
+
+
+def chunks(x, size):
+    return [x[i:i + size] for i in range(0, x.shape[0], size)]
+
+
+@pytest.mark.parametrize('packet_length', [1, 7, 64])
+def test_sos_matches_sample_loop(packet_length):
+    x = (np.random.RandomState(0).randn(200, 3)*1000).astype('int16')
+    sos = butterworth_sos(3, 0.1)
+    f = SOSFilter(sos)
+    y = np.concatenate([f.process(packet) for packet in chunks(x, packet_length)])
+    assert np.allclose(y, reference_sos(sos, x), atol=1e-8)
+
+
+def test_butterworth_response():
+    def gain(sos, w):
+        z = np.exp(1j*w)
+        return abs(np.prod([(b0 + b1/z + b2/z**2)/(a0 + a1/z + a2/z**2) for b0, b1, b2, a0, a1, a2 in sos]))
+    assert gain(butterworth_sos(4, 0.2), 1e-9) == pytest.approx(1.0)
+    assert gain(butterworth_sos(4, 0.2), 0.2*np.pi) == pytest.approx(2**-0.5)
+    assert gain(butterworth_sos(5, 0.2, 'highpass'), 0.2*np.pi) == pytest.approx(2**-0.5)
+
+
+def test_no_transients_at_packet_boundaries():
+    "Filtering packet by packet gives the same output as filtering the whole stream."
+    x = (np.random.RandomState(1).randn(1000, 2)*500).astype('int16')
+    definitions = [{'type': 'moving_average', 'length': 5}, {'type': 'lowpass', 'order': 2, 'cutoff': 0.2},
+                   {'type': 'fir_decimator', 'factor': 10}]
+    whole = FilterChain(definitions).process(x)
+    chain = FilterChain(definitions)
+    assert chain.factor == 10
+    pieces = np.concatenate([chain.process(packet) for packet in chunks(x, 37)])
+    assert whole.shape == (100, 2)
+    assert np.allclose(pieces, whole)
+
+
+def test_decimation_raises_resolution():
+    "Averaging a noisy constant recovers it to a fraction of a count."
+    x = np.round(1234.3 + np.random.RandomState(2).randn(20000, 1)*3).astype('int16')
+    y = FilterChain([FIRDecimator(100), MovingAverage(20)]).process(x)
+    assert abs(y[-1, 0] - 1234.3) < 0.2
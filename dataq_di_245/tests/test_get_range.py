@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep
+
+import numpy as np
+
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+from dataq_di_245.recording import Archive, Reader
+
+
+def new_device(tmp_path):
+    device = Device()
+    assert device.init('EMU1', driver=EmulatedDriver('EMU1', rate=1000), publisher=LocalPublisher(),
+                       cache=DeviceCache(str(tmp_path)))
+    return device
+
+
+def test_get_range_reads_the_ring(tmp_path):
+    device = new_device(tmp_path)
+    device.start()
+    sleep(0.5)
+    device.stop()
+    timebase = device.timebase
+    t0, t1 = timebase.time_of(100), timebase.time_of(299)
+    data = device.get_range(t0, t1)
+    assert data.shape == (200, 4)
+    assert not np.shares_memory(data, device.buffer.buffer)
+    assert np.array_equal(data, device.buffer.buffer[100:300])
+    volts = device.get_range(t0, t1, channels=[1, 3], units=True)
+    assert np.allclose(volts, data[:, [1, 3]]*5.0/2**13)
+    assert device.get_range(t0, t1, channels=2).shape == (200,)
+
+
+def test_get_range_falls_back_to_recordings(tmp_path):
+    "Data that has left the ring is read from the archive, the result is seamless."
+    device = new_device(tmp_path)
+    device.archive = Archive(str(tmp_path / 'archive'), 'EMU1')
+    from dataq_di_245.ring import RingBuffer
+    device.buffer = RingBuffer(shape=(300, 4), dtype='int16')
+    device.subscriptions.buffer = device.buffer
+    device.start()
+    sleep(1.0)
+    device.stop()
+    assert device.buffer.g_pointer > 600
+    with Reader(device.archive.filenames[0]) as reader:
+        recorded = reader.read()
+    assert recorded.shape[0] == device.buffer.g_pointer + 1
+    t0 = device.timebase.time_of(0)
+    t1 = device.timebase.time_of(device.buffer.g_pointer)
+    data = device.get_range(t0, t1)
+    assert data.shape[0] == device.buffer.g_pointer + 1
+    assert np.array_equal(data, recorded)
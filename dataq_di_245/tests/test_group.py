@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep
+
+import numpy as np
+
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.group import DeviceGroup
+from dataq_di_245.publisher import LocalPublisher
+
+
+def test_group_alignment(tmp_path):
+    "Two emulated devices started together produce the same signal on a common time grid."
+    group = DeviceGroup(serial_numbers=['EMU1', 'EMU2'], publisher=LocalPublisher(),
+                        cache=DeviceCache(str(tmp_path)),
+                        driver_factory=lambda serial_number: EmulatedDriver(serial_number, rate=1000))
+    assert group.init()
+    group.start()
+    sleep(0.5)
+    t, data = group.get_last_N(200)
+    group.stop()
+    assert group.start_spread < 0.05
+    assert data.shape == (200, 8)
+    assert group.channels[4] == ('EMU2', 0)
+    assert np.all(np.diff(t) > 0)
+    # 1 Hz sine of 4000 counts amplitude on channel 0: slope is at most 25 counts per ms
+    assert np.abs(data[:, 0] - data[:, 4]).mean() < 0.05*4000
+    assert 'NIH:DI245:EMU1:RH' in group.publisher.values or 'NIH:DI245:EMU2:RH' in group.publisher.values
+
+
+def test_parallel_init_report(tmp_path):
+    "A failing device is reported and does not prevent the others from initializing concurrently."
+    def driver_factory(serial_number):
+        if serial_number == 'BAD':
+            raise IOError('port busy')
+        return EmulatedDriver(serial_number, rate=1000, read_timeout=1.0)
+    group = DeviceGroup(serial_numbers=['EMU1', 'EMU2', 'EMU3', 'BAD'], driver_factory=driver_factory,
+                        publisher=LocalPublisher(), cache=DeviceCache(str(tmp_path)))
+    assert not group.init()
+    assert [device.serial_number for device in group.devices] == ['EMU1', 'EMU2', 'EMU3']
+    results = group.report['devices']
+    assert results[3]['error'] == "OSError('port busy')"
+    assert all(result['timing']['driver.init'] > 0.3 for result in results[:3])
+    assert group.report['duration'] < 0.6*group.report['sequential_duration']
+    assert 'FAILED' in group.format_report()
+
+
+def test_devices_created_in_calling_thread(tmp_path):
+    "Only the initialization runs in the pool; Device objects (settings writes) are created one by one."
+    from threading import current_thread
+    threads = []
+
+    class Group(DeviceGroup):
+        def _new_device(self, serial_number):
+            threads.append(current_thread())
+            return DeviceGroup._new_device(self, serial_number)
+    group = Group(serial_numbers=['EMU1', 'EMU2', 'EMU3'], publisher=LocalPublisher(),
+                  cache=DeviceCache(str(tmp_path)),
+                  driver_factory=lambda serial_number: EmulatedDriver(serial_number, rate=1000))
+    assert group.init()
+    assert threads == [current_thread()]*3
+    assert group.rate is None
+    group.start()
+    sleep(0.5)
+    group.stop()
+    assert abs(group.rate - 1000) < 200
+    device = group.devices[1]
+    last = device.buffer.g_pointer
+    t = device.timebase.time_of(np.arange(last - 9, last + 1))
+    data = group.get_range(t, method='nearest')
+    assert np.array_equal(data[:, 4:8], device.buffer.read(10, last))
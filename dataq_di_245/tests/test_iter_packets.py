@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+import pytest
+
+from dataq_di_245.emulator import EmulatedDriver
+
+
+def new_driver(**kwargs):
+    driver = EmulatedDriver(**kwargs)
+    driver.port = driver.use_com_port()
+    driver.config_channels(scan_lst=['0', '1'], phys_ch_lst=['0', '1'], gain_lst=['5', '5'])
+    return driver
+
+
+def test_iter_packets_views_and_copies():
+    "Packets are views into one reusable array unless copy is requested; the scan is stopped on close."
+    driver = new_driver()
+    packets = driver.iter_packets(20)
+    first = next(packets)
+    second = next(packets)
+    assert first.shape == (20, 2) and first.dtype == np.int16
+    assert np.shares_memory(first, second)
+    assert driver.port.scanning
+    packets.close()
+    assert not driver.port.scanning
+    copies = list(zip(range(3), driver.iter_packets(20, copy=True)))
+    assert not np.shares_memory(copies[0][1], copies[1][1])
+    assert (np.abs(np.concatenate([packet for i, packet in copies])) < 8192).all()
+
+
+def test_iter_packets_max_latency():
+    "With max_latency the available scans are delivered before a full packet has accumulated."
+    driver = new_driver(rate=200)
+    packets = driver.iter_packets(1000, max_latency=0.05)
+    sizes = [next(packets).shape[0] for i in range(5)]
+    packets.close()
+    assert max(sizes) < 100
+    assert driver.stream_stats.scans == sum(sizes)
+
+
+def test_iter_packets_resync():
+    "Lost bytes drop the packet, the stream is realigned and counted in stream_stats."
+    driver = new_driver()
+    packets = driver.iter_packets(10)
+    next(packets)
+    driver.port.read(1)
+    for i in range(5):
+        next(packets)
+    packets.close()
+    assert driver.stream_stats.sync_errors == 1
+    assert driver.stream_stats.dropped == 10
+
+
+def test_packet_sizer_operating_point():
+    from dataq_di_245.driver import PacketSizer
+    sizer = PacketSizer(latency=0.05, max_rate=100.0, interval=0.1)
+    t = 0.0
+    for i in range(20):
+        sizer.update(arrived=int(8000*t), t=t)
+        t += 0.1
+    assert sizer.points == 128
+    assert sizer.next(waiting=127) == 0
+    assert sizer.next(waiting=200) == 128
+    assert sizer.next(waiting=300) == 256
+    point = sizer.operating_point()
+    assert point['catch_up'] == 1 and abs(point['packets_per_second'] - 62.5) < 1
+    slow = PacketSizer(latency=0.05, max_rate=100.0, interval=0.1)
+    for i in range(20):
+        slow.update(arrived=i, t=float(i))
+    assert slow.points == 1
+
+
+@pytest.mark.parametrize('rate', [150, 1000, 3000, 8000, 12800, 100000])
+def test_packet_sizer_rate_bound(rate):
+    "Without a binding latency the packet rate never exceeds max_rate."
+    from dataq_di_245.driver import PacketSizer
+    sizer = PacketSizer(latency=1.0, max_rate=100.0, interval=0, max_points=2**20)
+    for i in range(2):
+        sizer.update(arrived=rate*i, t=float(i))
+    assert sizer.operating_point()['packets_per_second'] <= 100.0
+    assert sizer.points == 1 or rate/(sizer.points//2) > 100.0
+
+
+def test_packet_sizer_latency_bound():
+    "If the latency is the binding limit, the packet never takes longer than latency to fill."
+    from dataq_di_245.driver import PacketSizer
+    sizer = PacketSizer(latency=0.005, max_rate=100.0, interval=0.1)
+    t = 0.0
+    for i in range(20):
+        sizer.update(arrived=int(1500*t), t=t)
+        t += 0.1
+    assert sizer.points == 4
+    assert sizer.points/sizer.rate <= 0.005
+
+
+def test_iter_packets_adapts_to_rate(capsysbinary):
+    from dataq_di_245.cli import main
+    from dataq_di_245.driver import PacketSizer
+    driver = EmulatedDriver(rate=2000)
+    driver.port = driver.use_com_port()
+    sizer = PacketSizer(latency=0.05, max_rate=100.0, initial_points=1)
+    N = 0
+    for packet in driver.iter_packets(N_of_channels=4, duration=1.0, sizer=sizer):
+        N += packet.shape[0]
+    assert sizer.points in (16, 32)
+    assert abs(sizer.rate - 2000) < 300
+    assert driver.stream_stats.scans == N and driver.stream_stats.dropped == 0
+    main(['stream', '--emulator', '--emulator-rate', '1000', '--no-cache', '--points', 'auto', '--duration', '0.5',
+          '--format', 'raw'])
+    assert b'packets/s' in capsysbinary.readouterr().err
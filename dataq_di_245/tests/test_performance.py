@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Performance regression tests. Every entry in performance_baselines.json names
+a benchmark from dataq_di_245.serialization_benchmarks and a packet length,
+together with the baseline throughput (samples per second) and, for the
+emulator driven pipeline, the 95th percentile per-packet latency.
+
+A test fails if the throughput drops below baseline/(1+tolerance) or the
+latency rises above baseline*(1+tolerance). The tolerance is stored in the
+file and can be overridden with the DI245_PERF_TOLERANCE environment variable.
+
+The baselines are absolute values of one host, so these tests are opt-in (see
+conftest.py at the top of the repository); test_import_is_lightweight is not
+a timing test and always runs:
+
+    pytest --performance                run them, also DI245_PERFORMANCE=1
+    pytest --update-baselines           store the values measured on this host
+"""
+import json
+import os
+
+import pytest
+
+from dataq_di_245.serialization_benchmarks import benchmarks
+
+baselines_file = os.path.join(os.path.dirname(__file__), 'performance_baselines.json')
+
+with open(baselines_file) as f:
+    baselines = json.load(f)
+
+
+def measure(key):
+    "Run the benchmark behind key, e.g. 'pipeline.emulator[10]', and return its record."
+    name, N = key[:-1].split('[')
+    results = benchmarks[name.split('.')[0]](sizes=[int(N)], repeat=3)
+    return [r for r in results if r['name'] == name][0]
+
+
+@pytest.fixture(scope='module')
+def update(request):
+    flag = request.config.getoption('--update-baselines', default=False)
+    yield flag
+    if flag:
+        with open(baselines_file, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+            f.write('\n')
+
+
+@pytest.mark.performance
+@pytest.mark.parametrize('key', sorted(baselines['benchmarks']))
+def test_performance(key, update):
+    baseline = baselines['benchmarks'][key]
+    tolerance = float(os.environ.get('DI245_PERF_TOLERANCE', baseline.get('tolerance', baselines['tolerance'])))
+    result = measure(key)
+    measured = {'samples_per_second': result['samples_per_second']}
+    if 'latency_p95' in baseline:
+        measured['latency_p95'] = result['params']['latency_p95']
+    if update:
+        baseline.update(measured)
+        return
+    assert measured['samples_per_second'] >= baseline['samples_per_second']/(1 + tolerance), \
+        '{} throughput regression: {:.3g} samples/s, baseline {:.3g}'.format(
+            key, measured['samples_per_second'], baseline['samples_per_second'])
+    if 'latency_p95' in baseline:
+        assert measured['latency_p95'] <= baseline['latency_p95']*(1 + tolerance), \
+            '{} latency regression: {:.3g} s, baseline {:.3g}'.format(
+                key, measured['latency_p95'], baseline['latency_p95'])
+
+
+def test_import_is_lightweight():
+    "Importing the package modules must not load NumPy, pyserial, YAML or the settings DataBase."
+    for result in benchmarks['import'](repeat=1):
+        assert result['params']['heavy_modules'] == [], result['name']
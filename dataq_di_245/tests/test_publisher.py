@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep
+
+from dataq_di_245.publisher import PublishingStage, LocalPublisher
+
+
+def test_coalescing_and_rate_limit():
+    "Updates faster than max_rate are coalesced, the latest value wins."
+    stage = PublishingStage(LocalPublisher(), prefix='TEST', pvs={'RH': {'max_rate': 5.0}})
+    stage.update('RH', 1.0)
+    stage.publish_once()
+    for value in range(2, 100):
+        stage.update('RH', float(value))
+        stage.publish_once()
+    assert stage.publisher.history[0][1:] == ('TEST:RH', 1.0)
+    assert len(stage.publisher.history) == 1
+    sleep(0.25)
+    stage.publish_once()
+    assert stage.publisher.values == {'TEST:RH': 99.0}
+    assert len(stage.publisher.history) == 2
+
+
+def test_deadband():
+    stage = PublishingStage(LocalPublisher(), pvs={'T': {'max_rate': 0, 'deadband': 0.5}})
+    for value in [20.0, 20.2, 20.4, 20.6, 20.7]:
+        stage.update('T', value)
+        stage.publish_once()
+    assert [h[2] for h in stage.publisher.history] == [20.0, 20.6]
+
+
+def test_thread():
+    stage = PublishingStage(LocalPublisher(), prefix='TEST', pvs={'A': {}, 'B': {}})
+    stage.start()
+    stage.update('A', 1)
+    stage.update('B', 2)
+    stage.update('C', 3)
+    sleep(0.1)
+    stage.stop()
+    assert stage.publisher.values == {'TEST:A': 1, 'TEST:B': 2}
+
+
+def test_waveform_decimation():
+    "Waveforms hold block means of the newest samples and only new samples are read."
+    import numpy as np
+    from circular_buffer_numpy.circular_buffer import CircularBuffer
+    from dataq_di_245.publisher import WaveformStage
+    buffer = CircularBuffer(shape=(100, 2), dtype='int16')
+    stage = WaveformStage(LocalPublisher(), buffer, prefix='TEST', length=5, decimation=4)
+    data = np.arange(180).reshape((90, 2)).astype('int16')
+    buffer.append(data[:10])
+    stage.publish_once()
+    assert np.allclose(stage.publisher.values['TEST:CH0_WF'], [3, 11])
+    buffer.append(data[10:90])
+    stage.publish_once()
+    waveform = stage.publisher.values['TEST:CH1_WF']
+    assert np.allclose(waveform, data[68:88, 1].reshape((5, 4)).mean(axis=1))
+    assert stage.g_pointer == 87
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep
+
+import numpy as np
+
+from dataq_di_245 import quality
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+from dataq_di_245.quality import QualityMonitor, clip_mask
+from dataq_di_245.ring import RingBuffer
+from dataq_di_245.subscriptions import Subscriptions
+
+
+def test_clip_mask():
+    counts = np.array([[-8192, 8191, 0], [-8191, 8190, -1], [-8180, 8180, 1]], dtype='int16')
+    assert clip_mask(counts).tolist() == [[True, True, False], [False, False, False], [False, False, False]]
+    assert clip_mask(counts, margin=1).sum() == 4
+    assert clip_mask(counts.astype('int64'), margin=12).sum() == 6
+
+
+def test_monitor_flags_blocks_and_windows():
+    monitor = QualityMonitor(N_of_channels=3, length=100)
+    buffer = RingBuffer(shape=(100, 3), dtype='int16')
+    subscriptions = Subscriptions(buffer, quality=monitor)
+    subscription = subscriptions.subscribe()
+    packets = [np.zeros((10, 3), dtype='int16') for i in range(3)]
+    packets[1][2, 0] = 8191
+    packets[2][:, 2] = -8192
+    flags = []
+    for packet in packets:
+        buffer.append(packet)
+        flags.append(monitor.check(packet))
+        subscriptions.notify(buffer.g_pointer)
+    assert flags == [quality.OK, quality.CLIPPED, quality.CLIPPED | quality.SATURATED]
+    assert monitor.clipped.tolist() == [1, 0, 10] and monitor.bad_blocks == 2
+    assert [subscription.get(0).flags for i in range(3)] == flags
+    flags, counts = monitor.quality_of(0, 11)
+    assert flags == quality.OK and counts.tolist() == [0, 0, 0]
+    flags, counts = monitor.quality_of(12, 29)
+    assert flags == quality.CLIPPED | quality.SATURATED and counts.tolist() == [1, 0, 10]
+    assert quality.describe(flags) == 'CLIPPED|SATURATED'
+    subscriptions.stop()
+
+
+def test_follow_restored_buffer():
+    buffer = RingBuffer(shape=(10, 2), dtype='int16')
+    data = np.zeros((25, 2), dtype='int16')
+    data[20, 1] = 8191
+    buffer.append(data)
+    monitor = QualityMonitor(N_of_channels=2, length=10)
+    monitor.follow(buffer)
+    assert monitor.buffer.g_pointer == buffer.g_pointer and monitor.clipped.tolist() == [0, 0]
+    assert monitor.mask_of(20, 20).tolist() == [[False, True]]
+
+
+def test_device_publishes_quality(tmp_path):
+    def voltage(t, N_of_channels):
+        return np.array([0.0, 9.0, 0.0, 0.0])[:N_of_channels, None]*np.ones_like(t)
+
+    QualityDevice = type('QualityDevice', (Device,), {'gain_lst': ['5', '5', '5', '5']})
+    device = QualityDevice()
+    publisher = LocalPublisher()
+    assert device.init('EMU1', driver=EmulatedDriver('EMU1', rate=1000, voltage=voltage), publisher=publisher,
+                       cache=DeviceCache(str(tmp_path)))
+    subscription = device.subscribe(samples=100)
+    device.start()
+    sleep(0.5)
+    device.stop()
+    clipped = device.quality_monitor.clipped
+    assert clipped[1] == device.buffer.g_pointer + 1 and clipped[[0, 2, 3]].tolist() == [0, 0, 0]
+    assert publisher.values['NIH:DI245:QUALITY'] == quality.CLIPPED | quality.SATURATED
+    assert publisher.values['NIH:DI245:CLIPPED'][1] > 0
+    notification = subscription.get(0)
+    assert notification.flags == quality.CLIPPED | quality.SATURATED
+    assert notification.clipped.tolist() == [0, notification.N, 0, 0]
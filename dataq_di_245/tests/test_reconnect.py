@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep
+
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+
+
+def test_reconnect_marks_gap(tmp_path):
+    "After the USB link drops the device is reopened and the gap is recorded in the timebase."
+    device = Device()
+    driver = EmulatedDriver('EMU1', rate=1000)
+    cache = DeviceCache(str(tmp_path))
+    assert device.init('EMU1', driver=driver, publisher=LocalPublisher(), cache=cache)
+    device.start()
+    sleep(0.3)
+    driver.unplug()
+    sleep(0.2)
+    lost_at = device.buffer.g_pointer
+    assert cache.get_config_hash('EMU1') is None
+    sleep(0.5)
+    driver.replug()
+    sleep(1.0)
+    device.stop()
+    assert device.buffer.g_pointer > lost_at + 200
+    assert len(device.timebase.gaps) == 1
+    gap = device.timebase.gaps[0]
+    assert gap.index == lost_at + 1
+    assert 0.6 < gap.gap < 2.0
+    assert abs(gap.missed - gap.gap*1000) < 50
+    assert device.timebase.sequence_of(gap.index) == gap.index + gap.missed
+    assert cache.get_config_hash('EMU1') is not None
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from time import sleep, time
+
+import numpy as np
+
+from dataq_di_245.cli import main
+from dataq_di_245.driver import decode
+from dataq_di_245.recording import Recorder, Reader
+from dataq_di_245.replay import ReplayDriver, replay_device
+from dataq_di_245.serialization_benchmarks import synthetic_signal
+
+
+def new_recording(filename, data, chunk=500, codec='delta+zlib:1'):
+    scan_lst = ['0', '1', '2', '3']
+    with Recorder(filename, N_of_channels=4, serial_number='REC1', scan_lst=scan_lst, phys_ch_lst=scan_lst,
+                  gain_lst=['5', '5', '2.5', 'T-thrmc'], codec=codec) as recorder:
+        for i in range(0, data.shape[0], chunk):
+            recorder.write(data[i:i + chunk], sequence=i, t=i/1000.0, rate=1000.0)
+
+
+def test_driver_replays_recording(tmp_path):
+    filename = str(tmp_path / 'data.di245')
+    data = synthetic_signal(3000)
+    new_recording(filename, data)
+    driver = ReplayDriver([filename, filename], speed=None)
+    assert driver.init() and driver.serial_number == 'REC1'
+    driver.config_channels(scan_lst=['0', '1', '2', '3'], phys_ch_lst=['0', '1', '2', '3'],
+                           gain_lst=['5', '5', '2.5', 'T-thrmc'])
+    packets = list(driver.iter_packets(100, copy=True, abort=lambda: driver.finished))
+    assert np.array_equal(np.concatenate(packets), np.concatenate([data, data]))
+    assert driver.stream_stats.dropped == 0
+
+
+def test_replay_speed(tmp_path):
+    filename = str(tmp_path / 'data.di245')
+    new_recording(filename, synthetic_signal(2000))
+    driver = ReplayDriver(filename, speed=10.0)
+    assert driver.init()
+    t = time()
+    scans = sum(packet.shape[0] for packet in driver.iter_packets(100, abort=lambda: driver.finished))
+    assert scans == 2000
+    assert 0.15 < time() - t < 1.0
+
+
+def test_cli_replays_raw_stream(tmp_path, capsysbinary):
+    main(['stream', '--emulator', '--no-cache', '--points', '10', '--duration', '0.2', '--format', 'raw'])
+    raw = capsysbinary.readouterr().out
+    filename = str(tmp_path / 'stream.raw')
+    with open(filename, 'wb') as f:
+        f.write(raw)
+    main(['stream', '--replay', filename, '--rate', '1000', '--speed', '0', '--no-cache', '--points', '10',
+          '--format', 'binary'])
+    counts = np.frombuffer(capsysbinary.readouterr().out, dtype='<i2').reshape(-1, 4)
+    assert counts.shape[0] == len(raw)//8
+    assert np.array_equal(counts, decode(raw, 4).T - 8192)
+
+
+def test_device_pipeline_runs_unchanged(tmp_path):
+    "The buffer, quality, publishers and the archive see the recorded samples."
+    filename = str(tmp_path / 'data.di245')
+    data = synthetic_signal(4000)
+    data[1000:1100, 2] = 8191
+    new_recording(filename, data)
+    device = replay_device(filename, speed=None, packet_length=100, packet_sizing={}, buffer_size=10000,
+                           archive_directory=str(tmp_path / 'archive'))
+    assert device.gain_lst == ['5', '5', '2.5', 'T-thrmc']
+    device.start()
+    while not device.driver.finished:
+        sleep(0.01)
+    device.stop()
+    assert device.buffer.g_pointer == 3999
+    assert np.array_equal(device.buffer.buffer[:4000], data)
+    assert device.quality_monitor.clipped.tolist() == [0, 0, 100, 0]
+    assert 'NIH:DI245:TEMP_TOP' in device.publishing.publisher.values
+    with Reader(device.archive.filename) as reader:
+        assert np.array_equal(reader.read(), data)
+        assert reader.header['gain_lst'] == device.gain_lst
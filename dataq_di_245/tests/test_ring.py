@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from threading import Thread
+from time import sleep
+
+import numpy as np
+import pytest
+
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+from dataq_di_245.ring import RingBuffer, PersistentBuffer
+
+
+def test_read_wraps_and_validates():
+    buffer = RingBuffer(shape=(10, 1), dtype='int64')
+    buffer.append(np.arange(25)[:, None])
+    assert buffer.read(4)[:, 0].tolist() == [21, 22, 23, 24]
+    assert buffer.read(10, M=24)[:, 0].tolist() == list(range(15, 25))
+    assert buffer.get_last_N(3)[:, 0].tolist() == [22, 23, 24]
+    with pytest.raises(IndexError):
+        buffer.read(4, M=17)
+    with pytest.raises(IndexError):
+        buffer.read(4, M=25)
+
+
+def test_lapped_reader_retries():
+    "The writer appends a packet while the reader copies, the copy is repeated."
+    buffer = RingBuffer(shape=(10, 1), dtype='int64')
+    buffer.append(np.arange(10)[:, None])
+
+    class Lapping(np.ndarray):
+        def __setitem__(self, key, value):
+            np.ndarray.__setitem__(self, key, value)
+            if buffer.g_pointer < 15:
+                buffer.append(np.arange(10, 16)[:, None])
+
+    out = np.zeros((5, 1), dtype='int64').view(Lapping)
+    assert np.asarray(buffer.read(5, out=out))[:, 0].tolist() == [11, 12, 13, 14, 15]
+    assert buffer.retries == 1
+    buffer.append(np.arange(16, 19)[:, None])
+    with pytest.raises(IndexError):
+        buffer.read(5, M=12, out=out)
+
+
+def test_concurrent_readers_see_consistent_snapshots():
+    buffer = RingBuffer(shape=(1000, 2), dtype='int64')
+    N_of_packets = 20000
+    errors = []
+
+    def write():
+        for i in range(N_of_packets):
+            index = np.arange(i*7, (i + 1)*7)
+            buffer.append(np.stack((index, -index), axis=1))
+
+    def read():
+        while buffer.g_pointer < (N_of_packets - 1)*7:
+            if buffer.g_pointer < 600:
+                continue
+            data = buffer.read(600)
+            if not (np.all(np.diff(data[:, 0]) == 1) and np.array_equal(data[:, 1], -data[:, 0])):
+                errors.append(data)
+
+    threads = [Thread(target=write)] + [Thread(target=read) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert buffer.g_pointer == N_of_packets*7 - 1
+
+
+def test_reopen_keeps_contents(tmp_path):
+    filename = str(tmp_path / 'ring')
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='abc')
+    assert not buffer.restored
+    data = np.arange(30, dtype='int16').reshape(15, 2)
+    buffer.append(data[:7])
+    buffer.append(data[7:])
+    buffer.set_time(14, 100.0, 1000.0)
+    assert np.array_equal(buffer.get_last_N(10), data[5:])
+    del buffer
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='abc')
+    assert buffer.restored
+    assert (buffer.g_pointer, buffer.pointer) == (14, 4)
+    assert np.array_equal(buffer.get_last_N(10), data[5:])
+    assert buffer.last_time == (14, 100.0, 1000.0)
+    buffer.append(data[:1])
+    assert np.array_equal(buffer.get_N_global(N=2, M=15), [[28, 29], [0, 1]])
+
+
+def test_torn_append_is_not_restored(tmp_path):
+    "Slots a crashed append may have overwritten are lost, the rest of the ring is restored."
+    filename = str(tmp_path / 'ring')
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='abc')
+    data = np.arange(30, dtype='int16').reshape(15, 2)
+    buffer.append(data)
+    # the process dies while it writes samples 15..17 into the slots of 5..7
+    buffer.header['reserved'] = 17
+    buffer.buffer[5:7] = -1
+    del buffer
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='abc')
+    assert buffer.restored and buffer.g_pointer == 14 and buffer.oldest == 8
+    assert np.array_equal(buffer.read(7), data[8:])
+    with pytest.raises(IndexError):
+        buffer.read(8, 14)
+    buffer.append(data[:2])
+    assert buffer.oldest == 8 and np.array_equal(buffer.read(9), np.concatenate([data[8:], data[:2]]))
+    buffer.append(data[:2])
+    assert buffer.oldest == 9
+
+
+def test_configuration_mismatch_starts_empty(tmp_path):
+    filename = str(tmp_path / 'ring')
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='abc')
+    buffer.append(np.ones((3, 2), dtype='int16'))
+    del buffer
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='def')
+    assert not buffer.restored
+    assert buffer.g_pointer == -1
+    del buffer
+    assert not PersistentBuffer(filename, shape=(10, 2), config_hash='abc').restored
+    buffer = PersistentBuffer(filename, shape=(10, 2), config_hash='abc')
+    buffer.append(np.ones((3, 2), dtype='int16'))
+    buffer.set_config_hash('ghi')
+    del buffer
+    assert not PersistentBuffer(filename, shape=(10, 2), config_hash='abc').restored
+
+
+def test_device_restart_restores_history(tmp_path):
+    PersistentDevice = type('PersistentDevice', (Device,), {'buffer_file': str(tmp_path / 'DI245.ring'),
+                                                            'buffer_size': 5000})
+
+    def new_device():
+        device = PersistentDevice()
+        assert device.init('EMU1', driver=EmulatedDriver('EMU1', rate=1000), publisher=LocalPublisher(),
+                           cache=DeviceCache(str(tmp_path)))
+        return device
+
+    device = new_device()
+    device.start()
+    sleep(0.5)
+    device.stop()
+    g_pointer = device.buffer.g_pointer
+    history = np.array(device.buffer.get_last_N(g_pointer + 1))
+    t_last = device.timebase.time_of(g_pointer)
+    del device
+
+    device = new_device()
+    assert device.buffer.restored
+    assert device.buffer.g_pointer == g_pointer
+    assert np.array_equal(device.buffer.get_last_N(g_pointer + 1), history)
+    assert abs(device.timebase.time_of(g_pointer) - t_last) < 1e-6
+    device.start()
+    sleep(0.3)
+    device.stop()
+    assert device.buffer.g_pointer > g_pointer
+    assert device.timebase.sequence_of(g_pointer + 1) == g_pointer + 1
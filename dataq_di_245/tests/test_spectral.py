@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+import pytest
+from circular_buffer_numpy.circular_buffer import CircularBuffer
+
+from dataq_di_245.spectral import SpectralMonitor
+
+
+def fill(buffer, signal, packet_length, monitor):
+    for start in range(0, signal.shape[0], packet_length):
+        buffer.append(signal[start:start + packet_length])
+        monitor.update()
+
+
+def test_mains_peak_and_power():
+    "A 60 Hz line shows up at 60 Hz and the integrated PSD equals its power."
+    rate = 1000.0
+    t = np.arange(20000)/rate
+    signal = np.zeros((t.shape[0], 2), dtype='int16')
+    signal[:, 0] = np.round(1000*np.sin(2*np.pi*60*t))
+    signal[:, 1] = np.round(200*np.sin(2*np.pi*125*t) + 50)
+    buffer = CircularBuffer(shape=(5000, 2), dtype='int16')
+    monitor = SpectralMonitor(buffer, segment_length=1000, averages=8, rate=rate)
+    fill(buffer, signal, 100, monitor)
+    frequencies, psd = monitor.get_psd()
+    assert monitor.count == 8 and monitor.skipped == 0
+    assert monitor.peaks(channel=0, N=1)[0][0] == 60.0
+    assert monitor.peaks(channel=1, N=1)[0][0] == 125.0
+    power = psd.sum(axis=0)*(frequencies[1] - frequencies[0])
+    assert power[0] == pytest.approx(1000**2/2, rel=0.05)
+    assert power[1] == pytest.approx(200**2/2, rel=0.05)
+
+
+def test_bounded_work_when_behind():
+    "A monitor that falls behind processes at most max_segments and skips the rest."
+    buffer = CircularBuffer(shape=(4096, 1), dtype='int16')
+    monitor = SpectralMonitor(buffer, segment_length=256, averages=4, rate=100.0)
+    buffer.append(np.random.RandomState(0).randint(-100, 100, size=(4000, 1)).astype('int16'))
+    assert monitor.update() == 4
+    assert monitor.skipped == 26
+    assert monitor.update() == 0
+
+
+def test_units():
+    buffer = CircularBuffer(shape=(4096, 1), dtype='int16')
+    counts = SpectralMonitor(buffer, segment_length=256, rate=100.0)
+    volts = SpectralMonitor(buffer, segment_length=256, rate=100.0, gain_lst=['5'])
+    buffer.append(np.random.RandomState(0).randint(-100, 100, size=(1000, 1)).astype('int16'))
+    counts.update()
+    volts.update()
+    assert np.allclose(volts.get_psd()[1], counts.get_psd()[1]*(5.0/2**13)**2)
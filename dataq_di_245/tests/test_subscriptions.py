@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+from threading import Event
+from time import sleep, time
+
+import numpy as np
+import pytest
+from circular_buffer_numpy.circular_buffer import CircularBuffer
+
+from dataq_di_245.cache import DeviceCache
+from dataq_di_245.device import Device
+from dataq_di_245.emulator import EmulatedDriver
+from dataq_di_245.publisher import LocalPublisher
+from dataq_di_245.subscriptions import Subscriptions
+
+
+def append(buffer, subscriptions, N, t=None):
+    buffer.append(np.zeros((N, 2), dtype='int16'))
+    subscriptions.notify(buffer.g_pointer, t)
+
+
+def test_samples_and_interval_triggers():
+    buffer = CircularBuffer(shape=(1000, 2), dtype='int16')
+    subscriptions = Subscriptions(buffer)
+    by_samples = subscriptions.subscribe(samples=25)
+    by_interval = subscriptions.subscribe(interval=1.0)
+    t0 = time()
+    for i in range(3):
+        append(buffer, subscriptions, 10, t0 + i*0.4)
+    notification = by_samples.get(timeout=0)
+    assert (notification.first, notification.last, notification.N) == (0, 29, 30)
+    assert by_samples.get(timeout=0) is None
+    assert by_interval.get(timeout=0) is None
+    append(buffer, subscriptions, 10, t0 + 1.2)
+    notification = by_interval.get(timeout=0)
+    assert (notification.first, notification.last) == (0, 39)
+    assert notification.data.shape == (40, 2)
+
+
+@pytest.mark.parametrize('policy, expected', [('drop_oldest', (8, 9)), ('drop_newest', (0, 1)),
+                                              ('coalesce', (0, 9))])
+def test_drop_policies(policy, expected):
+    "A full queue drops the oldest or the newest notification, or merges the new samples into the last one."
+    buffer = CircularBuffer(shape=(1000, 2), dtype='int16')
+    subscriptions = Subscriptions(buffer)
+    subscription = subscriptions.subscribe(queue_size=2, policy=policy)
+    for i in range(10):
+        append(buffer, subscriptions, 1)
+    first = subscription.get(timeout=0)
+    last = subscription.get(timeout=0)
+    assert (first.first, last.last) == expected
+    assert subscription.dropped + subscription.coalesced == 8
+    with pytest.raises(ValueError):
+        subscriptions.subscribe(policy='block')
+
+
+def test_slow_callback_does_not_stall_acquisition(tmp_path):
+    "A blocking subscriber drops notifications while the device keeps streaming."
+    release = Event()
+    received = []
+
+    def slow(notification):
+        received.append(notification)
+        release.wait()
+    device = Device()
+    assert device.init('EMU1', driver=EmulatedDriver('EMU1', rate=2000), publisher=LocalPublisher(),
+                       cache=DeviceCache(str(tmp_path)))
+    fast = []
+    fast_subscription = device.subscribe(fast.append, samples=100)
+    slow_subscription = device.subscribe(slow, queue_size=4)
+    device.start()
+    sleep(0.5)
+    pointer = device.buffer.g_pointer
+    release.set()
+    device.stop()
+    assert fast_subscription.thread.is_alive()
+    device.start()
+    sleep(0.2)
+    device.full_stop()
+    assert not device.running and not device.driver.acquiring
+    stopped = device.buffer.g_pointer
+    assert fast_subscription.thread is None and slow_subscription.thread is None
+    assert device.subscriptions.subscriptions == []
+    sleep(0.1)
+    assert device.buffer.g_pointer == stopped
+    assert pointer > 600
+    assert len(fast) >= 5 and all(n.N >= 100 for n in fast)
+    assert slow_subscription.dropped > 0
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+
+from dataq_di_245.timebase import Timebase
+
+
+def test_segments():
+    timebase = Timebase(rate=1000.0)
+    timebase.start(index=0, t=100.0)
+    assert timebase.time_of(500) == 100.5
+    timebase.update(index=1999, t=101.0)
+    assert timebase.rate == 2000.0
+    timebase.start(index=2000, t=200.0)
+    timebase.update(index=2999, t=201.0)
+    assert np.allclose(timebase.time_of(np.array([1000, 2500])), [100.5, 200.5])
+    assert np.allclose(timebase.index_of(np.array([100.5, 200.5])), [1000, 2500])
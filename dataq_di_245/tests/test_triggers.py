@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+import numpy as np
+from circular_buffer_numpy.circular_buffer import CircularBuffer
+
+from dataq_di_245.triggers import EventDetector, LevelTrigger, RateTrigger, EdgeTrigger
+
+
+def run(detector, signal, packet_length):
+    "Feeds (N points x 1) signal to the buffer and the detector packet by packet."
+    events = []
+    for start in range(0, signal.shape[0], packet_length):
+        packet = signal[start:start + packet_length]
+        detector.buffer.append(packet)
+        events += detector.process(packet)
+    return [(event.index, event.kind) for event in events]
+
+
+def test_level_hysteresis_across_packets():
+    "Alarms set and clear once with hysteresis; the result does not depend on the packet length."
+    signal = np.array([0, 5, 11, 9, 11, 7, 5, 0, -11, -9, -20, 0], dtype='int16')[:, None]
+    expected = [(2, 'high'), (6, 'high_clear'), (8, 'low'), (11, 'low_clear')]
+    for packet_length in (1, 3, 12):
+        buffer = CircularBuffer(shape=(100, 1), dtype='int16')
+        detector = EventDetector(buffer, [LevelTrigger(0, high=10, low=-10, hysteresis=4)])
+        assert run(detector, signal, packet_length) == expected
+
+
+def test_rate_trigger_units_per_second():
+    from dataq_di_245.timebase import Timebase
+    signal = np.array([0, 1, 2, 10, 11, 12, 12], dtype='int16')[:, None]
+    buffer = CircularBuffer(shape=(100, 1), dtype='int16')
+    timebase = Timebase(rate=100.0)
+    detector = EventDetector(buffer, [RateTrigger(0, limit=500.0)], timebase=timebase)
+    timebase.start(0, 0.0)
+    assert run(detector, signal, 2) == [(3, 'rate'), (4, 'rate_clear')]
+    assert detector.events[0].time == 0.03
+
+
+def test_edge_capture_window():
+    "Edge events wait for the post-trigger samples and carry the capture window."
+    signal = np.zeros((50, 1), dtype='int16')
+    signal[20:] = 100
+    buffer = CircularBuffer(shape=(100, 1), dtype='int16')
+    detector = EventDetector(buffer, [{'type': 'edge', 'channel': 0, 'level': 50, 'pre': 5, 'post': 10}])
+    events = []
+    for start in range(0, 50, 8):
+        packet = signal[start:start + 8]
+        buffer.append(packet)
+        events += detector.process(packet)
+        if start < 24:
+            assert events == []
+    assert len(events) == 1
+    event = events[0]
+    assert (event.index, event.kind) == (20, 'rising')
+    assert event.capture.shape == (16, 1)
+    assert (event.capture[:5] == 0).all() and (event.capture[5:] == 100).all()
+
+
+def test_edge_both_and_units():
+    signal = (np.sin(np.linspace(0, 4*np.pi, 400))*4000).astype('int16')[:, None]
+    buffer = CircularBuffer(shape=(1000, 1), dtype='int16')
+    detector = EventDetector(buffer, [EdgeTrigger(0, level=0.5, edge='both', hysteresis=0.1)], gain_lst=['5'])
+    kinds = [kind for index, kind in run(detector, signal, 37)]
+    assert kinds == ['rising', 'falling', 'rising', 'falling']
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Timebase: maps linear buffer indices (CircularBuffer.g_pointer counting) to
+wall-clock time and back.
+
+Acquisition is split into segments, one per start of a scan. Within a
+segment samples are equidistant: the time of sample i is
+
+    t = segment.time + (i - segment.index)/segment.rate
+
+The segment rate is measured from the arrival of packets (number of samples
+received over the time since the start), the nominal rate is used until the
+first packet arrives. Lookups are vectorized and find the segment with a
+binary search over the (few) segment starts.
+
+Besides the linear buffer index every sample has a sequence number that also
+counts the samples the device would have produced while the acquisition was
+interrupted (e.g. USB disconnect). mark_gap() starts a new segment after an
+interruption and records the estimated number of missed samples. A segment
+also records the gain list its samples were acquired with, which changes when
+the ranges are switched during a brief stop of the scan (see autorange.py).
+
+Examples
+--------
+>>> timebase = Timebase(rate = 1000.0)
+>>> timebase.start(index = 0, t = 100.0)
+>>> timebase.time_of(500)
+100.5
+>>> timebase.index_of(100.25)
+250.0
+
+Valentyn Stadnytskyi
+"""
+
+
+class Segment(object):
+    """
+    continuous stretch of equidistant samples
+    """
+    def __init__(self, index, time, rate, sequence = None, missed = 0, gap = 0.0, gain_lst = None):
+        self.index = index
+        self.time = time
+        self.rate = rate
+        self.last_index = index - 1
+        self.last_time = time
+        self.sequence = index if sequence is None else sequence
+        self.missed = missed
+        self.gap = gap
+        self.gain_lst = gain_lst
+
+    def __repr__(self):
+        return 'Segment(index={}, time={}, rate={}, last_index={}, sequence={}, missed={})'.format(
+            self.index, self.time, self.rate, self.last_index, self.sequence, self.missed)
+
+
+class Timebase(object):
+    """
+    maps linear sample indices to time and back
+    """
+    def __init__(self, rate = None):
+        """
+        Parameters
+        ----------
+        rate :: float, optional
+            nominal sample rate (scans per second) used until the rate is measured
+        """
+        self.nominal_rate = rate
+        self.segments = []
+
+    def start(self, index, t = None, gain_lst = None):
+        """
+        starts new segment: sample index is acquired at time t, with gain_lst
+        (default is the gain list of the previous segment)
+        """
+        from time import time
+        if t is None:
+            t = time()
+        if len(self.segments) > 0:
+            previous = self.segments[-1]
+            sequence = previous.sequence + index - previous.index
+            rate = previous.rate
+            if gain_lst is None:
+                gain_lst = previous.gain_lst
+        else:
+            sequence = index
+            rate = self.nominal_rate
+        self.segments.append(Segment(index, t, rate, sequence = sequence, gain_lst = gain_lst))
+
+    def resume(self, first, last, t, rate, sequence):
+        """
+        adds the segment of samples first..last restored from a persistent
+        buffer: sample last, with sequence number sequence, was acquired at
+        time t with the given rate
+        """
+        segment = Segment(first, t - (last - first)/rate, rate, sequence = sequence - (last - first))
+        segment.last_index = last
+        segment.last_time = t
+        self.segments.append(segment)
+        return segment
+
+    def mark_gap(self, index, t = None, gain_lst = None):
+        """
+        starts new segment after an interruption of the acquisition: sample
+        index is acquired at time t, with gain_lst if the ranges were changed.
+        The time since the last received sample is converted into the number
+        of missed samples with the rate of the previous segment; the sequence
+        numbers of the new segment skip them.
+
+        Returns
+        -------
+        segment :: Segment
+            the new segment, with gap (seconds) and missed (samples) set
+        """
+        self.start(index, t, gain_lst = gain_lst)
+        segment = self.segments[-1]
+        if len(self.segments) > 1:
+            previous = self.segments[-2]
+            segment.gap = segment.time - self.time_of(previous.last_index)
+            if previous.rate:
+                segment.missed = max(0, int(round(segment.gap*previous.rate)) - 1)
+            segment.sequence += segment.missed
+        return segment
+
+    @property
+    def gaps(self):
+        """
+        list of segments that follow an interruption
+        """
+        return [segment for segment in self.segments if segment.missed > 0 or segment.gap > 0]
+
+    def segments_of(self, index):
+        """
+        returns position(s) in self.segments of the segment(s) of sample(s)
+        with linear index
+        """
+        from numpy import asarray
+        return self._segment_of(asarray(index), 'index')
+
+    def sequence_of(self, index):
+        """
+        returns sequence number(s) of sample(s) with linear index
+        """
+        from numpy import asarray
+        index = asarray(index)
+        i = self._segment_of(index, 'index')
+        result = (asarray([segment.sequence - segment.index for segment in self.segments])[i] + index)
+        if result.ndim == 0:
+            return int(result)
+        return result
+
+    def update(self, index, t):
+        """
+        records arrival of all samples up to index (inclusive) at time t and
+        updates the measured rate of the current segment
+        """
+        segment = self.segments[-1]
+        segment.last_index = index
+        segment.last_time = t
+        if t > segment.time and index >= segment.index:
+            segment.rate = (index - segment.index + 1)/(t - segment.time)
+
+    @property
+    def rate(self):
+        """
+        sample rate of the current segment
+        """
+        if len(self.segments) == 0:
+            return self.nominal_rate
+        return self.segments[-1].rate
+
+    def _segment_of(self, values, key):
+        from numpy import searchsorted, asarray
+        starts = asarray([getattr(segment, key) for segment in self.segments])
+        return (searchsorted(starts, values, side = 'right') - 1).clip(0, None)
+
+    def time_of(self, index):
+        """
+        returns time of sample(s) with linear index
+
+        Parameters
+        ----------
+        index :: integer or numpy.ndarray
+            linear index(es)
+
+        Returns
+        -------
+        time :: float or numpy.ndarray
+        """
+        from numpy import asarray
+        index = asarray(index)
+        i = self._segment_of(index, 'index')
+        t = asarray([segment.time for segment in self.segments])[i]
+        rate = asarray([segment.rate for segment in self.segments], dtype = 'float64')[i]
+        result = t + (index - asarray([segment.index for segment in self.segments])[i])/rate
+        if result.ndim == 0:
+            return float(result)
+        return result
+
+    def index_of(self, t):
+        """
+        returns (fractional) linear index of the sample acquired at time t
+
+        Parameters
+        ----------
+        t :: float or numpy.ndarray
+            time, seconds
+
+        Returns
+        -------
+        index :: float or numpy.ndarray
+        """
+        from numpy import asarray
+        t = asarray(t)
+        i = self._segment_of(t, 'time')
+        start = asarray([segment.time for segment in self.segments])[i]
+        rate = asarray([segment.rate for segment in self.segments], dtype = 'float64')[i]
+        result = asarray([segment.index for segment in self.segments])[i] + (t - start)*rate
+        if result.ndim == 0:
+            return float(result)
+        return result
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+####!/bin/env python
+"""
+Threshold, rate-of-change and edge detection on the decoded stream.
+
+Every packet is evaluated at once with NumPy, so alarms are detected with
+per-sample resolution. The state of every trigger (alarm active, last sample)
+is carried from one packet to the next, events at packet boundaries are
+neither missed nor duplicated.
+
+    LevelTrigger    alarm when a channel goes above high or below low, cleared
+                    only after it comes back by more than the hysteresis
+    RateTrigger     alarm when a channel changes faster than limit units per
+                    second (per sample if the rate is unknown)
+    EdgeTrigger     rising and/or falling crossings of a level, with a capture
+                    window of pre samples before and post samples after the
+                    crossing taken from the buffer
+
+Thresholds are in counts or, if the EventDetector is given gain_lst, in Volts
+and degrees C. Detected events are compact Event records:
+
+    index       global buffer index of the sample
+    channel     scan list member
+    kind        'high', 'high_clear', 'low', 'low_clear', 'rate', 'rate_clear',
+                'rising' or 'falling'
+    value       value of the sample
+    time        time of the sample, if a Timebase is given
+    capture     (pre + 1 + post) x N channels counts, edge triggers only
+
+Triggers are configured with dictionaries (Device.triggers):
+
+    {'type': 'level', 'channel': 0, 'high': 30.0, 'low': 10.0, 'hysteresis': 0.5}
+    {'type': 'rate', 'channel': 2, 'limit': 5.0}
+    {'type': 'edge', 'channel': 1, 'level': 2.5, 'edge': 'rising', 'pre': 100, 'post': 400}
+
+Examples
+--------
+>>> detector = EventDetector(device.buffer, gain_lst = device.active_gain_lst, timebase = device.timebase)
+>>> detector.add(LevelTrigger(0, high = 30.0, hysteresis = 0.5))
+>>> device.buffer.append(packet)
+>>> detector.process(packet)
+[Event(index=10234, channel=0, kind='high', value=30.02)]
+
+Valentyn Stadnytskyi
+"""
+from logging import error
+import traceback
+
+
+class Event(object):
+    """
+    one detected event
+    """
+    __slots__ = ('index', 'channel', 'kind', 'value', 'time', 'capture')
+
+    def __init__(self, index, channel, kind, value, time = None, capture = None):
+        self.index = index
+        self.channel = channel
+        self.kind = kind
+        self.value = value
+        self.time = time
+        self.capture = capture
+
+    def __repr__(self):
+        return 'Event(index={}, channel={}, kind={!r}, value={:.6g})'.format(self.index, self.channel, self.kind,
+                                                                           self.value)
+
+
+def schmitt(values, set_mask, reset_mask, state):
+    """
+    vectorized two-level state machine: the state becomes 1 where set_mask
+    and 0 where reset_mask is True, otherwise it keeps the previous value.
+
+    Parameters
+    ----------
+    values :: numpy.ndarray
+        samples of one channel
+    set_mask, reset_mask :: numpy.ndarray
+        boolean arrays of the shape of values, never both True
+    state :: integer
+        state before the first sample
+
+    Returns
+    -------
+    changes :: numpy.ndarray
+        positions where the state changes
+    states :: numpy.ndarray
+        new state at these positions
+    """
+    from numpy import full, arange, where, maximum, nonzero, concatenate
+    code = full(values.shape[0], -1, dtype = 'int8')
+    code[set_mask] = 1
+    code[reset_mask] = 0
+    last = maximum.accumulate(where(code >= 0, arange(values.shape[0]), -1))
+    states = where(last >= 0, code[last.clip(0, None)], state)
+    changes = nonzero(states != concatenate(([state], states[:-1])))[0]
+    return changes, states[changes]
+
+
+class LevelTrigger(object):
+    def __init__(self, channel, high = None, low = None, hysteresis = 0.0):
+        self.channel = channel
+        self.high = high
+        self.low = low
+        self.hysteresis = hysteresis
+        self.high_state = 0
+        self.low_state = 0
+
+    def detect(self, values, rate = None):
+        """
+        returns list of (position, kind) in the packet
+        """
+        result = []
+        if self.high is not None:
+            changes, states = schmitt(values, values > self.high, values < self.high - self.hysteresis,
+                                      self.high_state)
+            result += [(i, 'high' if s else 'high_clear') for i, s in zip(changes, states)]
+            if len(states):
+                self.high_state = states[-1]
+        if self.low is not None:
+            changes, states = schmitt(values, values < self.low, values > self.low + self.hysteresis,
+                                      self.low_state)
+            result += [(i, 'low' if s else 'low_clear') for i, s in zip(changes, states)]
+            if len(states):
+                self.low_state = states[-1]
+        return result
+
+
+class RateTrigger(object):
+    def __init__(self, channel, limit, hysteresis = 0.0):
+        self.channel = channel
+        self.limit = limit
+        self.hysteresis = hysteresis
+        self.state = 0
+        self.last = None
+
+    def detect(self, values, rate = None):
+        from numpy import diff, concatenate, absolute
+        previous = values[:1] if self.last is None else [self.last]
+        change = absolute(diff(concatenate((previous, values))))
+        if rate:
+            change = change*rate
+        changes, states = schmitt(values, change > self.limit, change <= self.limit - self.hysteresis,
+                                  self.state)
+        self.last = values[-1]
+        if len(states):
+            self.state = states[-1]
+        return [(i, 'rate' if s else 'rate_clear') for i, s in zip(changes, states)]
+
+
+class EdgeTrigger(object):
+    def __init__(self, channel, level, edge = 'rising', hysteresis = 0.0, pre = 0, post = 0):
+        if edge not in ('rising', 'falling', 'both'):
+            raise ValueError('unknown edge {!r}'.format(edge))
+        self.channel = channel
+        self.level = level
+        self.edge = edge
+        self.hysteresis = hysteresis
+        self.pre = pre
+        self.post = post
+        self.state = None
+
+    def detect(self, values, rate = None):
+        if self.state is None:
+            # the first sample defines the initial state, it is not an edge
+            self.state = int(values[0] >= self.level)
+        changes, states = schmitt(values, values >= self.level, values < self.level - self.hysteresis,
+                                  self.state)
+        if len(states):
+            self.state = states[-1]
+        kinds = {1: 'rising', 0: 'falling'}
+        return [(i, kinds[s]) for i, s in zip(changes, states) if self.edge in ('both', kinds[s])]
+
+
+types = {'level': LevelTrigger, 'rate': RateTrigger, 'edge': EdgeTrigger}
+
+
+def from_definition(definition):
+    """
+    returns trigger from a dictionary with 'type' and the keyword arguments of the trigger
+    """
+    definition = dict(definition)
+    kind = definition.pop('type')
+    if kind not in types:
+        raise ValueError('unknown trigger type {!r}'.format(kind))
+    return types[kind](**definition)
+
+
+class EventDetector(object):
+    """
+    evaluates triggers on every packet appended to the buffer
+    """
+    def __init__(self, buffer, triggers = None, gain_lst = None, timebase = None, callback = None, history = 1000):
+        """
+        Parameters
+        ----------
+        buffer :: CircularBuffer
+            (N points x N channels) buffer of counts, e.g. Device.buffer
+        triggers :: list, optional
+            trigger objects or definitions
+        gain_lst :: list, optional
+            gains of the channels, if given thresholds are in Volts/degrees C
+        timebase :: Timebase, optional
+            used to time-stamp events and for the rate of RateTrigger
+        callback :: callable, optional
+            callback(event), called for every event in the acquisition thread
+        history :: integer
+            number of events kept in self.events
+        """
+        from collections import deque
+        self.buffer = buffer
+        self.gain_lst = gain_lst
+        self.timebase = timebase
+        self.callback = callback
+        self.triggers = []
+        self.events = deque(maxlen = history)
+        self.pending = []
+        for trigger in triggers or []:
+            self.add(trigger)
+
+    def add(self, trigger):
+        if isinstance(trigger, dict):
+            trigger = from_definition(trigger)
+        self.triggers.append(trigger)
+        return trigger
+
+    def process(self, value_array, first = None):
+        """
+        detects events in a packet that was just appended to the buffer and
+        completes the captures whose post-trigger window has arrived
+
+        Parameters
+        ----------
+        value_array :: numpy.ndarray
+            (N points x N channels) counts
+        first :: integer, optional
+            global index of the first sample, default is the end of the buffer
+
+        Returns
+        -------
+        events :: list
+            completed events
+        """
+        if first is None:
+            first = self.buffer.g_pointer - value_array.shape[0] + 1
+        if self.gain_lst is not None and len(self.triggers) > 0:
+            from dataq_di_245.conversion import to_units
+            values = to_units(value_array, self.gain_lst)
+        else:
+            values = value_array
+        rate = self.timebase.rate if self.timebase is not None else None
+        found = []
+        for trigger in self.triggers:
+            column = values[:, trigger.channel]
+            for i, kind in trigger.detect(column, rate = rate):
+                event = Event(first + int(i), trigger.channel, kind, float(column[i]))
+                if self.timebase is not None:
+                    event.time = self.timebase.time_of(event.index)
+                if getattr(trigger, 'pre', 0) or getattr(trigger, 'post', 0):
+                    self.pending.append((event, trigger))
+                else:
+                    found.append(event)
+        found += self.capture()
+        found.sort(key = lambda event: event.index)
+        for event in found:
+            self.emit(event)
+        return found
+
+    def capture(self):
+        """
+        returns pending events whose post-trigger samples are in the buffer,
+        with the capture window attached
+        """
+        completed = []
+        waiting = []
+        for event, trigger in self.pending:
+            last = event.index + trigger.post
+            if last <= self.buffer.g_pointer:
+                N = min(trigger.pre + 1 + trigger.post, self.buffer.length, last + 1)
+                event.capture = self.buffer.get_N_global(N = N, M = last).copy()
+                completed.append(event)
+            else:
+                waiting.append((event, trigger))
+        self.pending = waiting
+        return completed
+
+    def emit(self, event):
+        self.events.append(event)
+        if self.callback is not None:
+            try:
+                self.callback(event)
+            except Exception:
+                error(traceback.format_exc())